@@ -1,7 +1,7 @@
 # bot/config.py (финальная, исправленная версия)
 import os
 import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from dotenv import load_dotenv
 from zoneinfo import ZoneInfo
@@ -9,7 +9,7 @@ from zoneinfo import ZoneInfo
 load_dotenv()
 __all__ = [
     "Settings", "get_settings", "Course", "get_course", "COURSES",
-    "tzinfo", "now_utc_str", "local_dt_str", "format_deadline_text"
+    "tzinfo", "now_utc_str", "local_dt_str", "format_deadline_text", "parse_hours_window"
 ]
 
 # <<< Класс для описания курса >>>
@@ -56,6 +56,31 @@ def _parse_admins() -> tuple[int, ...]:
                 ids.add(int(p))
     return tuple(sorted(ids))
 
+def _parse_chat_id(s: str | None) -> int | None:
+    """'-1001234567890' -> int. Пусто/мусор -> None."""
+    s = _clean(s)
+    return int(s) if s.lstrip("-").isdigit() else None
+
+def parse_topics(s: str | None) -> dict[str, int]:
+    """'submissions=3,payments=5' -> {'submissions': 3, 'payments': 5}. Мусорные пары пропускаем."""
+    topics: dict[str, int] = {}
+    for part in _clean(s).split(","):
+        name, _, value = part.partition("=")
+        name, value = name.strip(), value.strip()
+        if name and value.isdigit():
+            topics[name] = int(value)
+    return topics
+
+def parse_hours_window(s: str | None) -> tuple[int, int] | None:
+    """'10-21' -> (10, 21). Окно через полночь тоже можно: '22-6'. Мусор/пусто -> None."""
+    parts = _clean(s).replace(" ", "").split("-")
+    if len(parts) != 2 or not all(p.isdigit() for p in parts):
+        return None
+    start, end = int(parts[0]), int(parts[1])
+    if not (0 <= start <= 23 and 0 <= end <= 24) or start == end % 24:
+        return None
+    return start, end % 24
+
 # bot/config.py
 
 # ... (в начале файла у тебя уже есть @dataclass, Course, COURSES и т.д.) ...
@@ -72,6 +97,12 @@ class Settings:
     # <<< НОВОЕ: Добавляем пути к конкретным категориям уроков >>>
     course_general_path: Path
     by_code_path: Path
+    # Окно доставки напоминаний в местном времени: (с часа, до часа)
+    remind_window: tuple[int, int] | None
+    # Группа проверки (форум): карточки админам идут туда одним сообщением вместо рассылки в личку.
+    # Темы по категориям: submissions, payments, help, onboarding, tests (нет темы — в общий чат группы)
+    review_chat_id: int | None = None
+    review_topics: dict[str, int] = field(default_factory=dict)
 
 def get_settings() -> Settings:
     token = _clean(os.getenv("BOT_TOKEN"))
@@ -83,6 +114,7 @@ def get_settings() -> Settings:
     tz = _clean(os.getenv("TIMEZONE") or "Asia/Aqtobe")
     link = _clean(os.getenv("PAYMENT_LINK") or "")
     admin_ids = _parse_admins()
+    remind_window = parse_hours_window(os.getenv("REMIND_WINDOW"))  # не задано — без окна, как раньше
 
     # <<< НОВОЕ: Определяем пути к подпапкам с уроками >>>
     course_general = lessons / "course_general"
@@ -103,6 +135,9 @@ def get_settings() -> Settings:
         # <<< НОВОЕ: Передаем созданные пути в настройки >>>
         course_general_path=course_general,
         by_code_path=by_code,
+        remind_window=remind_window,
+        review_chat_id=_parse_chat_id(os.getenv("REVIEW_CHAT_ID")),
+        review_topics=parse_topics(os.getenv("REVIEW_TOPICS")),
     )
 
 
@@ -1,4 +1,5 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 def _b(n: int) -> str:
     return f" ({n})" if n else ""
@@ -20,3 +21,17 @@ def admin_main_reply_kb(queue: int = 0, pay_pending: int = 0, onb_pending: int =
         input_field_placeholder="Админ-меню",
         selective=True,
     )
+
+
+def broadcast_controls_kb(bid: int, status: str) -> InlineKeyboardMarkup | None:
+    """Кнопки под живым сообщением рассылки: пауза/продолжить/отмена."""
+    kb = InlineKeyboardBuilder()
+    if status == "running":
+        kb.button(text="⏸ Пауза", callback_data=f"bc_pause:{bid}")
+    elif status == "paused":
+        kb.button(text="▶️ Продолжить", callback_data=f"bc_resume:{bid}")
+    else:
+        return None
+    kb.button(text="⛔ Отменить", callback_data=f"bc_cancel:{bid}")
+    kb.adjust(2)
+    return kb.as_markup()
@@ -8,12 +8,22 @@ from aiogram.enums import ParseMode
 
 from bot.config import get_settings
 from bot.middlewares.block_until_done import BlockUntilDoneMiddleware
+from bot.middlewares.user_context import UserContextMiddleware
+from bot.middlewares.throttle import ThrottleMiddleware
 from bot.routers.onboarding import router as onboarding_router
 from bot.routers.student import router as student_router
 from bot.routers.lesson_flow import router as lesson_flow_router
 from bot.routers.admin import router as admin_router
 from bot.routers.admin_reply import router as admin_reply_router
 from bot.services.reminder_worker import reminder_loop
+from bot.services.outbox import outbox_loop
+from bot.services.leases import run_with_lease
+from bot.services.release_notifier import release_watch_loop
+from bot.services.broadcasts import broadcast_loop
+from bot.services.counters import counters_loop
+from bot.services.assignments import assignments_loop
+from bot.services.rollups import rollup_loop
+from bot.services.admin_notify import review_chat_gate
 from bot.services.db import DB_PATH
 import logging
 from bot.routers.fallback import router as fallback_router
@@ -38,17 +48,52 @@ logger = logging.getLogger("maestro")
 logger.setLevel(logging.INFO)
 
 async def on_startup(bot: Bot) -> None:
-    # Запускаем фоновый воркер как task_of(bot)
-    bot.reminder_task = asyncio.create_task(reminder_loop(bot), name="reminder_loop")
+    # Запускаем фоновые воркеры как task_of(bot).
+    # Каждый — под арендой: при нескольких процессах работает только один экземпляр.
+    bot.reminder_task = asyncio.create_task(
+        run_with_lease("reminder_loop", lambda: reminder_loop(bot)), name="reminder_loop"
+    )
     logging.warning("Reminder loop started")
+    # Доставка уведомлений из outbox
+    bot.outbox_task = asyncio.create_task(
+        run_with_lease("outbox_loop", lambda: outbox_loop(bot)), name="outbox_loop"
+    )
+    logging.warning("Outbox loop started")
+    # Уведомления о новых уроках по событиям каталога
+    bot.release_task = asyncio.create_task(
+        run_with_lease("release_watch", lambda: release_watch_loop(bot)), name="release_watch"
+    )
+    logging.warning("Release watcher started")
+    # Рассылки админов (подхватывает и прерванные рестартом)
+    bot.broadcast_task = asyncio.create_task(
+        run_with_lease("broadcasts", lambda: broadcast_loop(bot)), name="broadcasts"
+    )
+    logging.warning("Broadcast loop started")
+    # Сверка счётчиков админ-панели с таблицами
+    bot.counters_task = asyncio.create_task(
+        run_with_lease("counters", counters_loop), name="counters"
+    )
+    logging.warning("Counters reconcile loop started")
+    # Переназначение работ, не проверенных за ASSIGN_SLA_MINUTES
+    bot.assignments_task = asyncio.create_task(
+        run_with_lease("assignments", lambda: assignments_loop(bot)), name="assignments"
+    )
+    logging.warning("Review assignments loop started")
+    # Дневные агрегаты для /stats и отчётов: пересчёт помеченных дней
+    bot.rollup_task = asyncio.create_task(
+        run_with_lease("rollups", rollup_loop), name="rollups"
+    )
+    logging.warning("Rollup loop started")
 
 async def on_shutdown(bot: Bot) -> None:
-    # Отменяем фоновый воркер при остановке бота
-    if (task := getattr(bot, "reminder_task", None)):
-        task.cancel()
-        with suppress(asyncio.CancelledError):
-            await task
-    logging.warning("Reminder loop stopped")
+    # Отменяем фоновые воркеры при остановке бота
+    for name in ("reminder_task", "outbox_task", "release_task", "broadcast_task", "counters_task",
+                 "assignments_task", "rollup_task"):
+        if (task := getattr(bot, name, None)):
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    logging.warning("Background loops stopped")
 
 
 async def main() -> None:
@@ -65,6 +110,16 @@ async def main() -> None:
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
+    # Группа проверки: в хендлеры из неё идут только команды и FSM-ответы админов
+    dp.message.filter(review_chat_gate)
+    # Общий контекст пользователя на апдейт (data['ctx']): ученик, админ, активное задание, оплаты
+    dp.update.outer_middleware(UserContextMiddleware())
+    # Флуд-контроль: очередь апдейтов на ученика, схлопывание двойных тапов, лимит сообщений
+    dp.update.outer_middleware(ThrottleMiddleware())
+    # BlockUntilDoneMiddleware (блокировка сообщений до конца урока) сейчас выключена — как и раньше.
+    # Включить: dp.message.middleware(BlockUntilDoneMiddleware()); активное задание она берёт
+    # из кеша active_progress, сброс кеша уже стоит во всех местах, меняющих задание.
+
     # Роутеры
     dp.include_router(onboarding_router)
     dp.include_router(tests_entry_router)
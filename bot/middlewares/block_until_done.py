@@ -2,15 +2,14 @@
 from aiogram.types import Message
 from aiogram.dispatcher.middlewares.base import BaseMiddleware  # aiogram v3
 from typing import Callable, Dict, Any, Awaitable
-from bot.services.db import get_db
-from aiogram.fsm.context import FSMContext
+from bot.services import active_progress
 
 
 # Кнопки, которые всегда пропускаем
 ALLOWED_TEXTS = {
     "🆘 Помощь", "SOS", "СОС",
     "🏅 Мой ранг", "🥇 Мой ранг", "Мой ранг",
-    "🏆 Мой прогресс", "Мой прогресс",
+    "🏆 Мой прогресс", "📈 Мой прогресс", "Мой прогресс",
     "ℹ️ О курсе", "О курсе",
     "💳 Оплатить", "Оплатить",
     "✅ Сдать урок", "Сдать урок",
@@ -26,22 +25,15 @@ class BlockUntilDoneMiddleware(BaseMiddleware):
     ) -> Any:
         msg: Message = event
 
-        # 0) Если мы в состоянии ожидания сдачи (FSM SubmitForm.waiting_work) — ничего не блокируем
-        state: FSMContext | None = data.get("state")
-        if state is not None:
-            try:
-                cur_state = await state.get_state()
-                # Проверяем по имени состояния, чтобы не тянуть класс SubmitForm (без циклических импортов)
-                if cur_state and cur_state.endswith("SubmitForm:waiting_work"):
-                    return await handler(event, data)
-            except Exception:
-                pass
+        # 0) Любое FSM-состояние (сдача работы, помощь, анкета…) — ничего не блокируем.
+        # raw_state уже прочитал FSMContextMiddleware — повторно хранилище не трогаем
+        if data.get("raw_state"):
+            return await handler(event, data)
 
-        state: FSMContext | None = data.get("state")
-        if state:
-            cur = await state.get_state()
-            if cur:
-                return await handler(event, data)
+        # 0.5) Админов и не-личные чаты (группа проверки) не блокируем
+        ctx = data.get("ctx")
+        if msg.chat.type != "private" or (ctx is not None and ctx.is_admin):
+            return await handler(event, data)
 
         # 1) Команды пропускаем
         if msg.text and msg.text.startswith(("/", ".")):
@@ -51,27 +43,16 @@ class BlockUntilDoneMiddleware(BaseMiddleware):
         if msg.text and msg.text.strip() in ALLOWED_TEXTS:
             return await handler(event, data)
 
-        # 3) Если есть активный незавершённый урок — блокируем всё, кроме разрешённого
-        async with get_db() as db:
-            cur = await db.execute(
-                """
-                SELECT p.id, p.task_code
-                FROM progress p
-                JOIN students s ON s.id = p.student_id
-                WHERE s.tg_id=? AND p.status IN ('sent','returned')
-                ORDER BY p.id DESC
-                LIMIT 1
-                """,
-                (msg.from_user.id,),
-            )
-            prow = await cur.fetchone()
+        # 3) Если есть активный незавершённый урок — блокируем всё, кроме разрешённого.
+        # Активное задание — из кеша в памяти, в БД только при промахе
+        active = await ctx.active() if ctx is not None else await active_progress.get(msg.from_user.id)
 
         # Нет активного — пропускаем
-        if not prow:
+        if active is None:
             return await handler(event, data)
 
         # Активный есть и он не завершён (не DONE) — блокируем
-        if (prow["task_code"] or "") != "DONE":
+        if not active.done:
             await msg.answer(
                 "Я понимаю, что не терпится, но пожалуйста закончи все разделы текущего урока и нажми «✅ Сдать урок». "
                 "Если нужна помощь — жми «🆘 Помощь»."
@@ -0,0 +1,127 @@
+# bot/middlewares/throttle.py
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.middlewares.user_context import admin_ids
+
+# Одинаковый callback_data от одного пользователя чаще этого — дубль (двойной тап)
+DEBOUNCE_SECONDS = 1.5
+# Токен-бакет на сообщения ученика: столько подряд, дальше — MSG_RATE в секунду
+MSG_BURST = 5
+MSG_RATE = 1.0
+# Вежливое «не так быстро» — не чаще раза в столько секунд на пользователя
+THROTTLE_NOTICE_SECONDS = 10
+THROTTLE_TEXT = "Не так быстро 🙏 Я обрабатываю предыдущие сообщения."
+# Чистим словари, когда в них больше записей (старые записи всё равно ничего не решают)
+_PRUNE_SIZE = 5000
+
+# Счётчики с запуска процесса — показываются в «📊 Статистика» (/stats) у админов
+THROTTLE_STATS: Counter[str] = Counter()
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self) -> None:
+        self.tokens = float(MSG_BURST)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(MSG_BURST, self.tokens + (now - self.updated) * MSG_RATE)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def _prune(d: dict, older_than: float, stamp: Callable[[Any], float]) -> None:
+    if len(d) > _PRUNE_SIZE:
+        for key in [k for k, v in d.items() if stamp(v) < older_than]:
+            del d[key]
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update (после UserContextMiddleware):
+    • апдейты одного ученика обрабатываются по очереди — двойной «▶️ Следующий раздел»
+      не запустит send_next_t_block дважды параллельно;
+    • одинаковый callback в окне DEBOUNCE_SECONDS схлопывается (в том числе у админов);
+    • сообщения ученика в личке ограничены токен-бакетом, при превышении — один вежливый ответ.
+    Части альбома не ограничиваем и не сериализуем: их ждёт сборщик albums.collect.
+    """
+
+    def __init__(self) -> None:
+        self._locks: dict[int, tuple[asyncio.Lock, int]] = {}
+        self._last_cb: dict[tuple[int, str], float] = {}
+        self._buckets: dict[int, _Bucket] = {}
+        self._noticed: dict[int, float] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or not isinstance(event, Update):
+            return await handler(event, data)
+        uid, now = user.id, time.monotonic()
+        message, cb = event.message, event.callback_query
+
+        if cb is not None and cb.data:
+            key = (uid, cb.data)
+            last = self._last_cb.get(key)
+            self._last_cb[key] = now
+            _prune(self._last_cb, now - DEBOUNCE_SECONDS, lambda t: t)
+            if last is not None and now - last < DEBOUNCE_SECONDS:
+                THROTTLE_STATS["callbacks_coalesced"] += 1
+                try:
+                    await cb.answer()
+                except Exception:
+                    pass
+                return None
+
+        if uid in admin_ids() or (message is None and cb is None):
+            return await handler(event, data)
+        if message is not None and message.media_group_id:
+            return await handler(event, data)
+
+        # лимит и «не так быстро» — только в личке: в группах (в т.ч. группе проверки)
+        # чужие сообщения отсекает review_chat_gate, отвечать туда боту нечего
+        if message is not None and message.chat.type == "private":
+            bucket = self._buckets.setdefault(uid, _Bucket())
+            _prune(self._buckets, now - MSG_BURST / MSG_RATE, lambda b: b.updated)
+            if not bucket.take(now):
+                THROTTLE_STATS["messages_throttled"] += 1
+                if now - self._noticed.get(uid, 0.0) >= THROTTLE_NOTICE_SECONDS:
+                    self._noticed[uid] = now
+                    _prune(self._noticed, now - THROTTLE_NOTICE_SECONDS, lambda t: t)
+                    try:
+                        await message.answer(THROTTLE_TEXT)
+                    except Exception:
+                        pass
+                return None
+
+        lock, users = self._locks.get(uid, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        elif lock.locked():
+            THROTTLE_STATS["serialized_waits"] += 1
+        self._locks[uid] = (lock, users + 1)
+        try:
+            async with lock:
+                return await handler(event, data)
+        finally:
+            lock, users = self._locks[uid]
+            if users <= 1:
+                del self._locks[uid]
+            else:
+                self._locks[uid] = (lock, users - 1)
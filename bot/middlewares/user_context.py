@@ -0,0 +1,88 @@
+# bot/middlewares/user_context.py
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+import aiosqlite
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from bot.config import get_settings
+from bot.services import active_progress
+from bot.services.db import get_db
+
+_UNSET = object()
+_admin_ids: frozenset[int] | None = None
+
+
+def admin_ids() -> frozenset[int]:
+    """ADMIN_IDS читаем один раз на процесс, а не get_settings() на каждый апдейт."""
+    global _admin_ids
+    if _admin_ids is None:
+        _admin_ids = frozenset(get_settings().admin_ids)
+    return _admin_ids
+
+
+class UserContext:
+    """
+    Факты о пользователе апдейта: ученик, админ ли, активное задание, оплаченные курсы.
+    Всё считается лениво и не больше одного раза за апдейт — хендлеры и middleware делят один объект.
+    """
+
+    __slots__ = ("tg_id", "_student", "_paid")
+
+    def __init__(self, tg_id: int | None):
+        self.tg_id = tg_id
+        self._student: Any = _UNSET
+        self._paid: Any = _UNSET
+
+    @property
+    def is_admin(self) -> bool:
+        return self.tg_id in admin_ids()
+
+    async def student(self) -> aiosqlite.Row | None:
+        """Строка students по tg_id (None — ещё не зарегистрирован)."""
+        if self._student is _UNSET:
+            self._student = None
+            if self.tg_id is not None:
+                async with get_db() as db:
+                    cur = await db.execute("SELECT * FROM students WHERE tg_id=?", (self.tg_id,))
+                    self._student = await cur.fetchone()
+        return self._student
+
+    async def student_id(self) -> int | None:
+        row = await self.student()
+        return row["id"] if row else None
+
+    async def active(self) -> active_progress.ActiveProgress | None:
+        """Незавершённое задание (sent/returned) — из общего кеша active_progress."""
+        if self.tg_id is None:
+            return None
+        return await active_progress.get(self.tg_id)
+
+    async def paid_courses(self) -> frozenset[str]:
+        """Коды курсов с подтверждённой оплатой."""
+        if self._paid is _UNSET:
+            sid = await self.student_id()
+            self._paid = frozenset()
+            if sid is not None:
+                async with get_db() as db:
+                    cur = await db.execute(
+                        "SELECT DISTINCT COALESCE(course_code,'') AS c FROM payments WHERE student_id=?", (sid,)
+                    )
+                    self._paid = frozenset(r["c"] for r in await cur.fetchall())
+        return self._paid
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Outer-middleware на update: кладёт UserContext в data['ctx'] (у хендлера — параметр ctx)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        data["ctx"] = UserContext(user.id if user else None)
+        return await handler(event, data)
@@ -1,21 +1,22 @@
 from __future__ import annotations
 
-import random
-import asyncio
-import re
+import shutil
+from functools import wraps
 from typing import List
 
 from aiogram import Router, types, F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardRemove
+from aiogram.types import FSInputFile, ReplyKeyboardRemove
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from bot.config import get_settings, now_utc_str, local_dt_str
-from bot.keyboards.admin import admin_main_reply_kb
-from bot.services import points
+from bot.keyboards.admin import admin_main_reply_kb, broadcast_controls_kb
+from bot.services import points, outbox, broadcasts, segments, counters, student_search, approvals, admin_cards, assignments, exports, rollups, funnel, active_progress
 from bot.services.db import get_db
-from bot.services.ranks import get_rank_by_points
-from bot.config import get_course
+from bot.services.reminder_worker import notify_due_changed
+from bot.middlewares.throttle import THROTTLE_STATS
+from bot.config import get_course, COURSES
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from bot.keyboards.student import student_main_kb
@@ -25,6 +26,7 @@ from aiogram.filters import StateFilter, Command
 
 
 class BroadcastForm(StatesGroup):
+    waiting_segment = State()
     waiting_text = State()
 
 
@@ -41,41 +43,10 @@ router.callback_query.filter(F.from_user.id.in_(_admins), StateFilter("*"))
 async def admin_ping(m: types.Message):
     await m.answer("admin ok")
 
-# Пример ловли кнопки по эмодзи/префиксу, чтобы не зависеть от точного текста
-@router.message(F.text.func(lambda t: t and t.startswith("📊")))
-async def admin_stats(m: types.Message):
-    await m.answer("Статистика: ок")  # тут твоя логика
-
-MOTIVATION_TEXTS = [
-    "Красавчик! Держим темп 💪",
-    "С каждым уроком ты сильнее 🎸",
-    "Отличный прогресс — едем дальше! 🚀",
-]
-
 # ----------------- общие утилиты -----------------
 
-def render_broadcast(tpl: str, srow) -> str:
-    first = (srow["first_name"] or "").strip()
-    last = (srow["last_name"] or "").strip()
-    username = (srow["username"] or "").strip()
-    name = first or (username and f"@{username}") or "друг"
-
-    vars = {
-        "id": srow["id"],
-        "tg_id": srow["tg_id"],
-        "username": username,
-        "first_name": first,
-        "last_name": last,
-        "name": name,
-    }
-    def repl(m: re.Match):
-        key = m.group(1)
-        return str(vars.get(key, ""))
-    # заменяем {key} на значения; неизвестные ключи → пусто
-    return re.sub(r"\{(\w+)\}", repl, tpl)
-
 def _is_admin(uid: int) -> bool:
-    return uid in get_settings().admin_ids
+    return uid in _admins
 
 async def _send_chunked(bot: Bot, chat_id: int, lines: List[str], limit: int = 4000):
     """Отправка длинного списка сообщениями ≤ limit (TG ~4096)."""
@@ -96,28 +67,348 @@ async def _send_chunked(bot: Bot, chat_id: int, lines: List[str], limit: int = 4
 async def _admin_counts():
     """
     queue=submitted работ, pay_pending=ожидающих оплат,
-    onb_pending=анкет на модерации, students_total=всего учеников
+    onb_pending=анкет на модерации, students_total=всего учеников.
+    Берём из таблицы counters (её ведут триггеры), без COUNT(*) по таблицам.
     """
+    c = await counters.snapshot()
+    return c["queue"], c["pay_pending"], c["onb_pending"], c["students_total"]
+
+
+# ----------------- постраничные списки (одно сообщение, правится на месте) -----------------
+
+PAGE_SIZE = 8
+
+# kind → как выбирать и показывать. Пагинация keyset: (key, id) после/до якорной строки,
+# ключ якоря достаём подзапросом по id — в callback_data кладём только id.
+_LISTS = {
+    # работы на проверке: старые первыми, индекс idx_progress_status_submitted(status, submitted_at)
+    "q": {
+        "title": "🗂 Очередь работ",
+        "counter": "queue",
+        "sql": """
+            SELECT p.id, p.lesson_code, p.task_code, p.submitted_at, s.tg_id, s.username
+            FROM progress p JOIN students s ON s.id = p.student_id
+            WHERE p.status='submitted'""",
+        "id": "p.id", "key": "p.submitted_at",
+        "anchor": "(SELECT submitted_at FROM progress WHERE id=?)",
+        "desc": False,
+    },
+    "s": {
+        "title": "👥 Ученики (поиск: /find текст)",
+        "counter": "students_total",
+        "sql": """
+            SELECT id, tg_id, username, first_name, last_name, onboarding_done, created_at
+            FROM students WHERE 1=1""",
+        "id": "id", "key": None, "anchor": None,
+        "desc": True,
+    },
+    # заявки на оплату: idx_payreq_status(status) (+ rowid)
+    "r": {
+        "title": "🧾 Заявки на оплату",
+        "counter": "pay_pending",
+        "sql": """
+            SELECT pr.id, pr.amount, pr.course_code, pr.created_at, s.username, s.tg_id
+            FROM payment_requests pr JOIN students s ON s.id = pr.student_id
+            WHERE pr.status='pending'""",
+        "id": "pr.id", "key": None, "anchor": None,
+        "desc": False,
+    },
+    "o": {
+        "title": "📝 Анкеты на модерации",
+        "counter": "onb_pending",
+        "sql": """
+            SELECT id, tg_id, username, first_name, last_name, created_at
+            FROM students
+            WHERE onboarding_done = 1 AND COALESCE(approved, 0) = 0""",
+        "id": "id", "key": None, "anchor": None,
+        "desc": False,
+    },
+    # история платежей: свежие первыми, idx_payments_paid_at
+    "y": {
+        "title": "💳 Платежи",
+        "counter": None,
+        "sql": """
+            SELECT p.id, s.username, s.tg_id, p.amount, p.method, p.note, p.paid_at
+            FROM payments p JOIN students s ON s.id = p.student_id
+            WHERE p.paid_at IS NOT NULL""",
+        "id": "p.id", "key": "p.paid_at",
+        "anchor": "(SELECT paid_at FROM payments WHERE id=?)",
+        "desc": True,
+    },
+}
+
+
+async def _keyset(kind: str, forward: bool, anchor: int | None, inclusive: bool, limit: int) -> list:
+    """Строки списка kind после (forward) или до anchor в порядке обхода."""
+    spec = _LISTS[kind]
+    # «вперёд» по списку — это > для ASC и < для DESC
+    op = (">" if forward != spec["desc"] else "<") + ("=" if inclusive else "")
+    order_desc = spec["desc"] if forward else not spec["desc"]
+    keys = ([spec["key"]] if spec["key"] else []) + [spec["id"]]
+    order = ", ".join(f"{k} {'DESC' if order_desc else 'ASC'}" for k in keys)
+
+    sql, params = spec["sql"], []
+    if anchor is not None:
+        if spec["key"]:
+            sql += f" AND ({spec['key']}, {spec['id']}) {op} ({spec['anchor']}, ?)"
+            params += [anchor, anchor]
+        else:
+            sql += f" AND {spec['id']} {op} ?"
+            params.append(anchor)
+    sql += f" ORDER BY {order} LIMIT ?"
+    params.append(limit)
+
     async with get_db() as db:
-        # очередь работ
-        cur = await db.execute("SELECT COUNT(*) AS c FROM progress WHERE status='submitted'")
-        queue = (await cur.fetchone())["c"]
+        cur = await db.execute(sql, params)
+        return await cur.fetchall()
 
-        # заявки на оплату (pending)
-        cur = await db.execute("SELECT COUNT(*) AS c FROM payment_requests WHERE status='pending'")
-        pay_pending = (await cur.fetchone())["c"]
 
-        # анкеты на модерации
-        cur = await db.execute(
-            "SELECT COUNT(*) AS c FROM students WHERE onboarding_done=1 AND COALESCE(approved,0)=0"
-        )
-        onb_pending = (await cur.fetchone())["c"]
+async def _fetch_page(kind: str, direction: str, anchor: int | None) -> tuple[list, bool, bool]:
+    """
+    direction: 'n' — после anchor, 'p' — до anchor, 'c' — начиная с anchor включительно.
+    anchor=None — первая страница. Возвращает (rows, есть_назад, есть_вперёд).
+    """
+    if direction == "p" and anchor is not None:
+        rows = await _keyset(kind, False, anchor, False, PAGE_SIZE + 1)
+        has_prev = len(rows) > PAGE_SIZE
+        return list(reversed(rows[:PAGE_SIZE])), has_prev, True
+
+    rows = await _keyset(kind, True, anchor, direction == "c", PAGE_SIZE + 1)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    has_prev = bool(rows) and bool(await _keyset(kind, False, rows[0]["id"], False, 1))
+    return rows, has_prev, has_next
+
+
+def _page_item(kind: str, i: int, r, tz: str) -> str:
+    if kind == "q":
+        return (f"{i}. PID {r['id']} • @{r['username'] or 'no_username'} (id {r['tg_id']})\n"
+                f"   {r['lesson_code']}/{r['task_code']} • сдано {local_dt_str(r['submitted_at'], tz)}")
+    if kind == "s":
+        return (f"{i}. id:{r['id']} • tg_id:{r['tg_id']} @{r['username'] or '—'}\n"
+                f"   {r['first_name'] or ''} {r['last_name'] or ''} • onb:{r['onboarding_done']} • {r['created_at']}")
+    if kind == "r":
+        created = local_dt_str(r["created_at"], tz) if r["created_at"] else "—"
+        return f"{i}. @{r['username'] or 'no_username'} ({r['tg_id']}) — {r['amount']} ₸ • {r['course_code']} • {created}"
+    if kind == "o":
+        return (f"{i}. id:{r['id']} • tg_id:{r['tg_id']} @{r['username'] or '—'}\n"
+                f"   {r['first_name'] or ''} {r['last_name'] or ''} • {r['created_at']}")
+    paid = local_dt_str(r["paid_at"], tz) if r["paid_at"] else "—"
+    note = f" • {r['note']}" if (r["note"] or "").strip() else ""
+    return f"{i}. {paid} • @{r['username'] or 'no_username'} ({r['tg_id']}) — {r['amount']} ₸ [{r['method'] or 'manual'}]{note}"
+
+
+def _page_buttons(kind: str, ik: InlineKeyboardBuilder, i: int, r, ref: str, selected: set | None = None) -> int:
+    """
+    Кнопки действий для пункта i; ref — ':pg:<kind>:<первый id страницы>' для возврата.
+    selected — режим пакетной проверки очереди (выбранные PID). Возвращает число кнопок.
+    """
+    if kind == "q" and selected is not None:
+        anchor = ref.rsplit(":", 1)[1]
+        mark = "☑" if r["id"] in selected else "☐"
+        ik.button(text=f"{mark} {i}", callback_data=f"bq:t:{r['id']}:{anchor}")
+        ik.button(text=f"📚 {i}", callback_data=f"bq:l:{r['id']}:{anchor}")
+        return 2
+    if kind == "q":
+        ik.button(text=f"✅ {i}", callback_data=f"p_ok:{r['id']}{ref}")
+        ik.button(text=f"↩️ {i}", callback_data=f"p_back:{r['id']}{ref}")
+        return 2
+    if kind == "s":
+        ik.button(text=f"ℹ️ {i}", callback_data=f"stu_info:{r['id']}{ref}")
+        ik.button(text=f"🗑 {i}", callback_data=f"stu_del:{r['id']}{ref}")
+        return 2
+    if kind == "r":
+        ik.button(text=f"✅ {i}", callback_data=f"adm_pay_ok:{r['course_code']}:{r['tg_id']}{ref}")
+        ik.button(text=f"❌ {i}", callback_data=f"adm_pay_no:{r['course_code']}:{r['tg_id']}{ref}")
+        return 2
+    if kind == "o":
+        ik.button(text=f"✅ {i}", callback_data=f"onb_ok:{r['id']}{ref}")
+        ik.button(text=f"❌ {i}", callback_data=f"onb_rej:{r['id']}{ref}")
+        return 2
+    return 0
+
+
+async def _render_page(kind: str, direction: str = "n", anchor: int | None = None, selected: set | None = None):
+    spec = _LISTS[kind]
+    rows, has_prev, has_next = await _fetch_page(kind, direction, anchor)
+    if not rows and anchor is not None:
+        # страница опустела (всё разобрали) — показываем первую
+        rows, has_prev, has_next = await _fetch_page(kind, "n", None)
+
+    title = spec["title"]
+    if spec["counter"]:
+        title += f" — {(await counters.snapshot())[spec['counter']]}"
+    if not rows:
+        return f"{title}\n\nПусто.", None
+
+    tz = get_settings().timezone
+    ref = f":pg:{kind}:{rows[0]['id']}"
+    ik = InlineKeyboardBuilder()
+    sizes = []
+    lines = [title, ""]
+    for i, r in enumerate(rows, 1):
+        lines.append(_page_item(kind, i, r, tz))
+        n = _page_buttons(kind, ik, i, r, ref, selected)
+        if n:
+            sizes.append(n)
+
+    if kind == "q":
+        if selected is None:
+            ik.button(text="☑️ Выбрать несколько", callback_data=f"bq:on:{rows[0]['id']}")
+            sizes.append(1)
+        else:
+            lines += ["", "Отметь работы ☐ и прими разом; 📚 — все работы по этому уроку."]
+            ik.button(text=f"✅ Принять выбранные ({len(selected)})", callback_data=f"bq:go:{rows[0]['id']}")
+            ik.button(text="✖️ Выйти", callback_data=f"bq:off:{rows[0]['id']}")
+            sizes.append(2)
+
+    nav = 0
+    if has_prev:
+        ik.button(text="◀️", callback_data=f"pg:{kind}:p:{rows[0]['id']}"); nav += 1
+    ik.button(text="🔄", callback_data=f"pg:{kind}:c:{rows[0]['id']}"); nav += 1
+    if has_next:
+        ik.button(text="▶️", callback_data=f"pg:{kind}:n:{rows[-1]['id']}"); nav += 1
+    ik.adjust(*sizes, nav)
+    return "\n".join(lines), ik.as_markup()
+
+
+async def _send_page(bot: Bot, chat_id: int, kind: str) -> None:
+    text, markup = await _render_page(kind)
+    await bot.send_message(chat_id, text, reply_markup=markup)
+
+
+async def _edit_page(
+    message: types.Message, kind: str, direction: str, anchor: int | None, selected: set | None = None
+) -> None:
+    text, markup = await _render_page(kind, direction, anchor, selected)
+    try:
+        await message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        # «message is not modified» — страница не изменилась
+        pass
 
-        # всего учеников
-        cur = await db.execute("SELECT COUNT(*) AS c FROM students")
-        students_total = (await cur.fetchone())["c"]
 
-    return queue, pay_pending, onb_pending, students_total
+def _page_ref(data: str) -> tuple[str, int] | None:
+    """'p_ok:15:pg:q:12' → ('q', 12): действие нажато на странице списка."""
+    parts = data.split(":pg:", 1)
+    if len(parts) != 2:
+        return None
+    kind, _, anchor = parts[1].partition(":")
+    return (kind, int(anchor)) if kind in _LISTS and anchor.isdigit() else None
+
+
+def _refresh_page_after(handler):
+    """Действие со страницы списка: после обработки перерисовываем ту же страницу."""
+    @wraps(handler)
+    async def wrapper(cb: types.CallbackQuery):
+        try:
+            return await handler(cb)
+        finally:
+            ref = _page_ref(cb.data or "")
+            if ref:
+                await _edit_page(cb.message, ref[0], "c", ref[1])
+    return wrapper
+
+
+@router.callback_query(F.data.startswith("pg:"))
+async def cb_page(cb: types.CallbackQuery, state: FSMContext):
+    _, kind, direction, anchor = cb.data.split(":")
+    if kind not in _LISTS:
+        await cb.answer(); return
+    await _edit_page(cb.message, kind, direction, int(anchor) if anchor else None,
+                     await _bulk_selected(state) if kind == "q" else None)
+    await cb.answer()
+
+
+# ----- пакетная проверка очереди -----
+
+# Больше работ за одно действие не берём: транзакция и сводка остаются короткими
+BULK_MAX = 100
+
+
+async def _bulk_selected(state: FSMContext) -> set | None:
+    """Выбранные PID режима пакетной проверки; None — режим выключен."""
+    sel = (await state.get_data()).get("bulk_sel")
+    return None if sel is None else set(sel)
+
+
+async def _bulk_approve(cb: types.CallbackQuery, pids: list[int], again: str) -> list[int]:
+    """
+    Принимает до BULK_MAX работ одной транзакцией и присылает сводку по каждой.
+    Чужие брони пропускаем — их проверяет approvals в той же транзакции.
+    Возвращает PID сверх BULK_MAX — их не трогали; again — подсказка, как принять остаток.
+    """
+    results = await approvals.approve_many(pids[:BULK_MAX], admin_id=cb.from_user.id)
+    titles = {"approved": "✅ принята", "already": "уже принята", "not_submitted": "не на проверке",
+              "missing": "не найдена", "taken": "проверяет другой админ"}
+    ok = sum(1 for r in results if r.ok)
+    lines = [f"Пакетная проверка: принято {ok} из {len(results)}"]
+    lines += [f"• PID {r.pid}{f' ({r.lesson_code})' if r.lesson_code else ''} — {titles[r.status]}" for r in results]
+    who = admin_cards.admin_name(cb.from_user)
+    for r in results:
+        if r.ok:
+            admin_cards.update_copies_later(cb.bot, r.pid, f"✅ Принято: {who}", final=True)
+    rest = pids[BULK_MAX:]
+    if rest:
+        lines.append(f"Осталось ещё {len(rest)} — {again}.")
+    await _send_chunked(cb.bot, cb.message.chat.id, lines)
+    return rest
+
+
+@router.callback_query(F.data.startswith("bq:"))
+async def cb_bulk(cb: types.CallbackQuery, state: FSMContext):
+    parts = cb.data.split(":")
+    action, anchor = parts[1], int(parts[-1])
+    selected = await _bulk_selected(state)
+
+    if action == "on":
+        selected = set()
+    elif action == "off":
+        selected = None
+    elif action == "t":
+        pid = int(parts[2])
+        selected = selected or set()
+        selected ^= {pid}
+    elif action == "go":
+        if not selected:
+            await cb.answer("Ничего не выбрано", show_alert=True); return
+        await cb.answer("Принимаю…")
+        # остаток сверх BULK_MAX остаётся выбранным — следующий «Принять выбранные» возьмёт его
+        rest = await _bulk_approve(cb, sorted(selected), "они остались выбранными, нажми «Принять выбранные» ещё раз")
+        selected = set(rest) if rest else None
+    elif action in ("l", "lg"):
+        # все работы на проверке по уроку выбранной работы
+        pid = int(parts[2])
+        async with get_db() as db:
+            cur = await db.execute("SELECT lesson_code FROM progress WHERE id=?", (pid,))
+            row = await cur.fetchone()
+            lesson = row["lesson_code"] if row else None
+            cur = await db.execute(
+                "SELECT id FROM progress WHERE status='submitted' AND lesson_code=? ORDER BY submitted_at, id",
+                (lesson,),
+            )
+            pids = [r["id"] for r in await cur.fetchall()]
+        if not pids:
+            await cb.answer("По этому уроку нечего принимать.", show_alert=True); return
+        if action == "l":
+            ik = InlineKeyboardBuilder()
+            ik.button(text=f"✅ Да, принять {min(len(pids), BULK_MAX)}", callback_data=f"bq:lg:{pid}:{anchor}")
+            ik.button(text="Отмена", callback_data=f"pg:q:c:{anchor}")
+            ik.adjust(2)
+            await cb.message.edit_text(f"Принять все работы по уроку {lesson}? На проверке: {len(pids)}.",
+                                       reply_markup=ik.as_markup())
+            await cb.answer()
+            return
+        await cb.answer("Принимаю…")
+        await _bulk_approve(cb, pids, "нажми 📚 по этому уроку ещё раз")
+        selected = None
+    else:
+        await cb.answer(); return
+
+    await state.update_data(bulk_sel=None if selected is None else sorted(selected))
+    await _edit_page(cb.message, "q", "c", anchor, selected)
+    if action not in ("go", "lg"):
+        await cb.answer()
 
 
 # ----------------- вход/выход админ-режима -----------------
@@ -139,71 +430,168 @@ async def admin_mode_off(m: types.Message):
 
 # ----------------- ReplyKeyboard: верхний уровень -----------------
 @router.message(F.text == "📊 Статистика")
+@router.message(Command("stats"))
 async def msg_adm_stats(m: types.Message):
     if not _is_admin(m.from_user.id):
         return
-    async with get_db() as db:
-        cur = await db.execute("SELECT COUNT(*) AS c FROM students"); students = (await cur.fetchone())["c"]
-        cur = await db.execute("SELECT COUNT(*) AS c FROM progress WHERE status IN ('sent','returned','submitted')"); active = (await cur.fetchone())["c"]
-        cur = await db.execute("SELECT COUNT(*) AS c FROM progress WHERE status='submitted'"); queued = (await cur.fetchone())["c"]
-        cur = await db.execute("SELECT COUNT(*) AS c FROM progress WHERE status='approved' AND approved_at >= datetime('now','-7 day') || 'Z'"); approved7 = (await cur.fetchone())["c"]
-        cur = await db.execute("SELECT COALESCE(SUM(amount),0) AS s FROM payments WHERE paid_at >= datetime('now','-30 day') || 'Z'"); sum30 = (await cur.fetchone())["s"]
+    c = await counters.snapshot()
+    approved7 = await counters.daily_sum("approved", 7)
+    sum30 = await counters.daily_sum("payments_sum", 30)
     txt = ("📊 Статистика\n"
-           f"— Ученики: {students}\n"
-           f"— Активных заданий: {active}\n"
-           f"— В очереди (submitted): {queued}\n"
+           f"— Ученики: {c['students_total']}\n"
+           f"— Активных заданий: {c['active']}\n"
+           f"— В очереди (submitted): {c['queue']}\n"
            f"— Одобрено за 7д: {approved7}\n"
            f"— Платежи за 30д: {sum30} ₸")
+    # воронка и выручка за неделю — из дневных агрегатов (rollup_daily), без сканов сырых таблиц
+    week = await rollups.window(7)
+
+    def total(metric: str) -> int:
+        return sum(week.get(metric, {}).values())
+
+    taken = total("tests_taken")
+    txt += ("\n\n📈 За 7 дней\n"
+            f"— Новых учеников: {total('new_students')}, анкет: {total('onboarded')}, "
+            f"одобрено: {total('students_approved')}\n"
+            f"— Тесты: {total('tests_passed')}/{taken} сдано"
+            + (f" ({total('tests_passed') * 100 // taken}%)" if taken else ""))
+    for code, course in COURSES.items():
+        issued, submitted, approved, revenue = (
+            week.get(metric, {}).get(code, 0)
+            for metric in ("lessons_issued", "lessons_submitted", "lessons_approved", "revenue")
+        )
+        if issued or submitted or approved or revenue:
+            txt += (f"\n— {course.title}: выдано {issued}, сдано {submitted}, "
+                    f"принято {approved}, выручка {revenue} ₸")
+    txt += ("\n\n🛡 Флуд-контроль (с запуска): "
+            f"дублей кнопок {THROTTLE_STATS['callbacks_coalesced']}, "
+            f"сообщений отсечено {THROTTLE_STATS['messages_throttled']}, "
+            f"в очереди ждали {THROTTLE_STATS['serialized_waits']}")
+    reviewers = await _reviewers_text()
+    if reviewers:
+        txt += "\n\n" + reviewers
     await m.answer(txt)
 
+async def _reviewers_text() -> str:
+    """Нагрузка ревьюеров: в работе / проверено за STATS_DAYS / медиана времени проверки."""
+    reviewers = await assignments.reviewer_stats()
+    if not reviewers:
+        return ""
+    lines = [f"🧑‍🏫 Ревьюеры (в работе / проверено за {assignments.STATS_DAYS}д / медиана):"]
+    for admin_id, open_cnt, done, median in reviewers:
+        med = f"{median:.0f} мин" if median is not None else "—"
+        lines.append(f"— {admin_id}: {open_cnt} / {done} / {med}")
+    return "\n".join(lines)
+
+# команда, а не кнопка: в группе проверки текст кнопок до хендлеров не доходит
+@router.message(Command("reviewers"))
+async def cmd_reviewers(m: types.Message):
+    if not _is_admin(m.from_user.id):
+        return
+    await m.answer(await _reviewers_text() or "Ревьюеров нет.")
+
 @router.message(F.text.startswith("🗂 Очередь"))
 async def msg_adm_queue(m: types.Message):
     if not _is_admin(m.from_user.id):
         return
-    async with get_db() as db:
-        cur = await db.execute("""
-            SELECT p.id, p.lesson_code, p.task_code, p.submitted_at, s.tg_id, s.username
-            FROM progress p JOIN students s ON s.id = p.student_id
-            WHERE p.status='submitted' ORDER BY p.submitted_at DESC
-        """)
-        rows = await cur.fetchall()
-    if not rows:
-        await m.answer("Очередь пустая.")
-        return
-    await m.answer("Очередь работ (submitted):")
-    for r in rows:
-        card = (f"PID: {r['id']}\n"
-                f"Ученик: @{r['username'] or 'no_username'} (id {r['tg_id']})\n"
-                f"Урок/раздел: {r['lesson_code']}/{r['task_code']}\n"
-                f"Сдано: {r['submitted_at']}")
-        ik = InlineKeyboardBuilder()
-        ik.button(text="✅ Принять", callback_data=f"p_ok:{r['id']}")
-        ik.button(text="↩️ Вернуть", callback_data=f"p_back:{r['id']}")
-        ik.adjust(2)
-        await m.bot.send_message(m.chat.id, card, reply_markup=ik.as_markup())
+    # одно сообщение со страницей очереди; листается и обновляется на месте
+    await _send_page(m.bot, m.chat.id, "q")
 
 @router.message(F.text.startswith("👥 Ученики"))
 async def msg_adm_students(m: types.Message):
     if not _is_admin(m.from_user.id):
         return
-    async with get_db() as db:
-        cur = await db.execute("""
-            SELECT id, tg_id, username, first_name, last_name, onboarding_done, created_at
-            FROM students ORDER BY id DESC LIMIT 30
-        """)
-        rows = await cur.fetchall()
+    await _send_page(m.bot, m.chat.id, "s")
+
+
+# ----- поиск учеников (FTS5) -----
+async def _render_find(query: str, offset: int):
+    rows, more = await student_search.search(query, offset)
     if not rows:
-        await m.answer("Ученики не найдены.")
+        return f"🔎 «{query}» — ничего не нашёл.", None
+    lines = [f"🔎 «{query}»", ""]
+    ik = InlineKeyboardBuilder()
+    for i, r in enumerate(rows, offset + 1):
+        flags = ("✅" if r["approved"] else "⏳") if r["onboarding_done"] else "📝"
+        lines.append(f"{i}. {flags} id:{r['id']} • {r['first_name'] or ''} {r['last_name'] or ''} "
+                     f"@{r['username'] or '—'} • {r['phone'] or '—'}")
+        ik.button(text=f"ℹ️ {i}", callback_data=f"stu_info:{r['id']}:fd:{offset}")
+    nav = 0
+    if offset:
+        ik.button(text="◀️", callback_data=f"fd:{max(offset - student_search.SEARCH_PAGE_SIZE, 0)}"); nav += 1
+    if more:
+        ik.button(text="▶️", callback_data=f"fd:{offset + student_search.SEARCH_PAGE_SIZE}"); nav += 1
+    ik.adjust(*([4] * ((len(rows) + 3) // 4)), *([nav] if nav else []))
+    return "\n".join(lines), ik.as_markup()
+
+
+@router.message(Command("find"))
+async def cmd_find(m: types.Message, state: FSMContext):
+    if not _is_admin(m.from_user.id):
         return
-    await m.answer("Последние ученики:")
-    for r in rows:
-        card = (f"id:{r['id']} • tg_id:{r['tg_id']} @{r['username'] or '—'}\n"
-                f"{r['first_name'] or ''} {r['last_name'] or ''} • onb:{r['onboarding_done']} • {r['created_at']}")
-        ik = InlineKeyboardBuilder()
-        ik.button(text="ℹ️ Анкета", callback_data=f"stu_info:{r['id']}")
-        ik.button(text="🗑 Удалить", callback_data=f"stu_del:{r['id']}")
-        ik.adjust(2)
-        await m.bot.send_message(m.chat.id, card, reply_markup=ik.as_markup())
+    query = (m.text or "").partition(" ")[2].strip()
+    if not query:
+        await m.answer("Поиск ученика: /find имя, фамилия, @ник, телефон или слово из цели.")
+        return
+    # запрос держим в FSM-данных админа: в callback_data он может не влезть
+    await state.update_data(find_query=query)
+    text, markup = await _render_find(query, 0)
+    await m.answer(text, reply_markup=markup)
+
+
+@router.callback_query(F.data.startswith("fd:"))
+async def cb_find_page(cb: types.CallbackQuery, state: FSMContext):
+    query = (await state.get_data()).get("find_query")
+    if not query:
+        await cb.answer("Поиск устарел, повтори /find", show_alert=True); return
+    text, markup = await _render_find(query, int(cb.data.split(":")[1]))
+    try:
+        await cb.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        pass
+    await cb.answer()
+
+# ----- воронка -----
+@router.message(Command("funnel"))
+async def cmd_funnel(m: types.Message):
+    if not _is_admin(m.from_user.id):
+        return
+    # отчёт собирается ночью из funnel_*; «/funnel now» — пересобрать сейчас (тоже без сырых таблиц)
+    force = (m.text or "").partition(" ")[2].strip() == "now"
+    cached = None if force else await funnel.cached_report()
+    text, built_at = cached or await funnel.rebuild()
+    lines = text.split("\n") + ["", f"Обновлено: {funnel.built_at_text(built_at)}"]
+    await _send_chunked(m.bot, m.chat.id, lines)
+
+
+# ----- выгрузки -----
+# Больше Telegram не примет документом от бота — тогда только через bot.tools.export
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+
+@router.message(Command("export"))
+async def cmd_export(m: types.Message):
+    if not _is_admin(m.from_user.id):
+        return
+    try:
+        table, fmt, filters = exports.parse_args((m.text or "").split()[1:])
+    except ValueError as e:
+        await m.answer(f"{e}\n\n{exports.EXPORT_HELP}")
+        return
+    await m.answer("⏳ Готовлю выгрузку…")
+    try:
+        path, count = await exports.export(table, filters, fmt)
+    except Exception as e:
+        await m.answer(f"❌ Выгрузка не удалась: {e}")
+        return
+    try:
+        if path.stat().st_size > EXPORT_MAX_BYTES:
+            await m.answer("Файл больше 50 МБ — сузь фильтры или выгрузи через python -m bot.tools.export.")
+            return
+        await m.answer_document(FSInputFile(path), caption=f"{table}: {count} строк")
+    finally:
+        shutil.rmtree(path.parent, ignore_errors=True)
+
 
 @router.message(F.text == "💳 Платежи")
 async def msg_adm_payments(m: types.Message):
@@ -237,16 +625,19 @@ async def cb_adm_pay_pending(cb: types.CallbackQuery):
     if not _is_admin(cb.from_user.id):
         await cb.answer(); return
     await cb.answer()
-    await cb.message.edit_text("🧾 Заявки на оплату:")
-    await _show_pay_requests(cb.message.bot, cb.message.chat.id)
+    await _edit_page(cb.message, "r", "n", None)
 
 @router.callback_query(F.data == "adm_onb_pending")
 async def cb_adm_onb_pending(cb: types.CallbackQuery):
     if not _is_admin(cb.from_user.id):
         await cb.answer(); return
     await cb.answer()
-    await cb.message.edit_text("📝 Анкеты (модерация):")
-    await _show_onboarding_pending(cb.message.bot, cb.message.chat.id)
+    await _edit_page(cb.message, "o", "n", None)
+
+@router.callback_query(F.data == "adm_students")
+async def cb_adm_students(cb: types.CallbackQuery):
+    await cb.answer()
+    await _edit_page(cb.message, "s", "n", None)
 
 @router.callback_query(F.data.startswith("stu_info:"))
 async def stu_info(cb: types.CallbackQuery):
@@ -267,15 +658,24 @@ async def stu_info(cb: types.CallbackQuery):
         f"@{s['username'] or '—'} • tg_id: {s['tg_id']}\n"
         f"Зарегистрирован: {s['created_at'] or '—'}"
     )
-    await cb.message.edit_text(card)
+    ref = _page_ref(cb.data)
+    _, _, find_offset = cb.data.partition(":fd:")
+    ik = InlineKeyboardBuilder()
+    if ref:
+        ik.button(text="⬅️ К списку", callback_data=f"pg:{ref[0]}:c:{ref[1]}")
+    elif find_offset:
+        ik.button(text="⬅️ К поиску", callback_data=f"fd:{find_offset}")
+    await cb.message.edit_text(card, reply_markup=ik.as_markup() if (ref or find_offset) else None)
     await cb.answer()
 
 @router.callback_query(F.data.startswith("stu_del:"))
 async def stu_del(cb: types.CallbackQuery):
     sid = int(cb.data.split(":")[1])
+    ref = _page_ref(cb.data)
+    suffix = f":pg:{ref[0]}:{ref[1]}" if ref else ""
     ik = InlineKeyboardBuilder()
-    ik.button(text="Да, удалить", callback_data=f"stu_del_go:{sid}")
-    ik.button(text="Отмена", callback_data="adm_students")
+    ik.button(text="Да, удалить", callback_data=f"stu_del_go:{sid}{suffix}")
+    ik.button(text="Отмена", callback_data=f"pg:{ref[0]}:c:{ref[1]}" if ref else "adm_students")
     await cb.message.edit_text(
         f"Удалить ученика id:{sid}? Это удалит его прогресс и платежи.",
         reply_markup=ik.as_markup(),
@@ -283,6 +683,7 @@ async def stu_del(cb: types.CallbackQuery):
     await cb.answer()
 
 @router.callback_query(F.data.startswith("stu_del_go:"))
+@_refresh_page_after
 async def stu_del_go(cb: types.CallbackQuery):
     sid = int(cb.data.split(":")[1])
     async with get_db() as db:
@@ -292,128 +693,85 @@ async def stu_del_go(cb: types.CallbackQuery):
     await cb.answer()
 
 # ----- проверка работ -----
+_CLAIM_ALERTS = {
+    "mine": "Работа уже у тебя.",
+    "taken": "Эту работу уже проверяет другой админ.",
+    "not_submitted": "Работа не на проверке.",
+    "missing": "Прогресс не найден",
+}
+
+
+@router.callback_query(F.data.startswith("p_claim:"))
+async def p_claim(cb: types.CallbackQuery):
+    pid = int(cb.data.split(":")[1])
+    status, _ = await admin_cards.claim(pid, cb.from_user.id)
+    if status != "claimed":
+        await cb.answer(_CLAIM_ALERTS[status], show_alert=status != "mine")
+        return
+    await assignments.assign(pid, reviewer=cb.from_user.id)
+    # у взявшего остаются «Принять/Вернуть», у остальных — пометка, кто проверяет
+    admin_cards.update_copies_later(
+        cb.bot, pid, f"🙋 Проверяет: {admin_cards.admin_name(cb.from_user)}", owner=cb.from_user.id
+    )
+    await cb.answer("Работа закреплена за тобой 🙋")
+
+
+async def _claimed_by_other(cb: types.CallbackQuery, pid: int) -> bool:
+    holder = await admin_cards.claim_holder(pid)
+    if holder and holder != cb.from_user.id:
+        await cb.answer(_CLAIM_ALERTS["taken"], show_alert=True)
+        return True
+    return False
+
+
 @router.callback_query(F.data.startswith("p_ok:"))
+@_refresh_page_after
 async def p_ok(cb: types.CallbackQuery):
     pid = int(cb.data.split(":")[1])
+    if await _claimed_by_other(cb, pid):
+        return
 
     # ↓↓↓ НАШЕ ИЗМЕНЕНИЕ №1 ↓↓↓
     # Немедленно убираем кнопки и показываем, что работа в процессе.
     original_text = cb.message.text
     await cb.message.edit_text(f"{original_text}\n\n⏳ Обрабатываю...")
 
-    async with get_db() as db:
-        # Прогресс
-        cur = await db.execute("SELECT status, task_code FROM progress WHERE id=?", (pid,))
-        prow = await cur.fetchone()
-        if not prow:
-            # Если что-то пошло не так, вернем исходный вид с кнопками
-            await cb.message.edit_text(original_text, reply_markup=cb.message.reply_markup)
-            await cb.answer("Прогресс не найден", show_alert=True)
-            return
-
-        # ... (вся ваша существующая логика проверок статуса)
-        status = (prow["status"] or "")
-        if status == "approved":
-            await cb.message.edit_text(f"{original_text}\n\n✅ Уже было принято.")
-            await cb.answer("Уже принято ✅")
-            return
-        if status != "submitted":
-            await cb.message.edit_text(original_text, reply_markup=cb.message.reply_markup)
-            await cb.answer("Работа не на проверке.", show_alert=True)
-            return
-
-        # апрув
-        now = now_utc_str()
-        await db.execute(
-            "UPDATE progress SET status='approved', approved_at=?, updated_at=? WHERE id=?",
-            (now, now, pid),
-        )
-
-        # студент
-        cur = await db.execute("""
-            SELECT s.id AS sid, s.tg_id AS tg_id
-            FROM progress p JOIN students s ON s.id = p.student_id
-            WHERE p.id = ?
-        """, (pid,))
-        row = await cur.fetchone()
-        if not row:
-            await cb.answer("Студент не найден", show_alert=True); return
-        sid, tg_id = row["sid"], row["tg_id"]
-
-        # +100 баллов за урок (идемпотентно)
-        try:
-            await points.add(sid, f"lesson_approved:{pid}", 100)
-        except Exception:
-            pass
-
-        # сколько уже принято
-        cur = await db.execute("SELECT COUNT(*) AS c FROM progress WHERE student_id=? AND status='approved'", (sid,))
-        appr = (await cur.fetchone())["c"]
-
-        bonus = None
-        if appr == 8:
-            bonus = ("module1_bonus:s{sid}", 500, "🎉 Поздравляем!\nТы закрыл 1-й модуль — 8 уроков 💪\n\n🎯 Бонус: +500 баллов")
-        elif appr == 16:
-            bonus = ("module2_bonus:s{sid}", 500, "🏆 Финал!\nТы прошёл 16 уроков.\n\n🎯 Бонус: +500 баллов\nБейдж: «Выпускник Maestro» 🏅")
-        if bonus:
-            try:
-                await points.add(sid, bonus[0], bonus[1])
-            except Exception:
-                pass
-
-        await db.commit()
-
-    # пересчёт ранга
-    total = await points.total(sid)
-    async with get_db() as db:
-        cur = await db.execute("SELECT rank FROM students WHERE id=?", (sid,))
-        prev_rank = (await cur.fetchone())["rank"] or ""
-    rank_name, next_thr = get_rank_by_points(total)
-
-    now = now_utc_str()
-    async with get_db() as db:
-        if rank_name != prev_rank:
-            await db.execute("UPDATE students SET rank=?, rank_points=?, updated_at=? WHERE id=?",
-                             (rank_name, total, now, sid))
-        else:
-            await db.execute("UPDATE students SET rank_points=?, updated_at=? WHERE id=?",
-                             (total, now, sid))
-        await db.commit()
-
-    # сообщение ученику
-    rank_up_text = (f"🏅 Новый ранг: <b>{rank_name}</b>!\nТвои баллы: <b>{total}</b>"
-                    f"\n⬆️ До следующего ранга: <b>{next_thr - total}</b>") if (rank_name != prev_rank and next_thr is not None) else None
-    accept_text = "✅ Работа принята! +100 баллов 🎯"
-    if appr == 8 or appr == 16:
-        accept_text += f"\n\n{bonus[2]}"
-    accept_text += f"\nТвой счёт: <b>{total}</b> баллов"
-    final_text = f"{rank_up_text}\n\n{accept_text}" if rank_up_text else accept_text
-
-    # ...
-    try:  # <<< ИЗМЕНЕНИЕ: Начало блока try
-        await cb.message.bot.send_message(tg_id, final_text)
-
-        kb = InlineKeyboardBuilder()
-        kb.button(text="📚 Следующий урок", callback_data=f"stu:take_next:{sid}")
-        kb.adjust(1)
-        await cb.message.bot.send_message(tg_id, random.choice(MOTIVATION_TEXTS), reply_markup=kb.as_markup())
-
-        await cb.message.edit_text(f"{original_text}\n\n✅ Принято. Ученик уведомлен.")
-        await cb.answer("Принято ✅")
+    # Всё в одной транзакции сервиса; здесь — только ответ админу по результату
+    res = await approvals.approve_submission(pid, admin_id=cb.from_user.id)
+    if res.status == "taken":
+        # бронь перехватили между проверкой выше и транзакцией
+        await cb.message.edit_text(original_text, reply_markup=cb.message.reply_markup)
+        await cb.answer(_CLAIM_ALERTS["taken"], show_alert=True)
+        return
+    if res.status == "missing":
+        await cb.message.edit_text(original_text, reply_markup=cb.message.reply_markup)
+        await cb.answer("Прогресс не найден", show_alert=True)
+        return
+    if res.status == "already":
+        await cb.message.edit_text(f"{original_text}\n\n✅ Уже было принято.")
+        await cb.answer("Уже принято ✅")
+        return
+    if res.status == "not_submitted":
+        await cb.message.edit_text(original_text, reply_markup=cb.message.reply_markup)
+        await cb.answer("Работа не на проверке.", show_alert=True)
+        return
 
-    except Exception as e:  # <<< ИЗМЕНЕНИЕ: Ловим возможную ошибку
-        # Если юзер заблокировал бота, просто сообщим админу
-        print(f"Не удалось отправить сообщение ученику {tg_id}: {e}")
-        await cb.message.edit_text(
-            f"{original_text}\n\n✅ Принято. (Не удалось уведомить ученика, возможно, он заблокировал бота)")
-        await cb.answer("Принято, но не удалось уведомить", show_alert=True)
+    await cb.message.edit_text(f"{original_text}\n\n✅ Принято. Уведомление ученику поставлено в очередь.")
+    admin_cards.update_copies_later(
+        cb.bot, pid, f"✅ Принято: {admin_cards.admin_name(cb.from_user)}", final=True,
+        skip=(cb.message.chat.id, cb.message.message_id),
+    )
+    await cb.answer("Принято ✅")
 
 
 # Файл: Bot/routers/admin.py
 
 @router.callback_query(F.data.startswith("p_back:"))
+@_refresh_page_after
 async def p_back(cb: types.CallbackQuery):
     pid = int(cb.data.split(":")[1])
+    if await _claimed_by_other(cb, pid):
+        return
 
     # 1. Сохраняем исходный текст и сразу блокируем интерфейс
     original_text = cb.message.text
@@ -442,10 +800,18 @@ async def p_back(cb: types.CallbackQuery):
         await cb.answer("Работа не на проверке.", show_alert=True)
         return
 
-    # 3. Выполняем основную логику
+    # 3. Выполняем основную логику; бронь проверяем в том же UPDATE — её могли перехватить
     async with get_db() as db:
-        await db.execute("UPDATE progress SET status='returned', returned_at=?, updated_at=? WHERE id=?",
-                         (now_utc_str(), now_utc_str(), pid))
+        cur = await db.execute(
+            "UPDATE progress SET status='returned', returned_at=?, updated_at=? "
+            f"WHERE id=? AND status='submitted' AND {admin_cards.CLAIM_FREE_SQL}",
+            (now_utc_str(), now_utc_str(), pid, cb.from_user.id, admin_cards.claim_cutoff()),
+        )
+        if not cur.rowcount:
+            await db.rollback()
+            await cb.message.edit_text(original_text, reply_markup=cb.message.reply_markup)
+            await cb.answer("Работу уже разобрал или взял другой админ.", show_alert=True)
+            return
         cur = await db.execute("""
             SELECT s.tg_id AS tg_id
             FROM progress p JOIN students s ON s.id = p.student_id
@@ -453,111 +819,40 @@ async def p_back(cb: types.CallbackQuery):
         """, (pid,))
         row = await cur.fetchone()
         await db.commit()
+    notify_due_changed()
+    await assignments.finish([pid], "returned")
+    active_progress.invalidate(row["tg_id"] if row else None)
 
     if row and row["tg_id"]:
         await cb.message.bot.send_message(row["tg_id"], "↩️ Работа возвращена на доработку. Исправь и сдавай снова 💪")
 
     # 4. Сообщаем админу об успешном выполнении
     await cb.message.edit_text(f"{original_text}\n\n↩️ Возвращено. Ученик уведомлен.")
+    admin_cards.update_copies_later(
+        cb.bot, pid, f"↩️ Возвращено: {admin_cards.admin_name(cb.from_user)}", final=True,
+        skip=(cb.message.chat.id, cb.message.message_id),
+    )
     await cb.answer("Возвращено")
 # ----- платежи -----
 async def _show_payments(bot: Bot, chat_id: int):
-    settings = get_settings(); tz = settings.timezone
-    async with get_db() as db:
-        cur = await db.execute("""
-            SELECT p.id, s.username, s.tg_id, p.amount, p.method, p.note, p.paid_at
-            FROM payments p JOIN students s ON s.id = p.student_id
-            ORDER BY COALESCE(p.paid_at,'') DESC, p.id DESC
-            LIMIT 20
-        """); pays = await cur.fetchall()
-        cur = await db.execute("""
-            SELECT pr.id, pr.amount, pr.created_at, s.username, s.tg_id
-            FROM payment_requests pr JOIN students s ON s.id = pr.student_id
-            WHERE pr.status='pending'
-            ORDER BY pr.created_at DESC
-        """); reqs = await cur.fetchall()
-        cur = await db.execute("""
-            SELECT COALESCE(SUM(amount),0) AS s
-            FROM payments
-            WHERE paid_at >= datetime('now','-30 day') || 'Z'
-        """); sum30 = (await cur.fetchone())["s"]
-
-    await bot.send_message(chat_id, f"💳 Платежи (последние 20)\nИтого за 30 дней: {sum30} ₸")
-
-    if pays:
-        lines = []
-        for p in pays:
-            paid = local_dt_str(p["paid_at"], tz) if p["paid_at"] else "—"
-            user = p["username"] or "no_username"
-            method = p["method"] or "manual"
-            note = (f" • {p['note']}" if (p["note"] or "").strip() else "")
-            lines.append(f"{paid} • @{user} ({p['tg_id']}) — {p['amount']} ₸ [{method}]{note}")
-        await _send_chunked(bot, chat_id, lines)
-    else:
-        await bot.send_message(chat_id, "Платежей пока нет.")
-
-    if reqs:
-        await bot.send_message(chat_id, "Ожидают подтверждения:")
-        for r in reqs:
-            ik = InlineKeyboardBuilder()
-            ik.button(text="✅ Подтвердить", callback_data=f"adm_pay_ok:{r['tg_id']}")
-            ik.button(text="❌ Отклонить",  callback_data=f"adm_pay_no:{r['tg_id']}")
-            ik.adjust(2)
-            created = local_dt_str(r["created_at"], tz) if r["created_at"] else "—"
-            await bot.send_message(
-                chat_id,
-                f"@{r['username'] or 'no_username'} ({r['tg_id']}) — {r['amount']} ₸, {created}",
-                reply_markup=ik.as_markup(),
-            )
-    else:
-        await bot.send_message(chat_id, "Нет ожидающих заявок.")
+    sum30 = await counters.daily_sum("payments_sum", 30)
+    await bot.send_message(chat_id, f"💳 Итого за 30 дней: {sum30} ₸")
+    await _send_page(bot, chat_id, "y")
+    await _send_page(bot, chat_id, "r")
 
 async def _show_pay_requests(bot: Bot, chat_id: int):
-    async with get_db() as db:
-        cur = await db.execute("""
-            SELECT pr.id, pr.amount, pr.created_at, s.username, s.tg_id
-            FROM payment_requests pr JOIN students s ON s.id = pr.student_id
-            WHERE pr.status='pending' ORDER BY pr.created_at ASC
-        """); reqs = await cur.fetchall()
-    if not reqs:
-        await bot.send_message(chat_id, "Нет ожидающих заявок на оплату.")
-        return
-    await bot.send_message(chat_id, "Ожидают подтверждения:")
-    for r in reqs:
-        ik = InlineKeyboardBuilder()
-        ik.button(text="✅ Подтвердить", callback_data=f"adm_pay_ok:{r['tg_id']}")
-        ik.button(text="❌ Отклонить",  callback_data=f"adm_pay_no:{r['tg_id']}")
-        ik.adjust(2)
-        await bot.send_message(chat_id,
-            f"@{r['username'] or 'no_username'} ({r['tg_id']}) — {r['amount']} ₸, {r['created_at']}",
-            reply_markup=ik.as_markup())
+    await _send_page(bot, chat_id, "r")
 
 async def _show_onboarding_pending(bot: Bot, chat_id: int):
-    async with get_db() as db:
-        cur = await db.execute("""
-            SELECT id, tg_id, username, first_name, last_name, created_at
-            FROM students
-            WHERE onboarding_done = 1 AND COALESCE(approved, 0) = 0
-            ORDER BY created_at ASC
-        """); rows = await cur.fetchall()
-    if not rows:
-        await bot.send_message(chat_id, "Нет анкет на модерации.")
-        return
-    await bot.send_message(chat_id, "Анкеты на модерации:")
-    for r in rows:
-        card = (f"id:{r['id']} • tg_id:{r['tg_id']} @{r['username'] or '—'}\n"
-                f"{r['first_name'] or ''} {r['last_name'] or ''} • {r['created_at']}")
-        ik = InlineKeyboardBuilder()
-        ik.button(text="✅ Одобрить", callback_data=f"onb_ok:{r['id']}")
-        ik.button(text="❌ Отклонить", callback_data=f"onb_rej:{r['id']}")
-        ik.adjust(2)
-        await bot.send_message(chat_id, card, reply_markup=ik.as_markup())
+    await _send_page(bot, chat_id, "o")
 
 # ----- подтверждение/отклонение оплаты -----
 @router.callback_query(F.data.startswith("adm_pay_ok:"))
+@_refresh_page_after
 async def adm_pay_ok(cb: types.CallbackQuery):
     try:
-        _, course_code, tg_id_str = cb.data.split(":")
+        # adm_pay_ok:<курс>:<tg_id>[:pg:<список>:<id>]
+        course_code, tg_id_str = cb.data.split(":")[1:3]
         tg_id = int(tg_id_str)
     except (ValueError, IndexError):
         await cb.answer("Ошибка в данных кнопки.", show_alert=True)
@@ -581,29 +876,33 @@ async def adm_pay_ok(cb: types.CallbackQuery):
 
         # Создаём запись об оплате для конкретного курса
         now = now_utc_str()
-        await db.execute(
+        cur = await db.execute(
             "INSERT INTO payments(student_id, amount, course_code, method, note, paid_at, created_at) VALUES(?,?,?,?,?,?,?)",
             (sid, course.price, course.code, "manual", f"confirmed by {cb.from_user.id}", now, now),
         )
+        payment_id = cur.lastrowid
         # Закрываем заявку на оплату
         await db.execute(
             "UPDATE payment_requests SET status='confirmed', resolved_at=? WHERE student_id=? AND course_code=? AND status='pending'",
             (now, sid, course.code)
         )
+        # Уведомление ученику — в той же транзакции
+        await outbox.enqueue(
+            db, tg_id, f"✅ Доступ к курсу «{course.title}» открыт! Можешь начинать обучение.",
+            dedupe_key=f"pay_ok:{payment_id}",
+        )
         await db.commit()
+    outbox.notify_outbox()
 
     await cb.message.edit_text(f"{original_text}\n\n✅ Оплата курса «{course.title}» подтверждена.")
     await cb.answer("Подтверждено")
 
-    try:
-        await cb.bot.send_message(tg_id, f"✅ Доступ к курсу «{course.title}» открыт! Можешь начинать обучение.")
-    except Exception as e:
-        print(f"Не удалось уведомить студента {tg_id} об оплате: {e}")
-
 @router.callback_query(F.data.startswith("adm_pay_no:"))
+@_refresh_page_after
 async def adm_pay_no(cb: types.CallbackQuery):
     try:
-        _, course_code, tg_id_str = cb.data.split(":")
+        # adm_pay_ok:<курс>:<tg_id>[:pg:<список>:<id>]
+        course_code, tg_id_str = cb.data.split(":")[1:3]
         tg_id = int(tg_id_str)
     except (ValueError, IndexError):
         await cb.answer("Ошибка в данных кнопки.", show_alert=True)
@@ -638,6 +937,7 @@ async def adm_pay_no(cb: types.CallbackQuery):
 
 # ----- модерация онбординга -----
 @router.callback_query(F.data.startswith("onb_ok:"))
+@_refresh_page_after
 async def onb_ok(cb: types.CallbackQuery):
     if not _is_admin(cb.from_user.id):
         await cb.answer(); return
@@ -647,56 +947,44 @@ async def onb_ok(cb: types.CallbackQuery):
     original_text = cb.message.text
     await cb.message.edit_text(f"{original_text}\n\n⏳ Одобряю анкету...")
 
-    # 1) пометить как одобренного и достать tg_id
+    # Всё — одной транзакцией: одобрение, +50, ранг и уведомления в outbox
     async with get_db() as db:
-        await db.execute("UPDATE students SET approved=1, updated_at=? WHERE id=?",
-                         (now_utc_str(), sid))
-        await db.commit()
-        cur = await db.execute("SELECT tg_id, COALESCE(rank,'') AS rank FROM students WHERE id=?", (sid,))
+        # 1) достать tg_id и пометить как одобренного
+        cur = await db.execute("SELECT tg_id FROM students WHERE id=?", (sid,))
         row = await cur.fetchone()
+        if not row:
+            await cb.answer("Студент не найден", show_alert=True); return
 
-    if not row:
-        await cb.answer("Студент не найден", show_alert=True); return
-
-    tg_id = row["tg_id"]
-    prev_rank = row["rank"] or ""
-
-    # 2) безопасно начислить +50 за онбординг (идемпотентно по UNIQUE(student_id, source))
-    try:
-        await points.add(sid, "onboarding_bonus", 50)
-    except Exception:
-        pass
+        tg_id = row["tg_id"]
+        now = now_utc_str()
+        cur = await db.execute(
+            "UPDATE students SET approved=1, updated_at=? WHERE id=? AND COALESCE(approved,0)=0", (now, sid)
+        )
+        if cur.rowcount != 1:
+            await cb.message.edit_text(f"{original_text}\n\n✅ Уже было одобрено.")
+            await cb.answer("Уже одобрено ✅")
+            return
 
-    # 3) пересчитать ранг и сохранить rank/rank_points
-    total = await points.total(sid)
-    rank_name, next_thr = get_rank_by_points(total)
-    async with get_db() as db:
-        if rank_name != prev_rank:
-            await db.execute(
-                "UPDATE students SET rank=?, rank_points=?, updated_at=? WHERE id=?",
-                (rank_name, total, now_utc_str(), sid),
-            )
-        else:
-            await db.execute(
-                "UPDATE students SET rank_points=?, updated_at=? WHERE id=?",
-                (total, now_utc_str(), sid),
-            )
+        # 2-3) +50 за онбординг (идемпотентно) и ранг из нового баланса
+        balance = await points.award(db, sid, [("onboarding_bonus", 50)])
+        rank_name, total, next_thr = balance.rank, balance.total, balance.next_threshold
+
+        # 4) студенту — статус, баллы, ранг + меню
+        msg = f"✅ Твоя анкета одобрена! Доступ открыт.\nНачислено: +50 баллов.\n"
+        msg += f"🏅 Твой ранг: <b>{rank_name}</b> • Баллы: <b>{total}</b>"
+        if next_thr is not None:
+            msg += f"\n⬆️ До следующего ранга: <b>{next_thr - total}</b>"
+        await outbox.enqueue(db, tg_id, msg)
+        await outbox.enqueue(db, tg_id, "Открываю меню 👇", reply_markup=student_main_kb())
         await db.commit()
+    outbox.notify_outbox()
 
-    # 4) уведомления
     await cb.message.edit_text(f"{original_text}\n\n✅ Анкета одобрена.")
     await cb.answer("Анкета одобрена ✅", show_alert=True)
 
-    # студенту — статус, баллы, ранг + меню
-    msg = f"✅ Твоя анкета одобрена! Доступ открыт.\nНачислено: +50 баллов.\n"
-    msg += f"🏅 Твой ранг: <b>{rank_name}</b> • Баллы: <b>{total}</b>"
-    if next_thr is not None:
-        msg += f"\n⬆️ До следующего ранга: <b>{next_thr - total}</b>"
-    await cb.bot.send_message(tg_id, msg)
-    await cb.bot.send_message(tg_id, "Открываю меню 👇", reply_markup=student_main_kb())
-
 
 @router.callback_query(F.data.startswith("onb_rej:"))
+@_refresh_page_after
 async def onb_rej(cb: types.CallbackQuery):
     if not _is_admin(cb.from_user.id):
         await cb.answer(); return
@@ -731,58 +1019,106 @@ async def onb_rej(cb: types.CallbackQuery):
 async def msg_broadcast_start(m: types.Message, state: FSMContext):
     if not _is_admin(m.from_user.id):
         return
-    await state.set_state(BroadcastForm.waiting_text)
+    await state.set_state(BroadcastForm.waiting_segment)
     await m.answer(
-        "Введи текст рассылки.\n"
-        "Доступные коды: {name}, {first_name}, {last_name}, {username}, {tg_id}.\n"
-        "Пример: «Привет, {name}! Завтра урок в 19:00»\n\n"
+        "Кому шлём? Пример: «approved=1 course=course_general seen=14»\n\n"
+        f"{segments.SEGMENT_HELP}\n\n"
         "Напиши «Отмена» чтобы выйти."
     )
 
-@router.message(BroadcastForm.waiting_text, F.text.casefold() == "отмена")
+@router.message(StateFilter(BroadcastForm.waiting_segment, BroadcastForm.waiting_text), F.text.casefold() == "отмена")
 async def msg_broadcast_cancel(m: types.Message, state: FSMContext):
     await state.clear()
     await m.answer("Отменил рассылку.")
 
+@router.message(BroadcastForm.waiting_segment)
+async def msg_broadcast_segment(m: types.Message, state: FSMContext):
+    try:
+        seg = segments.parse(m.text or "")
+    except ValueError as e:
+        await m.answer(f"⚠️ {e}\nПопробуй ещё раз или «Отмена».")
+        return
+
+    # Пробный прогон: сколько получателей и сколько займёт отправка
+    total = await segments.count(seg)
+    if not total:
+        await m.answer(f"Аудитория «{segments.describe(seg)}» пуста. Задай другие фильтры или «Отмена».")
+        return
+    eta = segments.eta_seconds(total)
+    await state.update_data(segment=seg.to_json())
+    await state.set_state(BroadcastForm.waiting_text)
+    await m.answer(
+        f"Аудитория: {segments.describe(seg)}\n"
+        f"Получателей: {total}, отправка ≈ {eta // 60} мин {eta % 60} с.\n\n"
+        "Введи текст рассылки.\n"
+        f"Доступные коды: {broadcasts.TEMPLATE_CODES}.\n"
+        "Пример: «Привет, {name}! Завтра урок в 19:00»\n\n"
+        "Напиши «Отмена» чтобы выйти."
+    )
+
 @router.message(BroadcastForm.waiting_text)
 async def msg_broadcast_run(m: types.Message, state: FSMContext):
     if not _is_admin(m.from_user.id):
         return
-    tpl = m.text.strip()
+    tpl = (m.text or "").strip()
     if not tpl:
         await m.answer("Пустой текст, отправь ещё раз или «Отмена».")
         return
+    try:
+        # разбираем один раз: ошибки в кодах видны до старта, а не у 50k получателей
+        broadcasts.BroadcastTemplate(tpl)
+    except ValueError as e:
+        await m.answer(f"⚠️ {e}\nДоступны: {broadcasts.TEMPLATE_CODES}.")
+        return
+    data = await state.get_data()
+    seg = segments.Segment.from_json(data.get("segment"))
 
-    # берём все нужные поля для подстановки
-    async with get_db() as db:
-        cur = await db.execute("""
-            SELECT id, tg_id, username, first_name, last_name
-            FROM students
-            WHERE tg_id IS NOT NULL
-        """)
-        students = await cur.fetchall()
-
-    ok = fail = 0
-    await m.answer(f"Начинаю рассылку ({len(students)} получателей)…")
-
-    for s in students:
-        try:
-            text = render_broadcast(tpl, s)  # ← ПОДСТАВЛЯЕМ {name}, {first_name} и т.д.
-            await m.bot.send_message(s["tg_id"], text)
-            ok += 1
-        except Exception:
-            fail += 1
-        await asyncio.sleep(0.05)
-
+    # Рассылка живёт в БД и шлётся фоновым воркером — FSM админа не блокируется,
+    # а после рестарта она продолжится с сохранённого курсора.
+    bid = await broadcasts.create(tpl, seg, m.chat.id, m.from_user.id)
     await state.clear()
-    await m.answer(f"Готово. Успешно: {ok}, ошибок: {fail}.")
+
+    job = await broadcasts.get(bid)
+    msg = await m.answer(broadcasts.progress_text(job), reply_markup=broadcast_controls_kb(bid, job["status"]))
+    await broadcasts.set_progress_message(bid, msg.message_id)
+    broadcasts.notify_broadcasts()
+
+
+@router.callback_query(F.data.startswith("bc_pause:"))
+async def cb_broadcast_pause(cb: types.CallbackQuery):
+    bid = int(cb.data.split(":")[1])
+    ok = await broadcasts.set_status(bid, "paused", ("running",))
+    job = await broadcasts.get(bid)
+    if job:
+        await broadcasts.edit_progress(cb.bot, job)
+    await cb.answer("Пауза ⏸" if ok else "Рассылка уже не идёт.")
+
+
+@router.callback_query(F.data.startswith("bc_resume:"))
+async def cb_broadcast_resume(cb: types.CallbackQuery):
+    bid = int(cb.data.split(":")[1])
+    ok = await broadcasts.set_status(bid, "running", ("paused",))
+    job = await broadcasts.get(bid)
+    if job:
+        await broadcasts.edit_progress(cb.bot, job)
+    await cb.answer("Продолжаю ▶️" if ok else "Рассылка не на паузе.")
+
+
+@router.callback_query(F.data.startswith("bc_cancel:"))
+async def cb_broadcast_cancel(cb: types.CallbackQuery):
+    bid = int(cb.data.split(":")[1])
+    ok = await broadcasts.set_status(bid, "cancelled", ("running", "paused"))
+    job = await broadcasts.get(bid)
+    if job:
+        await broadcasts.edit_progress(cb.bot, job)
+    await cb.answer("Рассылка отменена ⛔" if ok else "Рассылка уже завершена.")
 
 @router.message(Command("db"))
 async def db_health(m: types.Message):
     try:
         async with get_db() as db:
             tables = []
-            for t in ("students","test_results","points"):
+            for t in ("students","test_results","points","outbox"):
                 try:
                     cur = await db.execute(f"SELECT COUNT(*) FROM {t}")
                     n = (await cur.fetchone())[0]
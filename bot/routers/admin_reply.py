@@ -6,6 +6,10 @@ from bot.config import get_settings, now_utc_str
 from bot.services.db import get_db
 
 router = Router(name="admin_reply")
+# Карточки с «Ответить» бывают в общей группе проверки — отвечают только админы
+_admins = set(get_settings().admin_ids or [])
+router.message.filter(F.from_user.id.in_(_admins))
+router.callback_query.filter(F.from_user.id.in_(_admins))
 
 from aiogram.exceptions import (
     TelegramAPIError,
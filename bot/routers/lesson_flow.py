@@ -10,8 +10,10 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.config import get_settings, now_utc_str, local_dt_str
 from bot.keyboards.student import next_t_inline
 from bot.routers.forms import SubmitForm, HelpForm
+from bot.services import active_progress
 from bot.services.db import get_db
 from bot.services.lessons import list_t_blocks, sort_materials
+from bot.services.reminder_worker import notify_due_changed
 
 router = Router(name="lesson_flow")
 
@@ -166,6 +168,8 @@ async def send_next_t_block(bot: Bot, chat_id: int, progress_id: int, first: boo
             await db.execute("UPDATE progress SET task_code='DONE', updated_at=? WHERE id=?",
                              (now_utc_str(), progress_id))
             await db.commit()
+        # сброс кэша — после commit: get() между ними закэшировал бы старый task_code
+        active_progress.invalidate(chat_id)
         dl = local_dt_str(pr["deadline_at"], settings.timezone) if pr["deadline_at"] else "—"
         await bot.send_message(
             chat_id,
@@ -195,11 +199,13 @@ async def send_next_t_block(bot: Bot, chat_id: int, progress_id: int, first: boo
             await db.execute("UPDATE progress SET task_code=?, updated_at=? WHERE id=?",
                              (t_code, now_utc_str(), progress_id))
             await db.commit()
+        active_progress.invalidate(chat_id)
     else:
         async with get_db() as db:
             await db.execute("UPDATE progress SET task_code='DONE', updated_at=? WHERE id=?",
                              (now_utc_str(), progress_id))
             await db.commit()
+        active_progress.invalidate(chat_id)
         dl = local_dt_str(pr["deadline_at"], settings.timezone) if pr["deadline_at"] else "—"
         await bot.send_message(
             chat_id,
@@ -225,6 +231,8 @@ async def cb_submit_start(cb: types.CallbackQuery, state: FSMContext):
     async with get_db() as db:
         await db.execute("UPDATE progress SET status='sent', updated_at=? WHERE id=?", (now_utc_str(), pid))
         await db.commit()
+    notify_due_changed()
+    active_progress.invalidate(cb.from_user.id)
     await state.set_state(SubmitForm.waiting_work)
     await state.update_data(progress_id=pid)
     await cb.answer()
@@ -249,5 +257,7 @@ async def cb_restart_lesson(cb: types.CallbackQuery):
         await db.execute("UPDATE progress SET task_code=NULL, status='sent', updated_at=? WHERE id=?",
                          (now_utc_str(), pid))
         await db.commit()
+    notify_due_changed()
+    active_progress.invalidate(cb.from_user.id)
     await cb.answer("Урок начат заново.")
     await send_next_t_block(cb.message.bot, cb.message.chat.id, pid, first=True)
\ No newline at end of file
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from aiogram import Router, F, types
-from aiogram.filters import CommandStart
+from aiogram.filters import CommandStart, ChatMemberUpdatedFilter, KICKED, MEMBER
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -10,6 +10,8 @@ from bot.keyboards.student import student_main_kb
 from bot.config import get_settings, now_utc_str
 from bot.services.db import get_db
 from bot.services import points
+from bot.services.reachability import mark_reachable, mark_unreachable
+from bot.services.admin_notify import notify_admins
 
 from bot.keyboards.admin import admin_main_reply_kb
 from aiogram.types import ReplyKeyboardRemove
@@ -61,6 +63,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
                 now_utc_str(),
             ),
         )
+        # снова написал — значит, бот не заблокирован
+        await mark_reachable(db, message.from_user.id)
         await db.commit()
 
 
@@ -89,6 +93,20 @@ async def cmd_start(message: types.Message, state: FSMContext):
     await message.answer(WELCOME_TEXT, reply_markup=ib.as_markup())
     await state.set_state(Onb.waiting_start)
 
+# только личка: бота убрали из группы проверки — это не ученик его заблокировал
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(member_status_changed=KICKED))
+async def on_bot_blocked(event: types.ChatMemberUpdated):
+    # ученик заблокировал бота — сразу исключаем из рассылок
+    await mark_unreachable(event.from_user.id, "bot blocked by user")
+
+
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(member_status_changed=MEMBER))
+async def on_bot_unblocked(event: types.ChatMemberUpdated):
+    async with get_db() as db:
+        await mark_reachable(db, event.from_user.id)
+        await db.commit()
+
+
 @router.callback_query(F.data == "about_maestroffs")
 async def cb_about_maestroffs(cb: types.CallbackQuery):
     txt = (
@@ -225,10 +243,11 @@ async def onb_rules_ok(cb: types.CallbackQuery, state: FSMContext):
         student_id = row["id"] if row else None
 
         # award onboarding bonus (+50), idempotent via UNIQUE(student_id, source)
-        # +50 за онбординг (идемпотентно)
+        # +50 за онбординг (идемпотентно) — вместе с балансом rank_points
         if student_id:
             try:
-                await points.add(student_id, "onboarding_bonus", 50)
+                await points.award(db, student_id, [("onboarding_bonus", 50)])
+                await db.commit()
             except Exception:
                 pass
 
@@ -272,13 +291,8 @@ async def onb_rules_ok(cb: types.CallbackQuery, state: FSMContext):
             f"@{cb.from_user.username or 'no_username'} • tg_id: {cb.from_user.id}\n"
         )
         # используем уже существующий инстанс бота
-        for admin_id in settings.admin_ids:
-            try:
-                ik = InlineKeyboardBuilder()
-
-                ik.button(text="✅ Одобрить", callback_data=f"onb_ok:{student_id}")
-                ik.button(text="❌ Отклонить", callback_data=f"onb_rej:{student_id}")
-                ik.adjust(2)
-                await cb.bot.send_message(admin_id, card, reply_markup=ik.as_markup())
-            except Exception:
-                pass
\ No newline at end of file
+        ik = InlineKeyboardBuilder()
+        ik.button(text="✅ Одобрить", callback_data=f"onb_ok:{student_id}")
+        ik.button(text="❌ Отклонить", callback_data=f"onb_rej:{student_id}")
+        ik.adjust(2)
+        await notify_admins(cb.bot, "onboarding", card, reply_markup=ik.as_markup())
\ No newline at end of file
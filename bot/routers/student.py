@@ -23,8 +23,10 @@ from bot.services.lessons import (
 
 from bot.services.lessons import list_l_lessons
 from bot.config import get_course
-from bot.services.admin_cards import render_submission_card
-from bot.services import points
+from bot.services.admin_cards import render_submission_card, save_card_messages
+from bot.services.admin_notify import notify_admins
+from bot.services import points, albums, assignments, active_progress
+from bot.middlewares.user_context import UserContext
 from bot.services.ranks import get_rank_by_points
 from bot.routers.forms import HelpForm, SubmitForm, LessonCodeForm # <<< ИЗМЕНЕНИЕ
 
@@ -33,6 +35,8 @@ from aiogram.filters import StateFilter
 from bot.services.admin_cards import help_reply_kb
 from aiogram import Router , types, F, Bot
 from bot.services.db import get_db
+from bot.services.reminder_worker import notify_due_changed
+from bot.services.release_notifier import mark_waiting, course_max_lesson
 from aiogram.types import FSInputFile
 from aiogram.filters import StateFilter
 from bot.keyboards.student import student_main_kb
@@ -53,8 +57,11 @@ KNOWN_BUTTONS = {
 }
 
 
-async def _submit_active(message: types.Message) -> bool:
-    """Пометить активное задание как submitted и разослать карточку админам + копию сообщения."""
+async def _submit_active(message: types.Message, parts: list[types.Message] | None = None) -> bool:
+    """
+    Пометить активное задание как submitted и разослать карточку админам + копию сообщения.
+    parts — все сообщения альбома (одна сдача, одна карточка, одна копия).
+    """
     # 1) найти активное задание
     async with get_db() as db:
         cur = await db.execute(
@@ -69,13 +76,18 @@ async def _submit_active(message: types.Message) -> bool:
 
         pid = row["pid"]
 
-        # 2) отметить submitted
+        # 2) отметить submitted (бронь прошлой проверки снимаем); сообщения сдачи запоминаем —
+        #    при переназначении новый ревьюер получит их копию
         now = now_utc_str()
+        source_ids = ",".join(str(m.message_id) for m in (parts or [message]))
         await db.execute(
-            "UPDATE progress SET status='submitted', submitted_at=?, updated_at=? WHERE id=?",
-            (now, now, pid),
+            "UPDATE progress SET status='submitted', submitted_at=?, updated_at=?, "
+            "claimed_by=NULL, claimed_at=NULL, source_chat_id=?, source_message_ids=? WHERE id=?",
+            (now, now, message.chat.id, source_ids, pid),
         )
         await db.commit()
+    notify_due_changed()  # через AUTO_APPROVE_DELAY_MINUTES сработает автоприём
+    active_progress.invalidate(message.from_user.id)
 
         # 3) взять данные для карточки
     async with get_db() as db:
@@ -86,7 +98,6 @@ async def _submit_active(message: types.Message) -> bool:
         prow = await cur.fetchone()
 
     from bot.services.admin_cards import render_submission_card
-    settings = get_settings()
 
     card_text, kb = render_submission_card(
         pid,
@@ -96,13 +107,14 @@ async def _submit_active(message: types.Message) -> bool:
         submitted_at_utc=prow["submitted_at"],
     )
 
-    # Карточка + копия сообщения каждому админу
-    for admin_id in settings.admin_ids:
-        try:
-            await message.bot.send_message(admin_id, card_text, reply_markup=kb)
-            await message.copy_to(admin_id)
-        except Exception:
-            pass
+    # Карточка + копия сообщения назначенному ревьюеру (или одним сообщением в группу проверки);
+    # id карточек — для общего статуса (admin_cards)
+    reviewer = await assignments.assign(pid)
+    text = f"{card_text}\n{assignments.reviewer_line(reviewer)}" if reviewer else card_text
+    sent = await notify_admins(
+        message.bot, "submissions", text, reply_markup=kb, copy_of=parts or message, only=reviewer
+    )
+    await save_card_messages(pid, message.from_user.id, card_text, sent)
 
     # 5) ответ ученику
     await message.answer("Работа отправлена ✅ Маестрофф пошел проверять")
@@ -139,7 +151,10 @@ async def training_program_menu(message: types.Message):
     F.content_type.in_({"photo", "video", "document"})
 )
 async def handle_submission_media(message: types.Message):
-    await _submit_active(message)
+    # альбом приходит N апдейтами — сдаём его один раз, когда соберутся все части
+    parts = await albums.collect(message)
+    if parts:
+        await _submit_active(parts[0], parts)
 
 
 
@@ -180,16 +195,9 @@ async def btn_help(message: types.Message, state: FSMContext):
 )
 
 @router.message(HelpForm.waiting_text, F.text)
-async def handle_help_text(message: types.Message, state: FSMContext):
-    settings = get_settings()
-
-    # 1) находим студента (без колонки full_name)
-    async with get_db() as db:
-        cur = await db.execute(
-            "SELECT id, first_name, last_name, username FROM students WHERE tg_id=?",
-            (message.from_user.id,)
-        )
-        srow = await cur.fetchone()
+async def handle_help_text(message: types.Message, state: FSMContext, ctx: UserContext):
+    # 1) находим студента — из контекста апдейта
+    srow = await ctx.student()
 
     if not srow:
         await state.clear()
@@ -237,25 +245,18 @@ async def handle_help_text(message: types.Message, state: FSMContext):
     kb = InlineKeyboardBuilder()
     kb.button(text="✉️ Ответить", callback_data=f"adm_reply:{message.from_user.id}")
     kb.adjust(1)
-    for admin_id in settings.admin_ids:
-        try:
-            await message.bot.send_message(admin_id, card, reply_markup=kb.as_markup())
-        except Exception:
-            pass
+    await notify_admins(message.bot, "help", card, reply_markup=kb.as_markup())
 
     await state.clear()
     await message.answer("Передал твоё сообщение маестроффам, как только освободятся сразу ответят ( обычно 1-5 минуты 👌")
 
 @router.message(F.text == "🏆 Мой прогресс")
-async def my_progress(message: types.Message):
+async def my_progress(message: types.Message, ctx: UserContext):
     # находим студента
-    async with get_db() as db:
-        cur = await db.execute("SELECT id FROM students WHERE tg_id=?", (message.from_user.id,))
-        row = await cur.fetchone()
-    if not row:
+    sid = await ctx.student_id()
+    if sid is None:
         await message.answer("Не нашел тебя в списке. Нажми /start")
         return
-    sid = row["id"]
 
     # очки и ранг
     total = await points.total(sid)
@@ -281,18 +282,13 @@ async def my_progress(message: types.Message):
     await message.answer(txt)
 
 @router.message(F.text == "🏅 Мой ранг")
-async def my_rank(message: types.Message):
+async def my_rank(message: types.Message, ctx: UserContext):
     # находим студента по tg_id
-    async with get_db() as db:
-        cur = await db.execute("SELECT id FROM students WHERE tg_id=?", (message.from_user.id,))
-        row = await cur.fetchone()
-
-    if not row:
+    sid = await ctx.student_id()
+    if sid is None:
         await message.answer("Профиль не найден. Нажми /start")
         return
 
-    sid = row["id"]
-
     # суммарные баллы и ранг
     total = await points.total(sid)
     rank_name, next_thr = get_rank_by_points(total)
@@ -304,7 +300,7 @@ async def my_rank(message: types.Message):
     await message.answer(txt)
 
 @router.message(F.text == "💳 Оплатить")
-async def pay(message: types.Message):
+async def pay(message: types.Message, ctx: UserContext):
     settings = get_settings()
     await _get_or_create_student(message.from_user.id, message.from_user.username)
     txt = (
@@ -313,21 +309,15 @@ async def pay(message: types.Message):
         "Поддержи проект и продолжи обучение всего за <b>4999</b> (это почти как пара кружек кофе ☕️)"
     )
     # Check if already has confirmed payment
-    async with get_db() as db:
-        cur = await db.execute(
-            "SELECT COUNT(*) AS c FROM payments p JOIN students s ON s.id=p.student_id WHERE s.tg_id=?",
-            (message.from_user.id,),
-        )
-        r = await cur.fetchone()
-        if r and r["c"] > 0:
-            await message.answer("Уговорил, можно было не платить ✅", reply_markup=student_main_kb())
-            return
+    if await ctx.paid_courses():
+        await message.answer("Уговорил, можно было не платить ✅", reply_markup=student_main_kb())
+        return
 
-        # Check pending request
+    async with get_db() as db:
+        # Check pending request (ученика уже загрузил ctx.paid_courses)
         cur = await db.execute(
-            "SELECT pr.id FROM payment_requests pr JOIN students s ON s.id=pr.student_id "
-            "WHERE s.tg_id=? AND pr.status='pending'",
-            (message.from_user.id,),
+            "SELECT id FROM payment_requests WHERE student_id=? AND status='pending'",
+            (await ctx.student_id(),),
         )
         pend = await cur.fetchone()
         include_button = True
@@ -344,7 +334,7 @@ async def pay(message: types.Message):
 
 
 @router.callback_query(F.data.startswith("paid_ipaid:"))
-async def cb_paid_paid(cb: types.CallbackQuery):
+async def cb_paid_paid(cb: types.CallbackQuery, ctx: UserContext):
     try:
         # <<< ИЗМЕНЕНИЕ: Парсим новые данные с кодом курса >>>
         _, course_code, tg_id_str = cb.data.split(":")
@@ -362,21 +352,17 @@ async def cb_paid_paid(cb: types.CallbackQuery):
         await cb.answer("Курс не найден.", show_alert=True)
         return
 
-    settings = get_settings()
-    async with get_db() as db:
-        cur = await db.execute("SELECT id FROM students WHERE tg_id=?", (tg_id,))
-        r = await cur.fetchone()
-        if not r:
-            await cb.answer("Профиль не найден", show_alert=True)
-            return
-        sid = r["id"]
-
-        # Проверяем, не оплачен ли уже ЭТОТ курс
-        cur = await db.execute("SELECT 1 FROM payments WHERE student_id=? AND course_code=?", (sid, course_code))
-        if await cur.fetchone():
-            await cb.answer("Этот курс уже оплачен ✅", show_alert=True)
-            return
+    # ученик и его оплаты — из контекста апдейта (tg_id == cb.from_user.id проверен выше)
+    sid = await ctx.student_id()
+    if sid is None:
+        await cb.answer("Профиль не найден", show_alert=True)
+        return
+    # Проверяем, не оплачен ли уже ЭТОТ курс
+    if course_code in await ctx.paid_courses():
+        await cb.answer("Этот курс уже оплачен ✅", show_alert=True)
+        return
 
+    async with get_db() as db:
         # Создаем заявку на оплату с указанием курса
         await db.execute(
             "INSERT INTO payment_requests(student_id, amount, status, course_code, created_at) VALUES(?,?,?,?,?)",
@@ -395,11 +381,7 @@ async def cb_paid_paid(cb: types.CallbackQuery):
     ik.button(text="✅ Подтвердить", callback_data=f"adm_pay_ok:{course.code}:{tg_id}")
     ik.button(text="❌ Отклонить", callback_data=f"adm_pay_no:{course.code}:{tg_id}")
     ik.adjust(1)
-    for admin_id in settings.admin_ids:
-        try:
-            await cb.bot.send_message(admin_id, card, reply_markup=ik.as_markup())
-        except Exception:
-            pass
+    await notify_admins(cb.bot, "payments", card, reply_markup=ik.as_markup())
 
     await cb.message.edit_text(cb.message.text + "\n\n✅ Заявка отправлена на проверку!")
     await cb.answer()
@@ -476,6 +458,9 @@ async def _issue_new_lesson(bot: Bot, tg_id: int, chat_id: int, course_code: str
         next_lesson_folder = next_l_after(course_path, last_num)
 
         if not next_lesson_folder:
+            # Ждём релиза: release_notifier напишет, когда в курсе появится урок новее
+            await mark_waiting(db, sid, course.code, max(last_num, course_max_lesson(course.code)))
+            await db.commit()
             await bot.send_message(chat_id,
                                    f"Новых уроков в курсе «{course.title}» пока нет. Я сообщу, когда они появятся 👌")
             return
@@ -498,6 +483,7 @@ async def _issue_new_lesson(bot: Bot, tg_id: int, chat_id: int, course_code: str
         cur = await db.execute("SELECT last_insert_rowid() AS id")
         pid = (await cur.fetchone())["id"]
         await db.commit()
+    notify_due_changed()
 
     # 6. Выдаем первый блок урока
     await bot.send_message(chat_id, f"Начинаем урок «{next_lesson_folder}» из курса «{course.title}»...")
@@ -604,7 +590,7 @@ async def handle_unhandled_photo(m: types.Message):
 # ... остальные обработчики
 
 @router.callback_query(F.data.startswith("show_course:"))
-async def show_course_lessons(cb: types.CallbackQuery):
+async def show_course_lessons(cb: types.CallbackQuery, ctx: UserContext):
     """
     Показывает список уроков для выбранного курса со статусами
     ✅ - пройден
@@ -621,15 +607,9 @@ async def show_course_lessons(cb: types.CallbackQuery):
     await cb.answer(f"Загружаю уроки курса «{course.title}»...")
 
     settings = get_settings()
-    sid = None
 
     # 1. Находим ID студента
-    async with get_db() as db:
-        cur = await db.execute("SELECT id FROM students WHERE tg_id=?", (cb.from_user.id,))
-        s_row = await cur.fetchone()
-        if s_row:
-            sid = s_row["id"]
-
+    sid = await ctx.student_id()
     if not sid:
         await cb.message.answer("Не нашел твой профиль. Нажми /start")
         return
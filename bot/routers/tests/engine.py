@@ -27,7 +27,7 @@ from bot.services.tests.progress import (
     PASS_THRESHOLD_PCT,
 )
 from bot.services.tests.registry import TestMeta
-from bot.config import get_settings
+from bot.services.admin_notify import notify_admins, targets
 
 router = Router(name="tests_engine")
 log = logging.getLogger(__name__)
@@ -355,14 +355,10 @@ async def _finish(user_id: int, bot: Bot) -> None:
             f"Telegram ID: {user_id}\n"
             f"Итог: {correct}/{total} ({pct}%) — {'ПРОЙДЕН' if passed else 'НЕ ПРОЙДЕН'}"
         )
-        settings = get_settings()
-        admin_ids = settings.admin_ids
-        if not admin_ids:
+        if not targets("tests"):
             log.warning("[tests_engine] skip admin notify: no ADMIN ids configured")
         else:
-            for aid in admin_ids:
-                with contextlib.suppress(Exception):
-                    await bot.send_message(aid, admin_msg)
+            await notify_admins(bot, "tests", admin_msg)
 
     except Exception:
         pass
@@ -508,11 +504,7 @@ async def on_quiz_cancel(cb: types.CallbackQuery, bot: Bot, state: FSMContext) -
             f"Ученик: {tg_user.full_name} {uname}\n"
             f"Telegram ID: {tg_user.id}"
         )
-        settings = get_settings()
-        admin_ids = settings.admin_ids
-        for aid in admin_ids:
-            with contextlib.suppress(Exception):
-                await bot.send_message(aid, admin_msg)
+        await notify_admins(bot, "tests", admin_msg)
     except Exception:
         pass
 
@@ -552,11 +544,7 @@ async def cancel_quiz_cmd(m: types.Message, state: FSMContext) -> None:
             f"Ученик: {tg_user.full_name} {uname}\n"
             f"Telegram ID: {uid}"
         )
-        settings = get_settings()
-        admin_ids = settings.admin_ids
-        for aid in admin_ids:
-            with contextlib.suppress(Exception):
-                await m.bot.send_message(aid, admin_msg)
+        await notify_admins(m.bot, "tests", admin_msg)
     except Exception:
         pass
 
@@ -0,0 +1,65 @@
+# bot/services/active_progress.py
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from bot.services.db import get_db
+
+# Сколько учеников держим в памяти (LRU) и сколько живёт запись.
+# Основной механизм — invalidate() из мест, меняющих задание; TTL страхует от правок в обход них
+# (другой процесс, ручные правки БД).
+ACTIVE_CACHE_SIZE = 10_000
+ACTIVE_CACHE_TTL = 300
+
+
+@dataclass(frozen=True)
+class ActiveProgress:
+    pid: int
+    task_code: str | None
+    status: str
+
+    @property
+    def done(self) -> bool:
+        """Все разделы урока пройдены — можно сдавать."""
+        return (self.task_code or "") == "DONE"
+
+
+# tg_id -> (ActiveProgress или None — активного нет, момент загрузки)
+_cache: OrderedDict[int, tuple[ActiveProgress | None, float]] = OrderedDict()
+
+
+async def get(tg_id: int) -> ActiveProgress | None:
+    """Последнее незавершённое задание ученика (sent/returned). Промах кеша — один запрос."""
+    hit = _cache.get(tg_id)
+    if hit is not None and time.monotonic() - hit[1] < ACTIVE_CACHE_TTL:
+        _cache.move_to_end(tg_id)
+        return hit[0]
+
+    async with get_db() as db:
+        cur = await db.execute(
+            """
+            SELECT p.id, p.task_code, p.status
+            FROM progress p
+            JOIN students s ON s.id = p.student_id
+            WHERE s.tg_id=? AND p.status IN ('sent','returned')
+            ORDER BY p.id DESC
+            LIMIT 1
+            """,
+            (tg_id,),
+        )
+        row = await cur.fetchone()
+    value = ActiveProgress(row["id"], row["task_code"], row["status"]) if row else None
+    _cache[tg_id] = (value, time.monotonic())
+    _cache.move_to_end(tg_id)
+    while len(_cache) > ACTIVE_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return value
+
+
+def invalidate(*tg_ids: int | None) -> None:
+    """Задание ученика изменилось (выдано, раздел, сдано, принято, возвращено, перезапущено)."""
+    for tg_id in tg_ids:
+        if tg_id is not None:
+            _cache.pop(tg_id, None)
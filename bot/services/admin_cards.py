@@ -2,10 +2,42 @@
 
 from __future__ import annotations
 
-from aiogram import types
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot, types
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardMarkup
 
 from bot.config import get_settings, local_dt_str, now_utc_str
+from bot.services import sender
+from bot.services.db import get_db
+
+log = logging.getLogger("maestro")
+
+# Взятая работа закреплена за админом столько минут; потом её может забрать другой
+CLAIM_TTL_MINUTES = 30
+# Сколько копий карточки правим одновременно (сверху — общий лимитер sender)
+CARD_EDIT_CONCURRENCY = 5
+
+# Фоновые правки карточек: держим ссылки, чтобы задачи не собрал GC
+_pending: set[asyncio.Task] = set()
+
+
+def submission_kb(pid: int, tg_id: int, *, claim: bool = True, review: bool = True,
+                  add_open_chat_button: bool = True) -> InlineKeyboardMarkup:
+    """Кнопки карточки сдачи: взять / принять / вернуть / чат."""
+    kb = InlineKeyboardBuilder()
+    if claim:
+        kb.button(text="🙋 Беру на проверку", callback_data=f"p_claim:{pid}")
+    if review:
+        kb.button(text="✅ Принять", callback_data=f"p_ok:{pid}")
+        kb.button(text="↩️ Вернуть", callback_data=f"p_back:{pid}")
+    if add_open_chat_button:
+        kb.button(text="💬 Открыть чат", url=f"tg://user?id={tg_id}")
+        kb.button(text="💬 Ответить", callback_data=f"adm_reply:{tg_id}")  # <-- новая кнопка
+    kb.adjust(1)
+    return kb.as_markup()
 
 
 def render_submission_card(
@@ -35,15 +67,159 @@ def render_submission_card(
     ]
     card_text = "\n".join([title, *lines])
 
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Принять", callback_data=f"p_ok:{pid}")
-    kb.button(text="↩️ Вернуть", callback_data=f"p_back:{pid}")
-    if add_open_chat_button:
-        kb.button(text="💬 Открыть чат", url=f"tg://user?id={tg_user.id}")
-        kb.button(text="💬 Ответить", callback_data=f"adm_reply:{tg_user.id}")  # <-- новая кнопка
-    kb.adjust(1)
+    return card_text, submission_kb(pid, tg_user.id, add_open_chat_button=add_open_chat_button)
+
+
+def admin_name(user: types.User) -> str:
+    return f"@{user.username}" if user.username else user.full_name
+
+
+# ----------------- общее состояние карточек -----------------
+# admin_cards(pid, chat_id, message_id, text, tg_id): где лежит копия карточки у каждого админа.
+# Статус карточки пишем в каждую копию, чтобы админы не открывали уже разобранную работу.
+
+async def save_card_messages(
+    pid: int, tg_id: int, text: str, sent: list[tuple[int, int]], *, replace: bool = True
+) -> None:
+    """
+    Запомнить message_id карточки у каждого админа.
+    replace — сдача заново: старые копии забываем; иначе добавляем (переназначение).
+    """
+    async with get_db() as db:
+        if replace:
+            await db.execute("DELETE FROM admin_cards WHERE pid=?", (pid,))
+        await db.executemany(
+            "INSERT OR REPLACE INTO admin_cards(pid, chat_id, message_id, text, tg_id) VALUES(?,?,?,?,?)",
+            [(pid, chat_id, message_id, text, tg_id) for chat_id, message_id in sent],
+        )
+        await db.commit()
+
+
+async def card_text(pid: int) -> tuple[str, int] | None:
+    """(текст карточки, tg_id ученика) из любой сохранённой копии."""
+    async with get_db() as db:
+        cur = await db.execute("SELECT text, tg_id FROM admin_cards WHERE pid=? LIMIT 1", (pid,))
+        row = await cur.fetchone()
+    return (row["text"], row["tg_id"]) if row else None
+
+
+async def card_message(pid: int, chat_id: int) -> int | None:
+    """message_id копии карточки pid в чате chat_id, если она есть."""
+    async with get_db() as db:
+        cur = await db.execute("SELECT message_id FROM admin_cards WHERE pid=? AND chat_id=?", (pid, chat_id))
+        row = await cur.fetchone()
+    return row["message_id"] if row else None
+
+
+# Работу может разобрать админ: брони нет, она его или истекла. Параметры: admin_id, claim_cutoff()
+CLAIM_FREE_SQL = "(claimed_by IS NULL OR claimed_by=? OR claimed_at <= ?)"
+
+
+def claim_cutoff() -> str:
+    """Брони, взятые раньше этого момента (UTC, формат now_utc_str), истекли."""
+    return (datetime.now(timezone.utc) - timedelta(minutes=CLAIM_TTL_MINUTES)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _claim_expired(claimed_at: str | None) -> bool:
+    if not claimed_at:
+        return True
+    dt = datetime.fromisoformat(claimed_at.replace("Z", "+00:00"))
+    return datetime.now(timezone.utc) - dt > timedelta(minutes=CLAIM_TTL_MINUTES)
+
+
+async def claim(pid: int, admin_id: int) -> tuple[str, int | None]:
+    """
+    Закрепить работу за админом. Возвращает (статус, кто держит):
+    claimed — взял сейчас; mine — уже его; taken — держит другой; not_submitted / missing.
+    Чужую бронь старше CLAIM_TTL_MINUTES можно перехватить.
+    """
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT status, claimed_by, claimed_at FROM progress WHERE id=?", (pid,))
+        row = await cur.fetchone()
+        if not row:
+            await db.rollback()
+            return "missing", None
+        if row["status"] != "submitted":
+            await db.rollback()
+            return "not_submitted", row["claimed_by"]
+        if row["claimed_by"] == admin_id:
+            await db.rollback()
+            return "mine", admin_id
+        if row["claimed_by"] and not _claim_expired(row["claimed_at"]):
+            await db.rollback()
+            return "taken", row["claimed_by"]
+        await db.execute(
+            "UPDATE progress SET claimed_by=?, claimed_at=? WHERE id=?", (admin_id, now_utc_str(), pid)
+        )
+        await db.commit()
+    return "claimed", admin_id
+
+
+async def claim_holder(pid: int) -> int | None:
+    """Кто сейчас держит работу (бронь не истекла), иначе None."""
+    async with get_db() as db:
+        cur = await db.execute("SELECT claimed_by, claimed_at FROM progress WHERE id=?", (pid,))
+        row = await cur.fetchone()
+    if not row or not row["claimed_by"] or _claim_expired(row["claimed_at"]):
+        return None
+    return row["claimed_by"]
+
+
+async def update_copies(
+    bot: Bot,
+    pid: int,
+    status_line: str,
+    *,
+    owner: int | None = None,
+    final: bool = False,
+    skip: tuple[int, int] | None = None,
+) -> None:
+    """
+    Дописать status_line во все копии карточки pid.
+    skip — (chat_id, message_id) копии, которую вызывающий уже поправил сам;
+    другие карточки в том же чате (например, из очереди) правим как обычно.
+    owner — у него остаются кнопки проверки, у остальных только «забрать» (после TTL);
+    в группе проверки копия одна на всех — кнопки проверки остаются (чужую бронь проверяет p_ok);
+    final — работа разобрана: кнопки убираем у всех и забываем копии.
+    """
+    async with get_db() as db:
+        cur = await db.execute("SELECT chat_id, message_id, text, tg_id FROM admin_cards WHERE pid=?", (pid,))
+        rows = await cur.fetchall()
+        if final:
+            await db.execute("DELETE FROM admin_cards WHERE pid=?", (pid,))
+            await db.commit()
+
+    sem = asyncio.Semaphore(CARD_EDIT_CONCURRENCY)
+
+    async def _one(r) -> None:
+        if (r["chat_id"], r["message_id"]) == skip:
+            return
+        if final:
+            markup = None
+        elif r["chat_id"] == owner or r["chat_id"] < 0:
+            markup = submission_kb(pid, r["tg_id"], claim=False)
+        else:
+            markup = submission_kb(pid, r["tg_id"], review=False)
+        async with sem:
+            await sender.edit_message_text(
+                bot, r["chat_id"], r["message_id"], f"{r['text']}\n\n{status_line}", reply_markup=markup
+            )
+
+    await asyncio.gather(*(_one(r) for r in rows))
+
+
+def update_copies_later(bot: Bot, pid: int, status_line: str, **kwargs) -> None:
+    """То же, что update_copies, но в фоне: обработчик отвечает админу сразу."""
+    async def _run() -> None:
+        try:
+            await update_copies(bot, pid, status_line, **kwargs)
+        except Exception as e:
+            log.warning("admin card update pid=%s failed: %s", pid, e)
 
-    return card_text, kb.as_markup()
+    task = asyncio.create_task(_run())
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
 
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardMarkup
 
@@ -0,0 +1,90 @@
+# bot/services/admin_notify.py
+from __future__ import annotations
+
+import logging
+
+from aiogram import Bot, types
+from aiogram.utils.keyboard import InlineKeyboardMarkup
+
+from bot.config import get_settings
+
+log = logging.getLogger("maestro")
+
+# Категории уведомлений = темы форума в группе проверки (REVIEW_TOPICS)
+CATEGORIES = ("submissions", "payments", "help", "onboarding", "tests")
+
+_gate: tuple[int | None, frozenset[int]] | None = None
+
+
+def targets(category: str, only: int | None = None) -> list[tuple[int, int | None]]:
+    """
+    Куда слать уведомление категории: [(chat_id, message_thread_id)].
+    Есть REVIEW_CHAT_ID — одно сообщение в группу (в тему категории), иначе — каждому админу в личку
+    (only — одному назначенному админу).
+    """
+    settings = get_settings()
+    if settings.review_chat_id:
+        return [(settings.review_chat_id, settings.review_topics.get(category))]
+    if only is not None:
+        return [(only, None)]
+    return [(admin_id, None) for admin_id in settings.admin_ids]
+
+
+async def notify_admins(
+    bot: Bot,
+    category: str,
+    text: str,
+    *,
+    reply_markup: InlineKeyboardMarkup | None = None,
+    copy_of: types.Message | list[types.Message] | None = None,
+    copy_ids: tuple[int, list[int]] | None = None,
+    only: int | None = None,
+) -> list[tuple[int, int]]:
+    """
+    Карточка (и копия сообщения ученика copy_of) всем получателям категории.
+    copy_ids — то же по id (чат, [сообщения]), когда объектов Message уже нет (переназначение).
+    Альбом (несколько сообщений) копируется одним вызовом copy_messages.
+    Возвращает [(chat_id, message_id)] отправленных карточек. Ошибки — в лог, без исключения.
+    """
+    if copy_of is not None:
+        parts = copy_of if isinstance(copy_of, list) else [copy_of]
+        copy_ids = (parts[0].chat.id, [m.message_id for m in parts])
+    sent: list[tuple[int, int]] = []
+    for chat_id, thread_id in targets(category, only):
+        try:
+            msg = await bot.send_message(chat_id, text, reply_markup=reply_markup, message_thread_id=thread_id)
+            sent.append((chat_id, msg.message_id))
+            if copy_ids and len(copy_ids[1]) > 1:
+                await bot.copy_messages(
+                    chat_id, from_chat_id=copy_ids[0], message_ids=copy_ids[1], message_thread_id=thread_id,
+                )
+            elif copy_ids and copy_ids[1]:
+                await bot.copy_message(
+                    chat_id, from_chat_id=copy_ids[0], message_id=copy_ids[1][0], message_thread_id=thread_id,
+                )
+        except Exception as e:
+            log.warning("admin notify %s -> %s failed: %s", category, chat_id, e)
+    return sent
+
+
+def review_chat_gate(message: types.Message, raw_state: str | None = None) -> bool:
+    """
+    Фильтр сообщений для Dispatcher: личка — как раньше.
+    Из группы проверки пропускаем только админов с командой или в FSM (например, ответ ученику),
+    чтобы переписка в группе не попадала в ученические хендлеры.
+    """
+    global _gate
+    if message.chat.type == "private":
+        return True
+    if _gate is None:
+        settings = get_settings()
+        _gate = (settings.review_chat_id, frozenset(settings.admin_ids))
+    review_chat_id, admins = _gate
+    if not review_chat_id:
+        return True
+    return (
+        message.chat.id == review_chat_id
+        and message.from_user is not None
+        and message.from_user.id in admins
+        and (raw_state is not None or (message.text or "").startswith("/"))
+    )
@@ -0,0 +1,36 @@
+# bot/services/albums.py
+from __future__ import annotations
+
+import asyncio
+
+from aiogram import types
+
+# Telegram шлёт фото альбома отдельными апдейтами почти подряд:
+# ждём, пока новые части не перестанут приходить это время
+ALBUM_WINDOW_SECONDS = 1.0
+
+# media_group_id -> части альбома в порядке прихода
+_albums: dict[str, list[types.Message]] = {}
+
+
+async def collect(message: types.Message) -> list[types.Message] | None:
+    """
+    Собирает альбом по media_group_id.
+    Первая часть ждёт окно и возвращает весь альбом (по message_id); остальные — None, их уже учли.
+    Сообщение не из альбома возвращается как есть, без ожидания.
+    """
+    group_id = message.media_group_id
+    if not group_id:
+        return [message]
+    parts = _albums.get(group_id)
+    if parts is not None:
+        parts.append(message)
+        return None
+
+    parts = _albums[group_id] = [message]
+    seen = 0
+    while seen != len(parts):
+        seen = len(parts)
+        await asyncio.sleep(ALBUM_WINDOW_SECONDS)
+    _albums.pop(group_id, None)
+    return sorted(parts, key=lambda m: m.message_id)
@@ -0,0 +1,156 @@
+# bot/services/approvals.py
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from typing import Optional
+
+import aiosqlite
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from bot.config import now_utc_str
+from bot.services import active_progress, admin_cards, assignments, outbox, points
+from bot.services.db import get_db
+
+LESSON_REWARD = 100
+# Бонусы за модули: сколько принятых уроков → (source, баллы, текст)
+MODULE_BONUSES = {
+    8: ("module1_bonus", 500, "🎉 Поздравляем!\nТы закрыл 1-й модуль — 8 уроков 💪\n\n🎯 Бонус: +500 баллов"),
+    16: ("module2_bonus", 500, "🏆 Финал!\nТы прошёл 16 уроков.\n\n🎯 Бонус: +500 баллов\nБейдж: «Выпускник Maestro» 🏅"),
+}
+
+MOTIVATION_TEXTS = [
+    "Красавчик! Держим темп 💪",
+    "С каждым уроком ты сильнее 🎸",
+    "Отличный прогресс — едем дальше! 🚀",
+]
+AUTO_APPROVE_TEXT = "✅ Твоя работа была автоматически принята. Держи 100 баллов!"
+
+
+@dataclass
+class ApprovalResult:
+    """
+    status: approved — приняли сейчас; already — уже была принята;
+    not_submitted — работа не на проверке; missing — нет такой работы;
+    taken — работу держит другой админ (бронь проверяется в той же транзакции).
+    """
+    status: str
+    pid: int
+    student_id: Optional[int] = None
+    tg_id: Optional[int] = None
+    lesson_code: Optional[str] = None
+    balance: Optional[points.Balance] = None
+    bonus_text: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "approved"
+
+
+def student_text(res: ApprovalResult) -> str:
+    """Сообщение ученику о принятой работе (ранг, бонус, счёт)."""
+    b = res.balance
+    text = f"✅ Работа принята! +{LESSON_REWARD} баллов 🎯"
+    if res.bonus_text:
+        text += f"\n\n{res.bonus_text}"
+    text += f"\nТвой счёт: <b>{b.total}</b> баллов"
+    if b.rank_changed and b.next_threshold is not None:
+        text = (f"🏅 Новый ранг: <b>{b.rank}</b>!\nТвои баллы: <b>{b.total}</b>"
+                f"\n⬆️ До следующего ранга: <b>{b.next_threshold - b.total}</b>\n\n{text}")
+    return text
+
+
+async def _approve_in(
+    db: aiosqlite.Connection, pid: int, auto: bool, admin_id: int | None = None
+) -> ApprovalResult:
+    """
+    Принимает одну работу в текущей транзакции db: статус, баллы, бонус, ранг, outbox.
+    admin_id — кто принимает: чужую живую бронь не трогаем. Автоприём (None) брони не смотрит.
+    """
+    now = now_utc_str()
+    guard, params = "", ()
+    if admin_id is not None:
+        guard, params = f" AND {admin_cards.CLAIM_FREE_SQL}", (admin_id, admin_cards.claim_cutoff())
+    cur = await db.execute(
+        "UPDATE progress SET status='approved', approved_at=?, updated_at=? "
+        f"WHERE id=? AND status='submitted'{guard} RETURNING student_id, lesson_code",
+        (now, now, pid, *params),
+    )
+    prow = await cur.fetchone()
+    await cur.close()
+    if not prow:
+        cur = await db.execute("SELECT status FROM progress WHERE id=?", (pid,))
+        row = await cur.fetchone()
+        if not row:
+            return ApprovalResult("missing", pid)
+        if row["status"] == "submitted":
+            return ApprovalResult("taken", pid)
+        return ApprovalResult("already" if row["status"] == "approved" else "not_submitted", pid)
+
+    sid = prow["student_id"]
+    cur = await db.execute("SELECT tg_id FROM students WHERE id=?", (sid,))
+    srow = await cur.fetchone()
+    tg_id = srow["tg_id"] if srow else None
+
+    # номер принятой работы — по индексу (student_id, status)
+    cur = await db.execute(
+        "SELECT COUNT(*) AS c FROM progress WHERE student_id=? AND status='approved'", (sid,)
+    )
+    approved_cnt = (await cur.fetchone())["c"]
+
+    source = f"lesson_approved_auto:{pid}" if auto else f"lesson_approved:{pid}"
+    awards = [(source, LESSON_REWARD)]
+    bonus_text = None
+    if approved_cnt in MODULE_BONUSES:
+        bonus_source, bonus_amount, bonus_text = MODULE_BONUSES[approved_cnt]
+        awards.append((f"{bonus_source}:s{sid}", bonus_amount))
+    balance = await points.award(db, sid, awards)
+
+    res = ApprovalResult("approved", pid, sid, tg_id, prow["lesson_code"], balance, bonus_text)
+
+    # Уведомления — в outbox той же транзакцией: доставит воркер, с повторами
+    if tg_id:
+        if auto:
+            text = AUTO_APPROVE_TEXT + (f"\n\n{bonus_text}" if bonus_text else "")
+            await outbox.enqueue(db, tg_id, text, dedupe_key=f"auto_approve:{pid}")
+        else:
+            kb = InlineKeyboardBuilder()
+            kb.button(text="📚 Следующий урок", callback_data=f"stu:take_next:{sid}")
+            kb.adjust(1)
+            await outbox.enqueue(db, tg_id, student_text(res), dedupe_key=f"p_ok:{pid}")
+            await outbox.enqueue(db, tg_id, random.choice(MOTIVATION_TEXTS), reply_markup=kb.as_markup(),
+                                 dedupe_key=f"p_ok:{pid}:next")
+    return res
+
+
+async def approve_many(
+    pids: list[int], *, auto: bool = False, admin_id: int | None = None
+) -> list[ApprovalResult]:
+    """Несколько работ — одной транзакцией; результат по каждой в том же порядке."""
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        results = [await _approve_in(db, pid, auto, admin_id) for pid in pids]
+        await db.commit()
+    if any(r.ok for r in results):
+        outbox.notify_outbox()
+        active_progress.invalidate(*(r.tg_id for r in results if r.ok))
+        await assignments.finish([r.pid for r in results if r.ok], "auto" if auto else "approved")
+    return results
+
+
+async def approve_submission(
+    pid: int, *, auto: bool = False, admin_id: int | None = None
+) -> ApprovalResult:
+    """
+    Принимает работу pid одной транзакцией (BEGIN IMMEDIATE — без гонок с другим админом
+    и автопринятием). Сообщения для админа строит вызывающий по результату, после commit.
+    """
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        res = await _approve_in(db, pid, auto, admin_id)
+        await db.commit()
+    if res.ok:
+        outbox.notify_outbox()
+        active_progress.invalidate(res.tg_id)
+        await assignments.finish([pid], "auto" if auto else "approved")
+    return res
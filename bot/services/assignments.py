@@ -0,0 +1,216 @@
+# bot/services/assignments.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import statistics
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from aiogram import Bot
+
+from bot.config import get_settings, now_utc_str
+from bot.services import admin_cards, sender
+from bot.services.admin_notify import notify_admins
+from bot.services.db import get_db
+
+log = logging.getLogger("maestro")
+
+# Не проверил за столько минут — работа уходит другому админу
+ASSIGN_SLA_MINUTES = 60
+# Как часто ищем просроченные назначения (и пересверяем счётчики с БД)
+ASSIGN_CHECK_SECONDS = 60
+# least_loaded — меньше всего открытых работ (равные — по кругу); round_robin — строго по кругу
+ASSIGN_STRATEGY = "least_loaded"
+# Окно для статистики ревьюеров
+STATS_DAYS = 30
+
+# admin_id -> открытых назначений; None — ещё не загружали из review_assignments
+_open: dict[int, int] | None = None
+_rr = 0
+_lock = asyncio.Lock()
+
+
+def _utc_iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+async def _counts() -> dict[int, int]:
+    global _open
+    if _open is None:
+        async with get_db() as db:
+            cur = await db.execute(
+                "SELECT admin_id, COUNT(*) AS c FROM review_assignments WHERE finished_at IS NULL GROUP BY admin_id"
+            )
+            _open = {r["admin_id"]: r["c"] for r in await cur.fetchall()}
+    return _open
+
+
+def _pick(counts: dict[int, int], exclude: Iterable[int]) -> int | None:
+    """Следующий ревьюер по ASSIGN_STRATEGY среди админов, кроме exclude."""
+    global _rr
+    admins = [a for a in get_settings().admin_ids if a not in set(exclude)]
+    if not admins:
+        return None
+    _rr += 1
+    ordered = admins[_rr % len(admins):] + admins[:_rr % len(admins)]
+    if ASSIGN_STRATEGY == "round_robin":
+        return ordered[0]
+    return min(ordered, key=lambda a: counts.get(a, 0))
+
+
+async def assign(pid: int, *, reviewer: int | None = None, exclude: Iterable[int] = ()) -> int | None:
+    """
+    Назначить работу ревьюеру (reviewer — явно, иначе выбираем сами). Возвращает admin_id.
+    Открытое назначение на другого закрывается как reassigned; на того же — остаётся,
+    но при явном reviewer (админ взял работу) срок SLA отсчитывается заново.
+    """
+    async with _lock:
+        counts = await _counts()
+        async with get_db() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cur = await db.execute(
+                "SELECT id, admin_id FROM review_assignments WHERE pid=? AND finished_at IS NULL", (pid,)
+            )
+            current = await cur.fetchone()
+            if current and (reviewer is None or current["admin_id"] == reviewer) \
+                    and current["admin_id"] not in set(exclude):
+                if reviewer is not None:
+                    await db.execute(
+                        "UPDATE review_assignments SET assigned_at=? WHERE id=?", (now_utc_str(), current["id"])
+                    )
+                    await db.commit()
+                else:
+                    await db.rollback()
+                return current["admin_id"]
+
+            reviewer = reviewer or _pick(counts, exclude)
+            if reviewer is None:
+                await db.rollback()
+                return current["admin_id"] if current else None
+            now = now_utc_str()
+            if current:
+                await db.execute(
+                    "UPDATE review_assignments SET finished_at=?, outcome='reassigned' WHERE id=?",
+                    (now, current["id"]),
+                )
+            await db.execute(
+                "INSERT INTO review_assignments(pid, admin_id, assigned_at) VALUES(?,?,?)", (pid, reviewer, now)
+            )
+            await db.commit()
+        if current:
+            counts[current["admin_id"]] = max(0, counts.get(current["admin_id"], 0) - 1)
+        counts[reviewer] = counts.get(reviewer, 0) + 1
+        return reviewer
+
+
+async def finish(pids: Iterable[int], outcome: str) -> None:
+    """Работы разобраны (approved / auto / returned / stale): закрыть назначения."""
+    pids = list(pids)
+    if not pids:
+        return
+    marks = ",".join("?" * len(pids))
+    async with _lock:
+        counts = await _counts()
+        async with get_db() as db:
+            cur = await db.execute(
+                f"UPDATE review_assignments SET finished_at=?, outcome=? "
+                f"WHERE pid IN ({marks}) AND finished_at IS NULL RETURNING admin_id",
+                (now_utc_str(), outcome, *pids),
+            )
+            closed = [r["admin_id"] for r in await cur.fetchall()]
+            await db.commit()
+        for admin_id in closed:
+            counts[admin_id] = max(0, counts.get(admin_id, 0) - 1)
+
+
+async def reviewer_stats(days: int = STATS_DAYS) -> list[tuple[int, int, int, float | None]]:
+    """[(admin_id, открыто, проверено за days, медиана минут от назначения до проверки)]."""
+    since = _utc_iso(datetime.now(timezone.utc) - timedelta(days=days))
+    async with get_db() as db:
+        cur = await db.execute(
+            "SELECT admin_id, (julianday(finished_at) - julianday(assigned_at)) * 1440 AS minutes "
+            "FROM review_assignments WHERE outcome IN ('approved','returned') AND finished_at >= ?",
+            (since,),
+        )
+        latencies: dict[int, list[float]] = {}
+        for r in await cur.fetchall():
+            latencies.setdefault(r["admin_id"], []).append(r["minutes"])
+    counts = await _counts()
+    admins = sorted(set(get_settings().admin_ids) | set(counts) | set(latencies))
+    return [
+        (a, counts.get(a, 0), len(latencies.get(a, [])),
+         statistics.median(latencies[a]) if latencies.get(a) else None)
+        for a in admins
+    ]
+
+
+async def reassign_overdue(bot: Bot) -> int:
+    """
+    Назначения старше ASSIGN_SLA_MINUTES — другому админу. Возвращает число переназначенных.
+    Работы под живой бронью (админ нажал «Беру») не трогаем — её держатель уже проверяет.
+    В личке новый ревьюер получает карточку и копию сдачи ученика (progress.source_*);
+    в группе проверки карточка одна на всех — в ней только меняем строку «Проверяет».
+    """
+    cutoff = _utc_iso(datetime.now(timezone.utc) - timedelta(minutes=ASSIGN_SLA_MINUTES))
+    async with get_db() as db:
+        cur = await db.execute(
+            "SELECT a.pid, a.admin_id, p.status, p.source_chat_id, p.source_message_ids "
+            "FROM review_assignments a JOIN progress p ON p.id = a.pid "
+            "WHERE a.finished_at IS NULL AND a.assigned_at < ? "
+            "AND NOT (p.status='submitted' AND p.claimed_by IS NOT NULL AND p.claimed_at > ?) "
+            "ORDER BY a.assigned_at",
+            (cutoff, admin_cards.claim_cutoff()),
+        )
+        overdue = await cur.fetchall()
+    group = bool(get_settings().review_chat_id)
+
+    # работу уже разобрали в обход назначения (очередь, автоприём до появления назначений)
+    await finish([r["pid"] for r in overdue if r["status"] != "submitted"], "stale")
+
+    moved = 0
+    for r in overdue:
+        if r["status"] != "submitted":
+            continue
+        reviewer = await assign(r["pid"], exclude=[r["admin_id"]])
+        if reviewer is None or reviewer == r["admin_id"]:
+            continue  # некому передать — остаётся у текущего
+        moved += 1
+        note = f"⏰ Переназначено: не проверено за {ASSIGN_SLA_MINUTES} мин.\n{reviewer_line(reviewer)}"
+        if group:
+            await admin_cards.update_copies(bot, r["pid"], note)
+            continue
+        card = await admin_cards.card_text(r["pid"])
+        if not card:
+            continue
+        text, tg_id = card
+        # у нового ревьюера уже была копия (работа вернулась к нему) — гасим её, новая придёт ниже
+        old = await admin_cards.card_message(r["pid"], reviewer)
+        if old:
+            await sender.edit_message_text(bot, reviewer, old, f"{text}\n\n⏰ Переназначено — карточка ниже")
+        source = None
+        if r["source_chat_id"] and r["source_message_ids"]:
+            source = (r["source_chat_id"], [int(i) for i in r["source_message_ids"].split(",")])
+        sent = await notify_admins(
+            bot, "submissions", f"{text}\n\n{note}",
+            reply_markup=admin_cards.submission_kb(r["pid"], tg_id), copy_ids=source, only=reviewer,
+        )
+        await admin_cards.save_card_messages(r["pid"], tg_id, text, sent, replace=False)
+    return moved
+
+
+def reviewer_line(admin_id: int) -> str:
+    return f'🧑‍🏫 Проверяет: <a href="tg://user?id={admin_id}">{admin_id}</a>'
+
+
+async def assignments_loop(bot: Bot):
+    """Переназначение просроченных работ; заодно счётчики перечитываются из БД."""
+    global _open
+    while True:
+        try:
+            async with _lock:
+                _open = None
+            await reassign_overdue(bot)
+        except Exception as e:
+            print("[assignments_loop] error:", e)
+        await asyncio.sleep(ASSIGN_CHECK_SECONDS)
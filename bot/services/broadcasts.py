@@ -0,0 +1,244 @@
+# bot/services/broadcasts.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+
+from aiogram import Bot
+
+from bot.config import now_utc_str
+from bot.keyboards.admin import broadcast_controls_kb
+from bot.services.db import get_db
+from bot.services.segments import Segment, count, describe, fetch_chunk
+from bot.services.sender import edit_message_text, send_bulk
+
+log = logging.getLogger("maestro")
+
+# Пачка получателей между сохранениями курсора (после рестарта повторится максимум она)
+BROADCAST_CHUNK_SIZE = 50
+BROADCAST_SEND_CONCURRENCY = 10
+# Как часто обновляем живое сообщение с прогрессом
+PROGRESS_EDIT_SECONDS = 3
+# Если запущенных рассылок нет — заглядываем раз в минуту (пауза/резюм из других процессов)
+BROADCAST_IDLE_SECONDS = 60
+
+STATUS_TITLES = {
+    "running": "идёт",
+    "paused": "на паузе",
+    "cancelled": "отменена",
+    "done": "завершена",
+}
+
+_wakeup = asyncio.Event()
+
+
+def notify_broadcasts() -> None:
+    """Будит воркер рассылок (новая рассылка / резюм)."""
+    _wakeup.set()
+
+
+# ----------------- шаблоны -----------------
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+def _s(v) -> str:
+    return (v or "").strip()
+
+
+# Значения подстановок из строки курсора (колонки segments.RECIPIENT_COLUMNS)
+TEMPLATE_VARS = {
+    "name": lambda r: _s(r["first_name"]) or (_s(r["username"]) and f"@{_s(r['username'])}") or "друг",
+    "first_name": lambda r: _s(r["first_name"]),
+    "last_name": lambda r: _s(r["last_name"]),
+    "username": lambda r: _s(r["username"]),
+    "tg_id": lambda r: str(r["tg_id"]),
+    "id": lambda r: str(r["id"]),
+}
+# Список кодов для подсказок админу — один на все сообщения
+TEMPLATE_CODES = ", ".join(f"{{{k}}}" for k in TEMPLATE_VARS)
+
+
+class BroadcastTemplate:
+    """
+    Шаблон, разобранный один раз: литералы + геттеры подстановок.
+    Рендер — склейка строк без regex; без подстановок — один и тот же готовый текст.
+    """
+
+    __slots__ = ("parts", "static")
+
+    def __init__(self, tpl: str):
+        unknown = sorted({m.group(1) for m in _PLACEHOLDER_RE.finditer(tpl)} - TEMPLATE_VARS.keys())
+        if unknown:
+            raise ValueError("Неизвестные коды: " + ", ".join(f"{{{k}}}" for k in unknown))
+
+        parts: list = []
+        pos = 0
+        for m in _PLACEHOLDER_RE.finditer(tpl):
+            if m.start() > pos:
+                parts.append(tpl[pos:m.start()])
+            parts.append(TEMPLATE_VARS[m.group(1)])
+            pos = m.end()
+        if pos < len(tpl):
+            parts.append(tpl[pos:])
+
+        self.parts = parts
+        self.static = tpl if all(isinstance(p, str) for p in parts) else None
+
+    def render(self, row) -> str:
+        if self.static is not None:
+            return self.static
+        return "".join(p if isinstance(p, str) else p(row) for p in self.parts)
+
+
+# ----------------- хранение -----------------
+
+async def create(template: str, segment: Segment, admin_chat_id: int, created_by: int) -> int:
+    """Создаёт рассылку по сегменту в статусе running и возвращает её id."""
+    now = now_utc_str()
+    total = await count(segment)
+    async with get_db() as db:
+        cur = await db.execute(
+            "INSERT INTO broadcasts(template, segment, status, cursor_id, sent, failed, total, admin_chat_id, "
+            "created_by, created_at, updated_at) VALUES(?,?,'running',0,0,0,?,?,?,?,?)",
+            (template, segment.to_json(), total, admin_chat_id, created_by, now, now),
+        )
+        bid = cur.lastrowid
+        await db.commit()
+    return bid
+
+
+async def get(bid: int):
+    async with get_db() as db:
+        cur = await db.execute("SELECT * FROM broadcasts WHERE id=?", (bid,))
+        return await cur.fetchone()
+
+
+async def set_progress_message(bid: int, message_id: int) -> None:
+    async with get_db() as db:
+        await db.execute("UPDATE broadcasts SET progress_message_id=? WHERE id=?", (message_id, bid))
+        await db.commit()
+
+
+async def set_status(bid: int, status: str, allowed_from: tuple[str, ...]) -> bool:
+    """Переводит рассылку в status, если сейчас она в одном из allowed_from."""
+    marks = ",".join("?" * len(allowed_from))
+    async with get_db() as db:
+        cur = await db.execute(
+            f"UPDATE broadcasts SET status=?, updated_at=? WHERE id=? AND status IN ({marks})",
+            (status, now_utc_str(), bid, *allowed_from),
+        )
+        await db.commit()
+    if cur.rowcount == 1 and status == "running":
+        notify_broadcasts()
+    return cur.rowcount == 1
+
+
+# ----------------- прогресс -----------------
+
+def progress_text(job, rate: float | None = None) -> str:
+    done = job["sent"] + job["failed"]
+    left = max(job["total"] - done, 0)
+    lines = [
+        f"📣 Рассылка #{job['id']} — {STATUS_TITLES.get(job['status'], job['status'])}",
+        f"Аудитория: {describe(Segment.from_json(job['segment']))}",
+        f"Отправлено: {job['sent']} / {job['total']}",
+        f"Ошибок: {job['failed']}",
+    ]
+    if job["status"] == "running" and rate and left:
+        eta = int(left / rate)
+        lines.append(f"Осталось ≈ {eta // 60} мин {eta % 60} с")
+    return "\n".join(lines)
+
+
+async def edit_progress(bot: Bot, job, rate: float | None = None) -> None:
+    # через общий лимитер: правки прогресса не должны отнимать темп у самой рассылки
+    if not job["progress_message_id"]:
+        return
+    await edit_message_text(
+        bot,
+        job["admin_chat_id"],
+        job["progress_message_id"],
+        progress_text(job, rate),
+        reply_markup=broadcast_controls_kb(job["id"], job["status"]),
+    )
+
+
+# ----------------- движок -----------------
+
+async def _run_job(bot: Bot, bid: int) -> None:
+    """Шлёт рассылку пачками от сохранённого курсора, пока она running."""
+    started = time.monotonic()
+    processed = 0
+    last_edit = 0.0
+    template = None
+
+    while True:
+        job = await get(bid)
+        if not job or job["status"] != "running":
+            break
+
+        if template is None:
+            try:
+                template = BroadcastTemplate(job["template"])
+            except ValueError as e:
+                log.warning("broadcast #%s: bad template: %s", bid, e)
+                await set_status(bid, "cancelled", ("running",))
+                break
+        rows = await fetch_chunk(Segment.from_json(job["segment"]), job["cursor_id"], BROADCAST_CHUNK_SIZE)
+
+        if not rows:
+            async with get_db() as db:
+                await db.execute(
+                    "UPDATE broadcasts SET status='done', finished_at=?, updated_at=? WHERE id=? AND status='running'",
+                    (now_utc_str(), now_utc_str(), bid),
+                )
+                await db.commit()
+            break
+
+        results = await send_bulk(
+            bot,
+            [(r["tg_id"], template.render(r)) for r in rows],
+            concurrency=BROADCAST_SEND_CONCURRENCY,
+        )
+        ok = sum(1 for x in results if x)
+        processed += len(rows)
+
+        async with get_db() as db:
+            await db.execute(
+                "UPDATE broadcasts SET cursor_id=?, sent=sent+?, failed=failed+?, updated_at=? WHERE id=?",
+                (rows[-1]["id"], ok, len(rows) - ok, now_utc_str(), bid),
+            )
+            await db.commit()
+
+        if time.monotonic() - last_edit >= PROGRESS_EDIT_SECONDS:
+            rate = processed / max(time.monotonic() - started, 0.001)
+            await edit_progress(bot, await get(bid), rate)
+            last_edit = time.monotonic()
+
+    # финальное состояние (done / paused / cancelled)
+    job = await get(bid)
+    if job:
+        await edit_progress(bot, job)
+
+
+async def broadcast_loop(bot: Bot):
+    """Воркер рассылок: подхватывает running-рассылки, в т.ч. прерванные рестартом."""
+    while True:
+        _wakeup.clear()
+        try:
+            async with get_db() as db:
+                cur = await db.execute("SELECT id FROM broadcasts WHERE status='running' ORDER BY id LIMIT 1")
+                row = await cur.fetchone()
+            if row:
+                await _run_job(bot, row["id"])
+                continue
+        except Exception as e:
+            print("[broadcast_loop] error:", e)
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=BROADCAST_IDLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
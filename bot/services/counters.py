@@ -0,0 +1,105 @@
+# bot/services/counters.py
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from bot.services.db import get_db
+
+log = logging.getLogger("maestro")
+
+# Полная пересверка счётчиков с таблицами (на случай ручных правок БД)
+COUNTERS_RECONCILE_SECONDS = 3600
+
+# Счётчики ведут триггеры (bot/tools/migrate_unified.py: migrate_counters),
+# а reconcile() пересчитывает их теми же запросами, что раньше шли на каждый клик админа.
+COUNTER_QUERIES = {
+    "students_total": "SELECT COUNT(*) FROM students",
+    "onb_pending": "SELECT COUNT(*) FROM students WHERE COALESCE(onboarding_done,0)=1 AND COALESCE(approved,0)=0",
+    "pay_pending": "SELECT COUNT(*) FROM payment_requests WHERE status='pending'",
+    "queue": "SELECT COUNT(*) FROM progress WHERE status='submitted'",
+    "active": "SELECT COUNT(*) FROM progress WHERE status IN ('sent','returned','submitted')",
+}
+
+# Дневные корзины (UTC-день 'YYYY-MM-DD'): окна «за 7/30 дней» = сумма нескольких строк
+DAILY_QUERIES = {
+    "approved": (
+        "SELECT substr(approved_at,1,10), COUNT(*) FROM progress "
+        "WHERE status='approved' AND approved_at IS NOT NULL GROUP BY 1"
+    ),
+    "payments_sum": (
+        "SELECT substr(paid_at,1,10), COALESCE(SUM(amount),0) FROM payments "
+        "WHERE paid_at IS NOT NULL GROUP BY 1"
+    ),
+}
+
+
+async def snapshot() -> dict[str, int]:
+    """Все текущие счётчики одним чтением маленькой таблицы."""
+    async with get_db() as db:
+        cur = await db.execute("SELECT name, value FROM counters")
+        rows = await cur.fetchall()
+    values = {name: 0 for name in COUNTER_QUERIES}
+    values.update({r["name"]: r["value"] or 0 for r in rows})
+    return values
+
+
+async def daily_sum(name: str, days: int) -> int:
+    """
+    Сумма дневной корзины name за days календарных UTC-дней: сегодня + (days - 1) полных.
+    Это не скользящие days*24 ч: «за 7д» в начале UTC-суток — почти ровно 6 суток,
+    в конце — почти 7. Для сводок админа такой точности хватает, а запрос — по индексу.
+    """
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    async with get_db() as db:
+        cur = await db.execute(
+            "SELECT COALESCE(SUM(value),0) AS s FROM counters_daily WHERE name=? AND day >= ?",
+            (name, since),
+        )
+        return (await cur.fetchone())["s"]
+
+
+async def reconcile() -> dict[str, int]:
+    """
+    Пересчитывает все счётчики из таблиц одной транзакцией.
+    Возвращает расхождения {имя: было - стало}, если триггеры что-то упустили.
+    """
+    drift: dict[str, int] = {}
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT name, value FROM counters")
+        before = {r["name"]: r["value"] for r in await cur.fetchall()}
+
+        for name, sql in COUNTER_QUERIES.items():
+            cur = await db.execute(sql)
+            value = (await cur.fetchone())[0]
+            if name in before and before[name] != value:
+                drift[name] = before[name] - value
+            await db.execute(
+                "INSERT INTO counters(name, value) VALUES(?,?) ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+                (name, value),
+            )
+
+        await db.execute("DELETE FROM counters_daily")
+        for name, sql in DAILY_QUERIES.items():
+            cur = await db.execute(sql)
+            await db.executemany(
+                "INSERT INTO counters_daily(name, day, value) VALUES(?,?,?)",
+                [(name, day, value) for day, value in await cur.fetchall() if day],
+            )
+        await db.commit()
+
+    if drift:
+        log.warning("counters reconciled, drift: %s", drift)
+    return drift
+
+
+async def counters_loop():
+    """Сверка на старте и дальше раз в COUNTERS_RECONCILE_SECONDS."""
+    while True:
+        try:
+            await reconcile()
+        except Exception as e:
+            print("[counters_loop] error:", e)
+        await asyncio.sleep(COUNTERS_RECONCILE_SECONDS)
@@ -0,0 +1,160 @@
+# bot/services/exports.py
+from __future__ import annotations
+
+import asyncio
+import csv
+import gzip
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+from bot.services.db import DB_PATH
+
+# Строк за один fetchmany: память не растёт с размером таблицы
+EXPORT_CHUNK_SIZE = 1000
+FORMATS = ("csv", "xlsx")
+# Выгрузки по одной: поток SQLite + сжатие не должны отъедать CPU у бота параллельно
+_export_slot = asyncio.Semaphore(1)
+
+# Выгружаемые таблицы: SQL, колонка даты для since/until и допустимые фильтры key=value → колонка
+EXPORTS = {
+    "students": {
+        "sql": "SELECT id, tg_id, username, first_name, last_name, phone, age, has_guitar, experience_months, "
+               "goal, onboarding_done, approved, rank, rank_points, reachable, created_at, last_seen "
+               "FROM students",
+        "date": "created_at",
+        "filters": {"approved": "approved", "onboarded": "onboarding_done", "rank": "rank"},
+        "order": "id",
+    },
+    "progress": {
+        "sql": "SELECT p.id, p.student_id, s.tg_id, s.username, p.lesson_code, p.task_code, p.status, "
+               "p.sent_at, p.submitted_at, p.returned_at, p.approved_at "
+               "FROM progress p LEFT JOIN students s ON s.id = p.student_id",
+        "date": "p.sent_at",
+        "filters": {"status": "p.status", "student": "p.student_id"},
+        "order": "p.id",
+    },
+    "payments": {
+        "sql": "SELECT y.id, y.student_id, s.tg_id, s.username, y.course_code, y.amount, y.method, y.note, y.paid_at "
+               "FROM payments y LEFT JOIN students s ON s.id = y.student_id",
+        "date": "y.paid_at",
+        "filters": {"course": "y.course_code", "student": "y.student_id"},
+        "order": "y.id",
+    },
+    "test_results": {
+        "sql": "SELECT t.id, t.user_id, s.id AS student_id, s.username, t.test_code, t.correct_count, "
+               "t.total_count, t.passed, t.created_at "
+               "FROM test_results t LEFT JOIN students s ON s.tg_id = t.user_id",
+        "date": "t.created_at",
+        "filters": {"test": "t.test_code", "passed": "t.passed"},
+        "order": "t.id",
+    },
+    # дневные агрегаты (bot/services/rollups.py) — маленькая таблица для отчётов
+    "rollups": {
+        "sql": "SELECT day, course, metric, value FROM rollup_daily",
+        "date": "day",
+        "filters": {"course": "course", "metric": "metric"},
+        "order": "day, course, metric",
+    },
+}
+
+EXPORT_HELP = (
+    "/export <таблица> [xlsx] [фильтры]\n"
+    f"Таблицы: {', '.join(EXPORTS)}\n"
+    "Фильтры: since=YYYY-MM-DD until=YYYY-MM-DD и по таблице:\n"
+    + "\n".join(f"• {name}: {', '.join(spec['filters'])}" for name, spec in EXPORTS.items())
+)
+
+
+def parse_args(tokens: list[str]) -> tuple[str, str, dict[str, str]]:
+    """['payments', 'xlsx', 'since=2025-01-01'] → (таблица, формат, фильтры). Ошибка — ValueError."""
+    if not tokens or tokens[0] not in EXPORTS:
+        raise ValueError(f"Нужна таблица: {', '.join(EXPORTS)}.")
+    table, fmt, filters = tokens[0], "csv", {}
+    for token in tokens[1:]:
+        if token in FORMATS:
+            fmt = token
+            continue
+        key, sep, value = token.partition("=")
+        if not sep or not value:
+            raise ValueError(f"Не понял «{token}» — нужно ключ=значение.")
+        if key not in ("since", "until") and key not in EXPORTS[table]["filters"]:
+            raise ValueError(f"Фильтр «{key}» для {table} не поддерживается.")
+        filters[key] = value
+    return table, fmt, filters
+
+
+def build_query(table: str, filters: dict[str, str]) -> tuple[str, list]:
+    spec = EXPORTS[table]
+    where, params = [], []
+    if "since" in filters:
+        where.append(f"{spec['date']} >= ?")
+        params.append(filters["since"])
+    if "until" in filters:
+        # until включительно: всё, что раньше следующего дня
+        where.append(f"{spec['date']} < ?")
+        params.append(filters["until"] + "~")
+    for key, column in spec["filters"].items():
+        if key in filters:
+            where.append(f"{column} = ?")
+            params.append(filters[key])
+    sql = spec["sql"] + (f" WHERE {' AND '.join(where)}" if where else "") + f" ORDER BY {spec['order']}"
+    return sql, params
+
+
+def _rows(cur: sqlite3.Cursor):
+    while True:
+        chunk = cur.fetchmany(EXPORT_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield from chunk
+
+
+def write_export(
+    table: str, filters: dict[str, str], fmt: str = "csv", out: Path | None = None, db_path: str = DB_PATH
+) -> tuple[Path, int]:
+    """
+    Синхронная выгрузка курсором пачками в .csv.gz или .xlsx (write-only). Возвращает (файл, строк).
+    Своё соединение только на чтение: в WAL не мешает боту писать.
+    """
+    sql, params = build_query(table, filters)
+    if fmt == "xlsx":
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("Для xlsx нужен openpyxl (pip install openpyxl).") from None
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    if out is None:
+        out = Path(tempfile.mkdtemp(prefix="export_")) / f"{table}_{stamp}.{'csv.gz' if fmt == 'csv' else 'xlsx'}"
+
+    conn = sqlite3.connect(f"file:{Path(db_path).as_posix()}?mode=ro", uri=True, timeout=30)
+    try:
+        cur = conn.execute(sql, params)
+        header = [d[0] for d in cur.description]
+        count = 0
+        if fmt == "xlsx":
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet(table)
+            ws.append(header)
+            for row in _rows(cur):
+                ws.append(list(row))
+                count += 1
+            wb.save(out)
+        else:
+            # utf-8-sig — чтобы Excel сам понял кириллицу
+            with gzip.open(out, "wt", encoding="utf-8-sig", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                for row in _rows(cur):
+                    writer.writerow(row)
+                    count += 1
+    finally:
+        conn.close()
+    return out, count
+
+
+async def export(table: str, filters: dict[str, str], fmt: str = "csv") -> tuple[Path, int]:
+    """То же в отдельном потоке: event loop бота не блокируется на время выгрузки."""
+    async with _export_slot:
+        return await asyncio.to_thread(write_export, table, filters, fmt)
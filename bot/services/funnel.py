@@ -0,0 +1,236 @@
+# bot/services/funnel.py
+from __future__ import annotations
+
+import statistics
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import aiosqlite
+
+from bot.config import COURSES, local_dt_str, now_utc_str, get_settings, tzinfo
+from bot.services.db import get_db
+from bot.services.lessons import parse_l_num
+
+# Воронка по курсам: регистрация → анкета → одобрение → L01 … LNN → оплата.
+# funnel_students / funnel_lessons — по строке на ученика (и курс), обновляются только для
+# учеников из funnel_dirty (помечают триггеры, см. migrate_funnel) вместе с rollup_loop.
+# Сам отчёт собирается из этих таблиц и кешируется в report_cache.
+#
+# Почему не rollup_daily: там дневные суммы по курсу («сколько уроков принято за день»),
+# а воронке нужен путь каждого ученика — когорта по неделе регистрации, максимальный
+# принятый урок, момент бесплатных уроков и первой оплаты, медианы между этапами.
+# Из дневных сумм это не восстановить (нельзя понять, что 5 приёмов — один ученик на L05
+# или пять на L01). Цена — триггеры funnel_dirty: один INSERT OR IGNORE по ключу
+# на изменённую строку students/progress/payments, пересборка — пачками в rollup_loop.
+
+# Учеников за один проход обновления
+FUNNEL_REFRESH_BATCH = 500
+# Пересборка отчёта — раз в сутки в этом окне (местные часы TIMEZONE), вне рабочего времени
+FUNNEL_REBUILD_WINDOW = (2, 6)
+FUNNEL_MAX_AGE_HOURS = 20
+# Сколько последних когорт (недель регистрации) показываем
+FUNNEL_COHORTS = 8
+REPORT_NAME = "funnel"
+
+
+def _dt(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _cohort(created_at: str | None) -> str | None:
+    dt = _dt(created_at)
+    if not dt:
+        return None
+    year, week, _ = dt.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+async def refresh_students(db: aiosqlite.Connection, ids: list[int]) -> None:
+    """Пересобрать строки воронки для учеников ids (в транзакции вызывающего)."""
+    if not ids:
+        return
+    marks = ",".join("?" * len(ids))
+    await db.execute(f"DELETE FROM funnel_students WHERE student_id IN ({marks})", ids)
+    await db.execute(f"DELETE FROM funnel_lessons WHERE student_id IN ({marks})", ids)
+
+    cur = await db.execute(
+        f"SELECT id, created_at, onboarded_at, approved_at FROM students WHERE id IN ({marks})", ids
+    )
+    await db.executemany(
+        "INSERT INTO funnel_students(student_id, cohort, signup_at, onboarded_at, approved_at) VALUES(?,?,?,?,?)",
+        [(r["id"], _cohort(r["created_at"]), r["created_at"] or None, r["onboarded_at"], r["approved_at"])
+         for r in await cur.fetchall()],
+    )
+
+    # (ученик, курс) → [первая выдача, макс. принятый урок, когда приняты бесплатные, первая оплата]
+    lessons: dict[tuple[int, str], list] = defaultdict(lambda: [None, 0, None, None])
+    cur = await db.execute(
+        f"SELECT student_id, lesson_code, status, sent_at, approved_at FROM progress WHERE student_id IN ({marks})",
+        ids,
+    )
+    for r in await cur.fetchall():
+        course, _, l_code = (r["lesson_code"] or "").partition(":")
+        num = parse_l_num(l_code)
+        if course not in COURSES or num is None:
+            continue
+        row = lessons[(r["student_id"], course)]
+        if r["sent_at"] and (row[0] is None or r["sent_at"] < row[0]):
+            row[0] = r["sent_at"]
+        if r["status"] == "approved":
+            row[1] = max(row[1], num)
+            if num == COURSES[course].free_lessons:
+                row[2] = r["approved_at"]
+
+    cur = await db.execute(
+        f"SELECT student_id, course_code, MIN(paid_at) AS paid_at FROM payments "
+        f"WHERE student_id IN ({marks}) GROUP BY student_id, course_code",
+        ids,
+    )
+    for r in await cur.fetchall():
+        if r["course_code"] in COURSES:
+            lessons[(r["student_id"], r["course_code"])][3] = r["paid_at"]
+
+    await db.executemany(
+        "INSERT INTO funnel_lessons(student_id, course, first_sent_at, max_lesson, free_done_at, paid_at) "
+        "VALUES(?,?,?,?,?,?)",
+        [(sid, course, *row) for (sid, course), row in lessons.items()],
+    )
+
+
+async def refresh_dirty(batch: int = FUNNEL_REFRESH_BATCH) -> int:
+    """Обновить помеченных учеников одной транзакцией. Возвращает их число."""
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT student_id FROM funnel_dirty LIMIT ?", (batch,))
+        ids = [r["student_id"] for r in await cur.fetchall()]
+        await refresh_students(db, ids)
+        await db.executemany("DELETE FROM funnel_dirty WHERE student_id=?", [(i,) for i in ids])
+        await db.commit()
+    return len(ids)
+
+
+def _median_hours(pairs) -> str:
+    """Медиана интервалов (от, до) в часах/днях; пары без одной из дат пропускаем."""
+    spans = [(b - a).total_seconds() / 3600 for a, b in ((_dt(x), _dt(y)) for x, y in pairs) if a and b and b >= a]
+    if not spans:
+        return "—"
+    m = statistics.median(spans)
+    return f"{m:.1f} ч" if m < 48 else f"{m / 24:.1f} д"
+
+
+def _pct(n: int, base: int) -> str:
+    return f"{n * 100 // base}%" if base else "—"
+
+
+async def build_report() -> str:
+    """Отчёт по воронке из funnel_* (сырые таблицы не трогаем)."""
+    async with get_db() as db:
+        cur = await db.execute("SELECT student_id, cohort, signup_at, onboarded_at, approved_at FROM funnel_students")
+        students = {r["student_id"]: r for r in await cur.fetchall()}
+        cur = await db.execute(
+            "SELECT student_id, course, first_sent_at, max_lesson, free_done_at, paid_at FROM funnel_lessons"
+        )
+        by_course: dict[str, list] = defaultdict(list)
+        for r in await cur.fetchall():
+            by_course[r["course"]].append(r)
+
+    lines = ["📉 Воронка", ""]
+    lines.append(
+        f"Всего: {len(students)} → анкета {sum(1 for s in students.values() if s['onboarded_at'])} "
+        f"→ одобрено {sum(1 for s in students.values() if s['approved_at'])}"
+    )
+    lines.append(
+        "Медианы: регистрация→анкета "
+        + _median_hours((s["signup_at"], s["onboarded_at"]) for s in students.values())
+        + ", анкета→одобрение "
+        + _median_hours((s["onboarded_at"], s["approved_at"]) for s in students.values())
+    )
+
+    for code, course in COURSES.items():
+        rows = by_course.get(code, [])
+        if not rows:
+            continue
+        free = course.free_lessons
+        top = max(r["max_lesson"] for r in rows)
+        lines += ["", f"<b>{course.title}</b> (бесплатных уроков: {free})"]
+
+        # когорты по неделе регистрации
+        cohorts: dict[str, list] = defaultdict(list)
+        for r in rows:
+            s = students.get(r["student_id"])
+            if s and s["cohort"]:
+                cohorts[s["cohort"]].append(r)
+        for cohort in sorted(cohorts)[-FUNNEL_COHORTS:]:
+            c = cohorts[cohort]
+            started = sum(1 for r in c if r["first_sent_at"])
+            lines.append(
+                f"{cohort}: начали {started} → L01 {sum(1 for r in c if r['max_lesson'] >= 1)} "
+                f"→ L{free:02d} {sum(1 for r in c if r['max_lesson'] >= free)} "
+                f"→ оплата {sum(1 for r in c if r['paid_at'])}"
+            )
+
+        # конверсия по урокам: дошли до LNN / начали курс
+        started = sum(1 for r in rows if r["first_sent_at"]) or len(rows)
+        steps = [f"L{n:02d} {_pct(sum(1 for r in rows if r['max_lesson'] >= n), started)}" for n in range(1, top + 1)]
+        if steps:
+            lines.append("По урокам: " + " • ".join(steps))
+
+        free_done = [r for r in rows if r["max_lesson"] >= free]
+        paid = sum(1 for r in free_done if r["paid_at"])
+        lines.append(f"Бесплатные → оплата: {paid}/{len(free_done)} ({_pct(paid, len(free_done))})")
+        lines.append(
+            "Медианы: одобрение→L01 "
+            + _median_hours((students[r["student_id"]]["approved_at"], r["first_sent_at"])
+                            for r in rows if r["student_id"] in students)
+            + ", бесплатные→оплата "
+            + _median_hours((r["free_done_at"], r["paid_at"]) for r in rows)
+        )
+    return "\n".join(lines)
+
+
+async def rebuild() -> tuple[str, str]:
+    text = await build_report()
+    built_at = now_utc_str()
+    async with get_db() as db:
+        await db.execute(
+            "INSERT INTO report_cache(name, text, built_at) VALUES(?,?,?) "
+            "ON CONFLICT(name) DO UPDATE SET text=excluded.text, built_at=excluded.built_at",
+            (REPORT_NAME, text, built_at),
+        )
+        await db.commit()
+    return text, built_at
+
+
+async def cached_report() -> tuple[str, str] | None:
+    """(текст, built_at) из кеша или None."""
+    async with get_db() as db:
+        cur = await db.execute("SELECT text, built_at FROM report_cache WHERE name=?", (REPORT_NAME,))
+        row = await cur.fetchone()
+    return (row["text"], row["built_at"]) if row else None
+
+
+def _in_window(hour: int, window: tuple[int, int]) -> bool:
+    start, end = window
+    return start <= hour < end if start < end else hour >= start or hour < end
+
+
+async def rebuild_if_due() -> bool:
+    """Пересобрать кеш ночью, если он старше FUNNEL_MAX_AGE_HOURS (или его нет)."""
+    if not _in_window(datetime.now(tzinfo()).hour, FUNNEL_REBUILD_WINDOW):
+        return False
+    cached = await cached_report()
+    built = _dt(cached[1]) if cached else None
+    if built and (datetime.now(timezone.utc) - built).total_seconds() < FUNNEL_MAX_AGE_HOURS * 3600:
+        return False
+    await rebuild()
+    return True
+
+
+def built_at_text(built_at: str) -> str:
+    return local_dt_str(built_at, get_settings().timezone)
@@ -0,0 +1,95 @@
+# bot/services/leases.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from bot.services.db import get_db
+
+log = logging.getLogger("maestro")
+
+# Аренда живёт столько секунд без продления
+LEASE_TTL_SECONDS = 30
+# Как часто держатель продлевает аренду (и как часто остальные пробуют её забрать)
+HEARTBEAT_SECONDS = 10
+
+# Уникальный id этого процесса
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+async def try_acquire(name: str, holder: str = HOLDER_ID, ttl: int = LEASE_TTL_SECONDS) -> bool:
+    """
+    Взять или продлить аренду name. Успех — если аренды нет, она наша или истекла.
+    Атомарно: один UPSERT с условием.
+    """
+    now = datetime.now(timezone.utc)
+    async with get_db() as db:
+        cur = await db.execute(
+            """
+            INSERT INTO worker_leases(name, holder, expires_at) VALUES(?,?,?)
+            ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+            WHERE worker_leases.holder=excluded.holder OR worker_leases.expires_at < ?
+            """,
+            (name, holder, _iso(now + timedelta(seconds=ttl)), _iso(now)),
+        )
+        await db.commit()
+    return cur.rowcount == 1
+
+
+async def release(name: str, holder: str = HOLDER_ID) -> None:
+    """Отдать аренду досрочно (при остановке), чтобы другой процесс подхватил сразу."""
+    async with get_db() as db:
+        await db.execute("DELETE FROM worker_leases WHERE name=? AND holder=?", (name, holder))
+        await db.commit()
+
+
+async def run_with_lease(name: str, worker: Callable[[], Awaitable[None]]) -> None:
+    """
+    Запускает worker() только пока этот процесс держит аренду name.
+    Держатель продлевает её каждые HEARTBEAT_SECONDS; потерял — worker отменяется.
+    Остальные процессы раз в HEARTBEAT_SECONDS пробуют забрать истёкшую аренду.
+    """
+    while True:
+        try:
+            acquired = await try_acquire(name)
+        except Exception as e:
+            log.warning("lease %s: acquire failed: %s", name, e)
+            acquired = False
+
+        if acquired:
+            log.warning("lease %s: acquired by %s", name, HOLDER_ID)
+            task = asyncio.create_task(worker(), name=f"{name}_leased")
+            try:
+                while True:
+                    done, _ = await asyncio.wait({task}, timeout=HEARTBEAT_SECONDS)
+                    if done:
+                        break
+                    try:
+                        renewed = await try_acquire(name)
+                    except Exception as e:
+                        log.warning("lease %s: renew failed: %s", name, e)
+                        renewed = False
+                    if not renewed:
+                        log.warning("lease %s: lost by %s", name, HOLDER_ID)
+                        break
+            finally:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                with suppress(Exception):
+                    await release(name)
+
+            if task.done() and not task.cancelled() and task.exception():
+                log.warning("lease %s: worker crashed: %s", name, task.exception())
+
+        await asyncio.sleep(HEARTBEAT_SECONDS)
@@ -0,0 +1,213 @@
+# bot/services/outbox.py
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import aiosqlite
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+from bot.config import now_utc_str
+from bot.services.db import get_db
+from bot.services.reachability import is_unreachable_error, mark_unreachable
+from bot.services.sender import limiter, DEFAULT_CONCURRENCY
+
+log = logging.getLogger("maestro")
+
+# Сколько писем забираем за один проход
+OUTBOX_BATCH_SIZE = 100
+# После стольких неудачных попыток письмо уходит в dead
+OUTBOX_MAX_ATTEMPTS = 5
+# Бэкофф: 30с, 60с, 120с, ...
+OUTBOX_BACKOFF_BASE_SECONDS = 30
+# Если очередь пуста — всё равно заглядываем раз в минуту
+OUTBOX_IDLE_SECONDS = 60
+
+_wakeup = asyncio.Event()
+
+
+def notify_outbox() -> None:
+    """Будит дренажный воркер. Вызывать после commit транзакции с enqueue()."""
+    _wakeup.set()
+
+
+def _dump_markup(markup) -> str | None:
+    if markup is None:
+        return None
+    return markup.model_dump_json(exclude_none=True)
+
+
+def _load_markup(raw: str | None):
+    if not raw:
+        return None
+    data = json.loads(raw)
+    if "inline_keyboard" in data:
+        return InlineKeyboardMarkup.model_validate(data)
+    if "keyboard" in data:
+        return ReplyKeyboardMarkup.model_validate(data)
+    if data.get("remove_keyboard"):
+        return ReplyKeyboardRemove.model_validate(data)
+    return None
+
+
+async def enqueue(
+    db: aiosqlite.Connection,
+    chat_id: int,
+    text: str,
+    *,
+    reply_markup=None,
+    dedupe_key: str | None = None,
+) -> bool:
+    """
+    Кладёт сообщение в outbox в ТЕКУЩЕЙ транзакции db — commit делает вызывающий,
+    вместе со сменой состояния. dedupe_key защищает от повторной постановки.
+    Возвращает False, если письмо с таким dedupe_key уже было.
+    """
+    now = now_utc_str()
+    cur = await db.execute(
+        "INSERT OR IGNORE INTO outbox(chat_id, text, reply_markup, status, attempts, next_attempt_at, "
+        "dedupe_key, created_at) VALUES(?,?,?,'pending',0,?,?,?)",
+        (chat_id, text, _dump_markup(reply_markup), now, dedupe_key, now),
+    )
+    return cur.rowcount == 1
+
+
+async def _deliver(bot: Bot, row) -> tuple[str, str | None, int | None]:
+    """
+    Одна попытка доставки. Возвращает ('sent'|'retry'|'dead', ошибка, через сколько секунд повтор).
+    Флуд-лимит не ждём на месте — письмо уходит на повтор через retry_after, дренаж идёт дальше.
+    """
+    await limiter.acquire()
+    try:
+        await bot.send_message(row["chat_id"], row["text"], reply_markup=_load_markup(row["reply_markup"]))
+        return "sent", None, None
+    except TelegramRetryAfter as e:
+        return "retry", str(e), e.retry_after
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # Бот заблокирован / чат не найден / кривой текст — повтор не поможет
+        if is_unreachable_error(e):
+            await mark_unreachable(row["chat_id"], str(e))
+        return "dead", str(e), None
+    except Exception as e:
+        return "retry", str(e), None
+
+
+# Письмо o не стоит в очереди чата за несозревшим повтором (параметр — текущее время)
+_NOT_BEHIND_RETRY = (
+    "NOT EXISTS (SELECT 1 FROM outbox p WHERE p.chat_id = o.chat_id AND p.status='pending' "
+    "AND p.id < o.id AND p.next_attempt_at > ?)"
+)
+
+
+async def drain_once(bot: Bot) -> int:
+    """Отправляет созревшие письма. Возвращает, сколько писем обработано."""
+    now_iso = now_utc_str()
+    async with get_db() as db:
+        cur = await db.execute(
+            f"""
+            SELECT o.id, o.chat_id, o.text, o.reply_markup, o.attempts,
+                   COALESCE(s.reachable, 1) AS reachable
+            FROM outbox o
+            LEFT JOIN students s ON s.tg_id = o.chat_id
+            WHERE o.status='pending' AND o.next_attempt_at <= ?
+              AND {_NOT_BEHIND_RETRY}
+            ORDER BY o.id
+            LIMIT ?
+            """,
+            (now_iso, now_iso, OUTBOX_BATCH_SIZE),
+        )
+        rows = await cur.fetchall()
+    if not rows:
+        return 0
+
+    # Письма одному чату — строго по порядку, разные чаты — параллельно.
+    # Письмо ушло на повтор — следующие этому чату ждут его (и в этом проходе, и в следующих:
+    # запрос выше не берёт письма, перед которыми в чате стоит несозревший повтор).
+    # Ученикам, заблокировавшим бота, не шлём вовсе — сразу в dead.
+    results: list[tuple] = []
+    by_chat: dict[int, list] = defaultdict(list)
+    for r in rows:
+        if r["reachable"]:
+            by_chat[r["chat_id"]].append(r)
+        else:
+            results.append((r, "dead", "unreachable", None))
+
+    sem = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+
+    async def _chat(items: list) -> None:
+        async with sem:
+            for r in items:
+                outcome, err, retry_after = await _deliver(bot, r)
+                results.append((r, outcome, err, retry_after))
+                if outcome == "retry":
+                    break
+
+    await asyncio.gather(*(_chat(items) for items in by_chat.values()))
+
+    now = datetime.now(timezone.utc)
+    sent, retry, dead = [], [], []
+    for r, outcome, err, retry_after in results:
+        attempts = (r["attempts"] or 0) + 1
+        if outcome == "sent":
+            sent.append((now_iso, attempts, r["id"]))
+        elif outcome == "retry" and retry_after:
+            # флуд-лимит — не ошибка письма: повтор через сколько просит Telegram, попытку не считаем
+            next_at = (now + timedelta(seconds=retry_after)).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+            retry.append((r["attempts"] or 0, next_at, err, r["id"]))
+        elif outcome == "retry" and attempts < OUTBOX_MAX_ATTEMPTS:
+            delay = OUTBOX_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1))
+            next_at = (now + timedelta(seconds=delay)).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+            retry.append((attempts, next_at, err, r["id"]))
+        else:
+            dead.append((attempts, err, r["id"]))
+            log.warning("outbox #%s dead-lettered (chat %s): %s", r["id"], r["chat_id"], err)
+
+    async with get_db() as db:
+        if sent:
+            await db.executemany("UPDATE outbox SET status='sent', sent_at=?, attempts=? WHERE id=?", sent)
+        if retry:
+            await db.executemany(
+                "UPDATE outbox SET attempts=?, next_attempt_at=?, last_error=? WHERE id=?", retry
+            )
+        if dead:
+            await db.executemany("UPDATE outbox SET status='dead', attempts=?, last_error=? WHERE id=?", dead)
+        await db.commit()
+
+    return len(rows)
+
+
+async def _seconds_until_next() -> float:
+    async with get_db() as db:
+        cur = await db.execute(
+            f"SELECT MIN(o.next_attempt_at) AS t FROM outbox o WHERE o.status='pending' AND {_NOT_BEHIND_RETRY}",
+            (now_utc_str(),),
+        )
+        row = await cur.fetchone()
+    if not row or not row["t"]:
+        return OUTBOX_IDLE_SECONDS
+    due = datetime.fromisoformat(row["t"].replace("Z", "+00:00"))
+    delay = (due - datetime.now(timezone.utc)).total_seconds()
+    return min(max(delay, 1), OUTBOX_IDLE_SECONDS)
+
+
+async def outbox_loop(bot: Bot):
+    """Дренажный воркер outbox: доставка с повторами, бэкоффом и dead-letter."""
+    while True:
+        _wakeup.clear()
+        try:
+            while await drain_once(bot) == OUTBOX_BATCH_SIZE:
+                pass
+            delay = await _seconds_until_next()
+        except Exception as e:
+            print("[outbox_loop] error:", e)
+            delay = OUTBOX_IDLE_SECONDS
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
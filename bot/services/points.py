@@ -2,23 +2,33 @@
 from __future__ import annotations
 
 import aiosqlite
-from typing import Optional
+from dataclasses import dataclass
+from typing import Iterable, Optional
 
 from bot.services.db import get_db
+from bot.services.ranks import get_rank_by_points
 from bot.config import now_utc_str
 
 
-async def add(student_id: int, source: str, amount: int) -> bool:
+async def add(student_id: int, source: str, amount: int, db: aiosqlite.Connection | None = None) -> bool:
     """
     Безопасно начисляет баллы.
     Возвращает True, если запись добавлена; False, если такой source уже есть (антидубль).
     Требуется уникальный индекс points(student_id, source).
+    Если передан db — пишет в его текущую транзакцию (commit делает вызывающий).
     """
     if not source:
         raise ValueError("source must be non-empty")
     if amount == 0:
         return False
 
+    if db is not None:
+        cur = await db.execute(
+            "INSERT OR IGNORE INTO points(student_id, source, amount, created_at) VALUES(?,?,?,?)",
+            (student_id, source, amount, now_utc_str()),
+        )
+        return cur.rowcount == 1
+
     try:
         async with get_db() as db:
             await db.execute(
@@ -32,14 +42,58 @@ async def add(student_id: int, source: str, amount: int) -> bool:
         return False
 
 
-async def total(student_id: int) -> int:
+async def total(student_id: int, db: aiosqlite.Connection | None = None) -> int:
     """
     Возвращает суммарные баллы студента (сумма по points.amount).
+    С переданным db видит и ещё не закоммиченные начисления этой транзакции.
     """
-    async with get_db() as db:
-        cur = await db.execute(
-            "SELECT COALESCE(SUM(amount),0) AS s FROM points WHERE student_id=?",
-            (student_id,),
-        )
+    sql = "SELECT COALESCE(SUM(amount),0) AS s FROM points WHERE student_id=?"
+    if db is not None:
+        cur = await db.execute(sql, (student_id,))
         row = await cur.fetchone()
+    else:
+        async with get_db() as db:
+            cur = await db.execute(sql, (student_id,))
+            row = await cur.fetchone()
     return int(row["s"] if row and row["s"] is not None else 0)
+
+
+@dataclass
+class Balance:
+    """Итог начисления: сколько реально добавлено, новый баланс и ранг до/после."""
+    added: int
+    total: int
+    rank: str
+    prev_rank: str
+    next_threshold: Optional[int]
+
+    @property
+    def rank_changed(self) -> bool:
+        return self.rank != self.prev_rank
+
+
+async def award(db: aiosqlite.Connection, student_id: int, items: Iterable[tuple[str, int]]) -> Balance:
+    """
+    Начисляет пачку (source, amount) в текущей транзакции db (commit делает вызывающий).
+    Баланс students.rank_points увеличивается только на реально добавленные записи,
+    ранг пересчитывается из нового баланса — без пересуммирования журнала points.
+    """
+    added = 0
+    for source, amount in items:
+        if await add(student_id, source, amount, db=db):
+            added += amount
+
+    cur = await db.execute(
+        "UPDATE students SET rank_points = COALESCE(rank_points,0) + ?, updated_at=? WHERE id=? "
+        "RETURNING rank_points, COALESCE(rank,'') AS rank",
+        (added, now_utc_str(), student_id),
+    )
+    row = await cur.fetchone()
+    await cur.close()
+    total = row["rank_points"] if row else added
+    prev_rank = row["rank"] if row else ""
+
+    rank_name, next_thr = get_rank_by_points(total)
+    if rank_name != prev_rank:
+        await db.execute("UPDATE students SET rank=? WHERE id=?", (rank_name, student_id))
+    return Balance(added, total, rank_name, prev_rank, next_thr)
@@ -0,0 +1,42 @@
+# bot/services/reachability.py
+from __future__ import annotations
+
+import logging
+
+import aiosqlite
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from bot.config import now_utc_str
+from bot.services.db import get_db
+
+log = logging.getLogger("maestro")
+
+
+def is_unreachable_error(e: Exception) -> bool:
+    """Ошибка значит «этому чату писать бесполезно»: бот заблокирован, аккаунт удалён, чата нет."""
+    if isinstance(e, TelegramForbiddenError):
+        return True
+    return isinstance(e, TelegramBadRequest) and "chat not found" in str(e).lower()
+
+
+async def mark_unreachable(chat_id: int, reason: str = "") -> None:
+    """students.reachable=0 для ученика с этим tg_id. Все массовые отправки его пропускают."""
+    try:
+        async with get_db() as db:
+            cur = await db.execute(
+                "UPDATE students SET reachable=0, blocked_at=?, updated_at=? WHERE tg_id=? AND reachable=1",
+                (now_utc_str(), now_utc_str(), chat_id),
+            )
+            await db.commit()
+        if cur.rowcount:
+            log.warning("student tg=%s marked unreachable: %s", chat_id, reason)
+    except Exception as e:
+        log.warning("mark_unreachable(%s) failed: %s", chat_id, e)
+
+
+async def mark_reachable(db: aiosqlite.Connection, tg_id: int) -> None:
+    """Ученик снова написал боту (/start, разблокировал). commit делает вызывающий."""
+    await db.execute(
+        "UPDATE students SET reachable=1, blocked_at=NULL, updated_at=? WHERE tg_id=? AND reachable=0",
+        (now_utc_str(), tg_id),
+    )
@@ -0,0 +1,107 @@
+# bot/services/release_notifier.py
+from __future__ import annotations
+
+import asyncio
+import logging
+from pathlib import Path
+
+from aiogram import Bot
+
+from bot.config import COURSES, get_settings, now_utc_str
+from bot.services.db import get_db
+from bot.services.lessons import list_l_lessons, parse_l_num
+from bot.services.segments import Segment, compile_where, fetch_chunk
+from bot.services.sender import send_bulk
+
+log = logging.getLogger("maestro")
+
+# Как часто смотрим mtime папок курсов (stat, без обхода уроков)
+CATALOG_POLL_SECONDS = 60
+# Сколько ждущих учеников уведомляем за одну пачку
+RELEASE_CHUNK_SIZE = 500
+RELEASE_SEND_CONCURRENCY = 20
+
+RELEASE_TEXT = "Появились новые уроки в курсе «{title}»! Можно продолжить обучение 🎸"
+
+
+def course_max_lesson(course_code: str) -> int:
+    """Максимальный номер L-урока в папке курса (0 — уроков нет)."""
+    course_dir = Path(get_settings().lessons_path) / course_code
+    nums = [parse_l_num(code) or 0 for code in list_l_lessons(course_dir)]
+    return max(nums, default=0)
+
+
+async def mark_waiting(db, student_id: int, course_code: str, known_max: int) -> None:
+    """Ученик дошёл до конца курса — ждёт новых уроков. commit делает вызывающий."""
+    await db.execute(
+        "UPDATE students SET waiting_lessons=1, waiting_course=?, last_known_max_lesson=? WHERE id=?",
+        (course_code, known_max, student_id),
+    )
+
+
+async def on_course_released(bot: Bot, course_code: str, current_max: int) -> int:
+    """
+    Событие «в курсе появились уроки до current_max».
+    Ждущие этого курса — сегмент, выбирается по индексу пачками (keyset по id),
+    уведомление — через лимитер, флаг и last_known_max_lesson — одним UPDATE на пачку.
+    Возвращает, сколько учеников уведомлено.
+    """
+    course = COURSES.get(course_code)
+    if not course or current_max <= 0:
+        return 0
+    text = RELEASE_TEXT.format(title=course.title)
+    seg = Segment(waiting=True, waiting_course=course_code, known_max_below=current_max)
+    where, params = compile_where(seg)
+
+    notified = 0
+    last_id = 0
+    while True:
+        rows = await fetch_chunk(seg, last_id, RELEASE_CHUNK_SIZE, columns="id, tg_id")
+        if not rows:
+            break
+
+        first_id, last_id = rows[0]["id"], rows[-1]["id"]
+        await send_bulk(bot, [(r["tg_id"], text) for r in rows], concurrency=RELEASE_SEND_CONCURRENCY)
+        notified += len(rows)
+
+        async with get_db() as db:
+            await db.execute(
+                f"UPDATE students SET waiting_lessons=0, last_known_max_lesson=?, updated_at=? "
+                f"WHERE {where} AND id BETWEEN ? AND ?",
+                (current_max, now_utc_str(), *params, first_id, last_id),
+            )
+            await db.commit()
+
+        if len(rows) < RELEASE_CHUNK_SIZE:
+            break
+
+    if notified:
+        log.warning("release %s: L%02d -> notified %s students", course_code, current_max, notified)
+    return notified
+
+
+def _course_mtime(course_code: str) -> float | None:
+    try:
+        return (Path(get_settings().lessons_path) / course_code).stat().st_mtime
+    except OSError:
+        return None
+
+
+async def release_watch_loop(bot: Bot):
+    """
+    Следит за каталогом: добавление/удаление папки LNN меняет mtime папки курса.
+    Только тогда пересчитываем максимум и шлём событие по этому курсу.
+    На старте проверяем все курсы — догоняем релизы, случившиеся, пока бот лежал.
+    """
+    seen: dict[str, float | None] = {}
+    while True:
+        for code in COURSES:
+            try:
+                mtime = _course_mtime(code)
+                if code in seen and seen[code] == mtime:
+                    continue
+                await on_course_released(bot, code, course_max_lesson(code))
+                seen[code] = mtime
+            except Exception as e:
+                print("[release_watch_loop] error:", e)
+        await asyncio.sleep(CATALOG_POLL_SECONDS)
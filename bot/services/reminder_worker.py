@@ -1,15 +1,16 @@
 from __future__ import annotations
 import asyncio
 from datetime import datetime, timezone, timedelta
-from pathlib import Path
+from zoneinfo import ZoneInfo
 from aiogram import Bot
 
 # --- ИСПРАВЛЕННЫЕ ИМПОРТЫ ---
 # Мы объединили все импорты в один блок, чтобы не было дублирования.
 from bot.services.db import get_db
-from bot.config import get_settings, now_utc_str
-from bot.services.lessons import list_l_lessons, parse_l_num
-from . import points  # <-- ИСПРАВЛЕННЫЙ ИМПОРТ для points.py
+from bot.config import get_settings, now_utc_str, parse_hours_window
+from bot.services.sender import send_bulk
+from bot.services.segments import Segment, compile_where
+from . import admin_cards, approvals
 # ---------------------------
 
 
@@ -25,158 +26,268 @@ MAX_REMIND_COUNT = len(REMINDER_TEXTS)
 # Интервал между напоминаниями (MVP: 24 часа)
 REMIND_INTERVAL_HOURS = 24
 
-# Интервал цикла воркера
-LOOP_SLEEP_SECONDS = 600
+# Сколько напоминаний разбираем за одну пачку и сколько шлём одновременно
+REMIND_CHUNK_SIZE = 200
+REMIND_SEND_CONCURRENCY = 10
 
+# Кому вообще шлём напоминания (фильтр по ученику поверх сроков прогресса)
+REMIND_SEGMENT = Segment()
 
-async def _send_progress_reminders(bot: Bot) -> None:
+# Через сколько минут после сдачи работа принимается автоматически
+AUTO_APPROVE_DELAY_MINUTES = 10
+
+# Если ничего не запланировано — спим не дольше 5 минут: сигнал notify_due_changed()
+# не долетает из других процессов бота, поэтому сроки всё равно перечитываем
+IDLE_SLEEP_SECONDS = 300
+# Пауза после ошибки цикла, чтобы не крутиться вхолостую
+ERROR_SLEEP_SECONDS = 60
+# Минимальный сон между проходами
+MIN_SLEEP_SECONDS = 1
+
+# Сигнал «сроки изменились»: хендлеры будят планировщик раньше времени
+_wakeup = asyncio.Event()
+
+
+def notify_due_changed() -> None:
     """
-    Шлём напоминания по прогрессам со статусами 'sent'/'returned',
-    у которых remind_at <= now. Используем счётчик reminded для эскалации.
+    Будит планировщик напоминаний. Вызывать после того, как хендлер
+    вставил или изменил remind_at / submitted_at / статус прогресса.
     """
-    now_iso = now_utc_str()
+    _wakeup.set()
+
+
+def _parse_utc(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _utc_iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+def _student_tz(name: str | None, default: ZoneInfo) -> ZoneInfo:
+    if not name:
+        return default
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return default
 
+
+def _window_slot(
+    pid: int,
+    now: datetime,
+    tz: ZoneInfo,
+    window: tuple[int, int] | None,
+) -> datetime | None:
+    """
+    None — напоминание можно слать сейчас. Иначе — момент, на который его перенести.
+    У каждого pid свой слот внутри окна (смещение от открытия — мультипликативный хеш),
+    поэтому созревшие напоминания ложатся по окну равномерно, а не пачкой за один тик:
+    и отложенные с ночи, и созревшие днём. Слот текущего окна уже прошёл — шлём сейчас.
+    """
+    if not window:
+        return None
+    start, end = window
+    local = now.astimezone(tz)
+    hour = local.hour + local.minute / 60
+    inside = (start <= hour < end) if start < end else (hour >= start or hour < end)
+
+    opens = local.replace(hour=start, minute=0, second=0, microsecond=0)
+    if inside and opens > local:
+        # окно через полночь, сейчас его «утренняя» часть — открылось вчера
+        opens -= timedelta(days=1)
+    elif not inside and opens <= local:
+        opens += timedelta(days=1)
+    window_seconds = ((end - start) % 24) * 3600
+    offset = (pid * 2654435761) % window_seconds
+    slot = opens + timedelta(seconds=offset)
+    if inside and slot <= local:
+        return None
+    return slot.astimezone(timezone.utc)
+
+
+async def _load_next_due() -> tuple[datetime | None, datetime | None]:
+    """
+    Ближайшие сроки из индексов (status, remind_at) и (status, submitted_at):
+    (следующее напоминание, следующий автоприём).
+    """
     async with get_db() as db:
         cur = await db.execute(
             """
-            SELECT p.id, p.student_id, p.remind_at, p.reminded, p.status,
-                   s.tg_id
-            FROM progress p
-            JOIN students s ON s.id = p.student_id
-            WHERE p.status IN ('sent','returned')
-              AND p.remind_at IS NOT NULL
-              AND p.remind_at <= ?
-            """,
-            (now_iso,),
+            SELECT
+              (SELECT MIN(remind_at) FROM progress
+                WHERE status='sent' AND remind_at IS NOT NULL)     AS sent_due,
+              (SELECT MIN(remind_at) FROM progress
+                WHERE status='returned' AND remind_at IS NOT NULL) AS returned_due,
+              (SELECT MIN(submitted_at) FROM progress
+                WHERE status='submitted' AND submitted_at IS NOT NULL) AS submitted_min
+            """
         )
-        rows = await cur.fetchall()
-
-        for r in rows:
-            pid = r["id"]
-            tg_id = r["tg_id"]
-            reminded = (r["reminded"] or 0)
-
-            # Выбираем текст по индексу, после лимита больше не шлём
-            if reminded >= MAX_REMIND_COUNT:
-                # Гасим дальнейшие напоминания
-                await db.execute(
-                    "UPDATE progress SET remind_at=NULL, updated_at=? WHERE id=?",
-                    (now_iso, pid),
-                )
-                continue
+        row = await cur.fetchone()
 
-            text = REMINDER_TEXTS[min(reminded, MAX_REMIND_COUNT - 1)]
+    reminds = [d for d in (_parse_utc(row["sent_due"]), _parse_utc(row["returned_due"])) if d]
+    remind_due = min(reminds) if reminds else None
 
-            try:
-                await bot.send_message(tg_id, text)
-            except Exception:
-                # не валимся из-за сетевых/блокировок
-                pass
+    approve_due = _parse_utc(row["submitted_min"])
+    if approve_due is not None:
+        approve_due += timedelta(minutes=AUTO_APPROVE_DELAY_MINUTES)
 
-            # Сдвигаем следующее окно + увеличиваем счётчик
-            next_at = (
-                datetime.now(timezone.utc) + timedelta(hours=REMIND_INTERVAL_HOURS)
-            ).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    return remind_due, approve_due
 
-            await db.execute(
-                "UPDATE progress SET remind_at=?, reminded=COALESCE(reminded,0)+1, updated_at=? WHERE id=?",
-                (next_at, now_iso, pid),
-            )
 
-        await db.commit()
+async def _send_progress_reminders(bot: Bot) -> None:
+    """
+    Шлём напоминания по прогрессам со статусами 'sent'/'returned',
+    у которых remind_at <= now. Используем счётчик reminded для эскалации.
 
+    Разбираем пачками по REMIND_CHUNK_SIZE (keyset по p.id): чтение — короткое,
+    отправка — параллельно через общий лимитер, без открытой транзакции,
+    а сдвиг remind_at всей пачки — одним executemany после отправки.
 
-async def _notify_waiting_lessons(bot: Bot) -> None:
-    """
-    Если у ученика стоит waiting_lessons=1 и появился новый L-урок — уведомляем.
-    Сбрасываем флаг и обновляем last_known_max_lesson.
+    Если задано окно доставки (students.remind_window или REMIND_WINDOW, по местному
+    времени ученика) — шлём только в нём, каждому pid — не раньше его слота в окне (_window_slot).
+    Созревшие раньше слота переносятся на слот без расхода попытки — эскалация
+    и MAX_REMIND_COUNT не меняются.
     """
     settings = get_settings()
-    lessons_dir = Path(settings.lessons_path)
+    default_tz = _student_tz(settings.timezone, ZoneInfo("UTC"))
+    now = datetime.now(timezone.utc)
+    now_iso = now_utc_str()
+    last_id = 0
+    seg_where, seg_params = compile_where(REMIND_SEGMENT, alias="s")
 
-    lessons = list_l_lessons(lessons_dir)
-    current_max = 0
-    for code in lessons:
-        n = parse_l_num(code) or 0
-        if n > current_max:
-            current_max = n
+    while True:
+        async with get_db() as db:
+            cur = await db.execute(
+                f"""
+                SELECT p.id, p.reminded, s.tg_id, s.timezone, s.remind_window,
+                       CASE WHEN {seg_where} THEN 1 ELSE 0 END AS in_segment
+                FROM progress p
+                JOIN students s ON s.id = p.student_id
+                WHERE p.status IN ('sent','returned')
+                  AND p.remind_at IS NOT NULL
+                  AND p.remind_at <= ?
+                  AND p.id > ?
+                ORDER BY p.id
+                LIMIT ?
+                """,
+                (*seg_params, now_iso, last_id, REMIND_CHUNK_SIZE),
+            )
+            rows = await cur.fetchall()
 
-    if current_max <= 0:
-        return
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
 
-    async with get_db() as db:
-        cur = await db.execute(
-            "SELECT id, tg_id, last_known_max_lesson FROM students WHERE waiting_lessons=1"
+        expired: list[int] = []
+        deferred: list[tuple[str, str, int]] = []
+        skipped: list[int] = []
+        due = []
+        for r in rows:
+            # После лимита больше не шлём — гасим дальнейшие напоминания
+            if (r["reminded"] or 0) >= MAX_REMIND_COUNT:
+                expired.append(r["id"])
+                continue
+            # Ученик вне REMIND_SEGMENT — не шлём, но срок сдвигаем, чтобы планировщик не крутился
+            if not r["in_segment"]:
+                skipped.append(r["id"])
+                continue
+            window = parse_hours_window(r["remind_window"]) or settings.remind_window
+            slot = _window_slot(r["id"], now, _student_tz(r["timezone"], default_tz), window)
+            if slot is not None:
+                deferred.append((_utc_iso(slot), now_iso, r["id"]))
+            else:
+                due.append(r)
+
+        # Не валимся из-за сетевых/блокировок: send_bulk ошибки не пробрасывает
+        await send_bulk(
+            bot,
+            [(r["tg_id"], REMINDER_TEXTS[min(r["reminded"] or 0, MAX_REMIND_COUNT - 1)]) for r in due],
+            concurrency=REMIND_SEND_CONCURRENCY,
         )
-        students_rows = await cur.fetchall()
-
-        for s in students_rows:
-            last_known = s["last_known_max_lesson"] or 0
-            if current_max > last_known:
-                try:
-                    await bot.send_message(
-                        s["tg_id"],
-                        "Появились новые уроки! Можно продолжить обучение 🎸"
-                    )
-                except Exception:
-                    pass
-
-                await db.execute(
-                    "UPDATE students SET waiting_lessons=0, last_known_max_lesson=? WHERE id=?",
-                    (current_max, s["id"]),
+
+        # Сдвигаем следующее окно + увеличиваем счётчик
+        next_at = _utc_iso(datetime.now(timezone.utc) + timedelta(hours=REMIND_INTERVAL_HOURS))
+        async with get_db() as db:
+            if expired:
+                await db.executemany(
+                    "UPDATE progress SET remind_at=NULL, updated_at=? WHERE id=?",
+                    [(now_iso, pid) for pid in expired],
+                )
+            if deferred:
+                await db.executemany("UPDATE progress SET remind_at=?, updated_at=? WHERE id=?", deferred)
+            if skipped:
+                await db.executemany(
+                    "UPDATE progress SET remind_at=?, updated_at=? WHERE id=?",
+                    [(next_at, now_iso, pid) for pid in skipped],
                 )
+            if due:
+                await db.executemany(
+                    "UPDATE progress SET remind_at=?, reminded=COALESCE(reminded,0)+1, updated_at=? WHERE id=?",
+                    [(next_at, now_iso, r["id"]) for r in due],
+                )
+            await db.commit()
 
-        await db.commit()
+        if len(rows) < REMIND_CHUNK_SIZE:
+            break
 
 
 async def _auto_approve_submitted_lessons(bot: Bot) -> None:
-    now_iso = now_utc_str()
+    # Порог считаем в том же формате, что и submitted_at (…T…Z),
+    # иначе строковое сравнение с datetime('now') ломается на разделителе.
+    cutoff_iso = _utc_iso(datetime.now(timezone.utc) - timedelta(minutes=AUTO_APPROVE_DELAY_MINUTES))
 
+    # Ищем работы, которые были сданы более AUTO_APPROVE_DELAY_MINUTES назад и ещё не приняты
     async with get_db() as db:
-        # Ищем работы, которые были сданы более 10 минут назад
-        # и ещё не приняты.
         cur = await db.execute(
-            """
-            SELECT p.id, s.tg_id, s.id AS sid
-            FROM progress p
-            JOIN students s ON s.id = p.student_id
-            WHERE p.status = 'submitted'
-              AND p.submitted_at <= datetime('now', '-10 minutes') || 'Z'
-            """
+            "SELECT id FROM progress WHERE status = 'submitted' AND submitted_at <= ? ORDER BY id",
+            (cutoff_iso,),
         )
-        rows = await cur.fetchall()
+        pids = [r["id"] for r in await cur.fetchall()]
 
-        for r in rows:
-            pid, tg_id, sid = r['id'], r['tg_id'], r['sid']
-
-            # Обновляем статус на 'approved'
-            await db.execute(
-                "UPDATE progress SET status='approved', approved_at=?, updated_at=? WHERE id=?",
-                (now_iso, now_iso, pid),
-            )
-
-            # Начисляем 100 баллов
-            try:
-                # Используем идемпотентный метод для начисления
-                await points.add(sid, f"lesson_approved_auto:{pid}", 100)
-            except Exception:
-                pass
-
-            # Отправляем уведомление ученику
-            await bot.send_message(tg_id, "✅ Твоя работа была автоматически принята. Держи 100 баллов!")
-
-        await db.commit()
+    # Принимаем тем же сервисом, что и админ: статус (если админ успел раньше — пропуск),
+    # баллы, бонус модуля, ранг и уведомление в outbox — одной транзакцией
+    if pids:
+        for res in await approvals.approve_many(pids, auto=True):
+            if res.ok:
+                admin_cards.update_copies_later(bot, res.pid, "🤖 Принято автоматически", final=True)
 
 async def reminder_loop(bot: Bot):
-    # ...
+    """
+    Планировщик: спит ровно до ближайшего срока (remind_at или submitted_at + задержка)
+    и просыпается раньше, если хендлер дёрнул notify_due_changed().
+    Каждая задача запускается только когда у неё действительно что-то созрело.
+    """
     while True:
+        # Сбрасываем сигнал ДО чтения сроков: изменение во время прохода не потеряется
+        _wakeup.clear()
         try:
-            await _send_progress_reminders(bot)
-            # Добавим новую функцию в цикл
-            await _auto_approve_submitted_lessons(bot)
-            #await _notify_waiting_lessons(bot)
+            remind_due, approve_due = await _load_next_due()
+            now = datetime.now(timezone.utc)
+
+            if remind_due is not None and remind_due <= now:
+                await _send_progress_reminders(bot)
+            if approve_due is not None and approve_due <= now:
+                await _auto_approve_submitted_lessons(bot)
+
+            remind_due, approve_due = await _load_next_due()
+            pending = [d for d in (remind_due, approve_due) if d is not None]
+            if pending:
+                delay = (min(pending) - datetime.now(timezone.utc)).total_seconds()
+                delay = min(max(delay, MIN_SLEEP_SECONDS), IDLE_SLEEP_SECONDS)
+            else:
+                delay = IDLE_SLEEP_SECONDS
         except Exception as e:
             # ... (логирование)
             print("[reminder_loop] error:", e)
+            delay = ERROR_SLEEP_SECONDS
 
-        await asyncio.sleep(LOOP_SLEEP_SECONDS)
\ No newline at end of file
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,108 @@
+# bot/services/rollups.py
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import aiosqlite
+
+from bot.services import funnel
+from bot.services.db import get_db
+
+log = logging.getLogger("maestro")
+
+# Как часто пересчитываем «грязные» дни (их помечают триггеры, см. migrate_rollups)
+ROLLUP_SECONDS = 600
+# Дней за одну транзакцию: после миграции помечено всё — догоняем порциями
+ROLLUP_MAX_DAYS = 60
+
+# Откуда берутся дневные агрегаты: таблица → (колонки-даты, прочие колонки, влияющие на метрики).
+# По этому же описанию migrate_rollups строит триггеры, помечающие дни в rollup_dirty.
+ROLLUP_SOURCES = {
+    "progress": (("sent_at", "submitted_at", "approved_at"), ("status", "lesson_code")),
+    "students": (("created_at", "onboarded_at", "approved_at"), ()),
+    "payments": (("paid_at",), ("amount", "course_code")),
+    "test_results": (("created_at",), ("passed",)),
+}
+
+# lesson_code = 'курс:LNN' → 'курс'
+_LESSON_COURSE = "COALESCE(substr(lesson_code, 1, instr(lesson_code, ':') - 1), '')"
+
+# Метрика → запрос (курс, значение) за день [?, ?). Курс '' — метрика не привязана к курсу.
+ROLLUP_QUERIES = {
+    "lessons_issued": f"SELECT {_LESSON_COURSE}, COUNT(*) FROM progress WHERE sent_at >= ? AND sent_at < ? GROUP BY 1",
+    "lessons_submitted": (
+        f"SELECT {_LESSON_COURSE}, COUNT(*) FROM progress WHERE submitted_at >= ? AND submitted_at < ? GROUP BY 1"
+    ),
+    "lessons_approved": (
+        f"SELECT {_LESSON_COURSE}, COUNT(*) FROM progress "
+        f"WHERE approved_at >= ? AND approved_at < ? AND status='approved' GROUP BY 1"
+    ),
+    "revenue": "SELECT COALESCE(course_code,''), SUM(amount) FROM payments WHERE paid_at >= ? AND paid_at < ? GROUP BY 1",
+    "payments": "SELECT COALESCE(course_code,''), COUNT(*) FROM payments WHERE paid_at >= ? AND paid_at < ? GROUP BY 1",
+    "new_students": "SELECT '', COUNT(*) FROM students WHERE created_at >= ? AND created_at < ?",
+    "onboarded": "SELECT '', COUNT(*) FROM students WHERE onboarded_at >= ? AND onboarded_at < ?",
+    "students_approved": "SELECT '', COUNT(*) FROM students WHERE approved_at >= ? AND approved_at < ?",
+    "tests_taken": "SELECT '', COUNT(*) FROM test_results WHERE created_at >= ? AND created_at < ?",
+    "tests_passed": "SELECT '', COALESCE(SUM(passed),0) FROM test_results WHERE created_at >= ? AND created_at < ?",
+}
+
+
+async def _recompute_day(db: aiosqlite.Connection, day: str) -> None:
+    """Все метрики одного UTC-дня заново (по индексам на колонках-датах)."""
+    await db.execute("DELETE FROM rollup_daily WHERE day=?", (day,))
+    # '~' больше любого символа времени: диапазон покрывает и '…T…Z', и '… …'
+    bounds = (day, day + "~")
+    for metric, sql in ROLLUP_QUERIES.items():
+        cur = await db.execute(sql, bounds)
+        await db.executemany(
+            "INSERT INTO rollup_daily(day, course, metric, value) VALUES(?,?,?,?)",
+            [(day, course, metric, value) for course, value in await cur.fetchall() if value],
+        )
+
+
+async def run_once(max_days: int = ROLLUP_MAX_DAYS) -> int:
+    """Пересчитать до max_days помеченных дней одной транзакцией. Возвращает число дней."""
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT day FROM rollup_dirty ORDER BY day LIMIT ?", (max_days,))
+        days = [r["day"] for r in await cur.fetchall()]
+        for day in days:
+            await _recompute_day(db, day)
+        await db.executemany("DELETE FROM rollup_dirty WHERE day=?", [(d,) for d in days])
+        await db.commit()
+    return len(days)
+
+
+async def window(days: int) -> dict[str, dict[str, int]]:
+    """Суммы за последние days дней, включая сегодня: {метрика: {курс: значение}}."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    async with get_db() as db:
+        cur = await db.execute(
+            "SELECT metric, course, SUM(value) AS v FROM rollup_daily WHERE day >= ? GROUP BY metric, course",
+            (since,),
+        )
+        rows = await cur.fetchall()
+    out: dict[str, dict[str, int]] = defaultdict(dict)
+    for r in rows:
+        out[r["metric"]][r["course"]] = r["v"]
+    return out
+
+
+async def rollup_loop():
+    """
+    Догоняем помеченные дни и учеников воронки; когда очереди пусты — спим ROLLUP_SECONDS.
+    Отчёт по воронке пересобирается ночью (funnel.rebuild_if_due).
+    """
+    while True:
+        try:
+            while await run_once() == ROLLUP_MAX_DAYS:
+                await asyncio.sleep(0)
+            while await funnel.refresh_dirty() == funnel.FUNNEL_REFRESH_BATCH:
+                await asyncio.sleep(0)
+            await funnel.rebuild_if_due()
+        except Exception as e:
+            print("[rollup_loop] error:", e)
+        await asyncio.sleep(ROLLUP_SECONDS)
@@ -0,0 +1,261 @@
+# bot/services/segments.py
+from __future__ import annotations
+
+import json
+import shlex
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+
+from bot.config import COURSES
+from bot.services.db import get_db
+from bot.services.ranks import RANKS
+from bot.services.sender import GLOBAL_RATE_PER_SEC
+
+# Поля ученика, которые отдаём получателям (их же подставляет BroadcastTemplate)
+RECIPIENT_COLUMNS = "id, tg_id, username, first_name, last_name"
+ACTIVE_STATUSES = ("sent", "returned", "submitted")
+
+
+@dataclass
+class Segment:
+    """
+    Аудитория рассылки/уведомления. None — фильтр не задан.
+    Все фильтры складываются через AND.
+    По умолчанию только доступные (reachable=1): заблокировавшим бота не шлём.
+    """
+    reachable: bool | None = True         # бот не заблокирован, чат существует
+    course: str | None = None             # есть уроки в курсе (progress.lesson_code = 'курс:…')
+    paid: str | None = None               # есть оплата за курс
+    approved: bool | None = None          # анкета одобрена
+    onboarded: bool | None = None         # анкета заполнена
+    waiting: bool | None = None           # ждёт новых уроков
+    waiting_course: str | None = None     # ждёт новых уроков именно этого курса
+    known_max_below: int | None = None    # last_known_max_lesson < N (для релизов)
+    guitar: bool | None = None            # есть гитара
+    active: bool | None = None            # есть активное задание (sent/returned/submitted)
+    seen_days: int | None = None          # заходил за последние N дней
+    unseen_days: int | None = None        # не заходил N дней (или не заходил вовсе)
+    rank: str | None = None               # название ранга
+    points_min: int | None = None         # rank_points >= N
+    points_max: int | None = None         # rank_points <= N
+
+    def is_empty(self) -> bool:
+        """Нет фильтров сверх умолчаний."""
+        return all(getattr(self, f.name) == f.default for f in fields(self))
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str | None) -> "Segment":
+        if not raw:
+            return cls()
+        data = json.loads(raw)
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def _days_ago_iso(days: int) -> str:
+    dt = datetime.now(timezone.utc) - timedelta(days=days)
+    return dt.replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+def compile_where(seg: Segment, alias: str = "students") -> tuple[str, list]:
+    """
+    Компилирует сегмент в WHERE (по таблице students под именем alias) и параметры.
+    Условия опираются на индексы: students(reachable, id), (approved, onboarding_done),
+    (last_seen), (rank_points), idx_students_waiting, payments(course_code, student_id), progress(student_id, lesson_code/status).
+    """
+    a = alias
+    where = [f"{a}.tg_id IS NOT NULL"]
+    params: list = []
+
+    # Колонки сравниваем напрямую, без COALESCE — иначе индексы не работают.
+    # NULL в флагах и rank_points не бывает: DEFAULT 0 + досыпка в migrate_students.
+    def flag(col: str, value: bool | None) -> None:
+        if value is not None:
+            where.append(f"{a}.{col}=?")
+            params.append(1 if value else 0)
+
+    flag("reachable", seg.reachable)
+    flag("approved", seg.approved)
+    flag("onboarding_done", seg.onboarded)
+    flag("waiting_lessons", seg.waiting)
+    flag("has_guitar", seg.guitar)
+
+    if seg.waiting_course is not None:
+        where.append(f"{a}.waiting_course=?")
+        params.append(seg.waiting_course)
+    if seg.known_max_below is not None:
+        where.append(f"COALESCE({a}.last_known_max_lesson,0) < ?")
+        params.append(seg.known_max_below)
+    if seg.seen_days is not None:
+        where.append(f"{a}.last_seen >= ?")
+        params.append(_days_ago_iso(seg.seen_days))
+    if seg.unseen_days is not None:
+        where.append(f"({a}.last_seen IS NULL OR {a}.last_seen < ?)")
+        params.append(_days_ago_iso(seg.unseen_days))
+    if seg.rank is not None:
+        where.append(f"{a}.rank=?")
+        params.append(seg.rank)
+    if seg.points_min is not None:
+        where.append(f"{a}.rank_points >= ?")
+        params.append(seg.points_min)
+    if seg.points_max is not None:
+        where.append(f"{a}.rank_points <= ?")
+        params.append(seg.points_max)
+    if seg.course is not None:
+        # lesson_code = 'курс:LNN' — диапазон вместо LIKE (в коде курса есть «_»)
+        where.append(
+            f"EXISTS (SELECT 1 FROM progress sp WHERE sp.student_id={a}.id "
+            f"AND sp.lesson_code >= ? AND sp.lesson_code < ?)"
+        )
+        params += [f"{seg.course}:", f"{seg.course};"]
+    if seg.paid is not None:
+        where.append(f"EXISTS (SELECT 1 FROM payments sy WHERE sy.course_code=? AND sy.student_id={a}.id)")
+        params.append(seg.paid)
+    if seg.active is not None:
+        marks = ",".join("?" * len(ACTIVE_STATUSES))
+        where.append(
+            f"{'' if seg.active else 'NOT '}EXISTS (SELECT 1 FROM progress sa "
+            f"WHERE sa.student_id={a}.id AND sa.status IN ({marks}))"
+        )
+        params += list(ACTIVE_STATUSES)
+
+    return " AND ".join(where), params
+
+
+async def count(seg: Segment) -> int:
+    where, params = compile_where(seg)
+    async with get_db() as db:
+        cur = await db.execute(f"SELECT COUNT(*) AS c FROM students WHERE {where}", params)
+        return (await cur.fetchone())["c"]
+
+
+def eta_seconds(n: int) -> int:
+    """Оценка времени отправки n сообщений при общем лимите."""
+    return int(n / GLOBAL_RATE_PER_SEC)
+
+
+async def fetch_chunk(seg: Segment, after_id: int, limit: int, columns: str = RECIPIENT_COLUMNS) -> list:
+    """Следующая пачка получателей после after_id (keyset по students.id)."""
+    where, params = compile_where(seg)
+    async with get_db() as db:
+        cur = await db.execute(
+            f"SELECT {columns} FROM students WHERE {where} AND id > ? ORDER BY id LIMIT ?",
+            (*params, after_id, limit),
+        )
+        return await cur.fetchall()
+
+
+async def stream(
+    seg: Segment, chunk_size: int, after_id: int = 0, columns: str = RECIPIENT_COLUMNS
+) -> AsyncIterator[list]:
+    """Получатели сегмента пачками; соединение с БД не держим между пачками."""
+    while True:
+        rows = await fetch_chunk(seg, after_id, chunk_size, columns)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after_id = rows[-1]["id"]
+
+
+# ----------------- текстовый формат для админа -----------------
+
+_BOOL_KEYS = {
+    "approved": "approved",
+    "onboarded": "onboarded",
+    "waiting": "waiting",
+    "guitar": "guitar",
+    "active": "active",
+}
+
+SEGMENT_HELP = (
+    "Фильтры через пробел (все должны выполняться):\n"
+    "• approved=1 / onboarded=1 / guitar=1 / waiting=1 / active=1 (или =0)\n"
+    "• course=<код> — учится на курсе; paid=<код> — оплатил курс\n"
+    "• seen=7 — заходил за 7 дней; unseen=30 — не заходил 30 дней\n"
+    "• points=100-500 — диапазон баллов; rank=<название> — ранг (rank=Ученик II)\n"
+    f"Коды курсов: {', '.join(COURSES)}\n"
+    "«всем» — без фильтров."
+)
+
+
+_RANK_NAMES = {name.casefold(): name for _, name in RANKS}
+
+
+def _take_rank(value: str, rest: list[str]) -> tuple[str, int]:
+    """
+    Название ранга бывает из нескольких слов («Ученик II»): пишут как есть, в кавычках
+    или через «_». Берём самое длинное совпадение с RANKS. → (название, сколько слов из rest съели).
+    """
+    words = value.replace("_", " ").split()
+    for n in range(len(rest), -1, -1):
+        name = _RANK_NAMES.get(" ".join(words + rest[:n]).casefold())
+        if name:
+            return name, n
+    raise ValueError(f"Нет ранга «{value}». Есть: {', '.join(_RANK_NAMES.values())}.")
+
+
+def parse(text: str) -> Segment:
+    """'approved=1 course=course_general rank=Ученик II' → Segment. Ошибка — ValueError с понятным текстом."""
+    seg = Segment()
+    text = (text or "").strip()
+    if text.casefold() in {"", "всем", "все", "all"}:
+        return seg
+
+    try:
+        tokens = shlex.split(text)
+    except ValueError:
+        raise ValueError("Не закрыта кавычка.") from None
+    while tokens:
+        token = tokens.pop(0)
+        key, sep, value = token.partition("=")
+        key = key.strip().lower()
+        value = value.strip()
+        if not sep or not value:
+            raise ValueError(f"Не понял «{token}» — нужно ключ=значение.")
+
+        if key in _BOOL_KEYS:
+            if value not in {"0", "1"}:
+                raise ValueError(f"{key}: только 0 или 1.")
+            setattr(seg, _BOOL_KEYS[key], value == "1")
+        elif key in {"course", "paid"}:
+            if value not in COURSES:
+                raise ValueError(f"Нет курса «{value}». Есть: {', '.join(COURSES)}.")
+            setattr(seg, key, value)
+        elif key in {"seen", "unseen"}:
+            if not value.isdigit():
+                raise ValueError(f"{key}: число дней.")
+            setattr(seg, f"{key}_days", int(value))
+        elif key == "points":
+            lo, _, hi = value.partition("-")
+            try:
+                seg.points_min = int(lo) if lo else None
+                seg.points_max = int(hi) if hi else None
+            except ValueError:
+                raise ValueError("points: диапазон вида 100-500 (или 100- / -500).") from None
+        elif key == "rank":
+            seg.rank, used = _take_rank(value, tokens)
+            del tokens[:used]
+        else:
+            raise ValueError(f"Неизвестный фильтр «{key}».")
+    return seg
+
+
+def describe(seg: Segment) -> str:
+    """Короткое описание сегмента для сообщений админу."""
+    if seg.is_empty():
+        return "все ученики"
+    parts = []
+    for f in fields(seg):
+        v = getattr(seg, f.name)
+        if v == f.default:
+            continue
+        if isinstance(v, bool):
+            v = int(v)
+        parts.append(f"{f.name}={v}")
+    return " ".join(parts)
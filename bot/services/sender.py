@@ -0,0 +1,104 @@
+# bot/services/sender.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.services.reachability import is_unreachable_error, mark_unreachable
+
+log = logging.getLogger("maestro")
+
+# Telegram пускает ~30 сообщений/сек на бота — держим запас
+GLOBAL_RATE_PER_SEC = 25
+# Сколько отправок держим «в полёте» одновременно при массовых рассылках
+DEFAULT_CONCURRENCY = 10
+# Сколько раз повторяем отправку после RetryAfter
+MAX_SEND_ATTEMPTS = 3
+
+
+class RateLimiter:
+    """Токен-бакет на весь процесс: не больше rate отправок в секунду."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+limiter = RateLimiter(GLOBAL_RATE_PER_SEC)
+
+
+async def send_message(bot: Bot, chat_id: int, text: str, **kwargs: Any) -> bool:
+    """
+    Отправка через общий лимитер.
+    RetryAfter — ждём сколько просит Telegram и повторяем; прочие ошибки — False, без исключения.
+    Бот заблокирован / чата нет — помечаем ученика недоступным (students.reachable=0).
+    """
+    for _ in range(MAX_SEND_ATTEMPTS):
+        await limiter.acquire()
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+            return True
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            if is_unreachable_error(e):
+                await mark_unreachable(chat_id, str(e))
+            else:
+                log.warning("send_message to %s failed: %s", chat_id, e)
+            return False
+    return False
+
+
+async def send_bulk(
+    bot: Bot,
+    items: Iterable[tuple[int, str]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **kwargs: Any,
+) -> list[bool]:
+    """
+    Параллельная отправка пар (chat_id, text), не больше concurrency одновременно.
+    Возвращает результаты в том же порядке.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(chat_id: int, text: str) -> bool:
+        async with sem:
+            return await send_message(bot, chat_id, text, **kwargs)
+
+    return list(await asyncio.gather(*(_one(chat_id, text) for chat_id, text in items)))
+
+
+async def edit_message_text(bot: Bot, chat_id: int, message_id: int, text: str, **kwargs: Any) -> bool:
+    """Правка сообщения через тот же лимитер. «message is not modified» — тоже успех."""
+    for _ in range(MAX_SEND_ATTEMPTS):
+        await limiter.acquire()
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+            return True
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            if "message is not modified" in str(e):
+                return True
+            log.warning("edit_message_text %s/%s failed: %s", chat_id, message_id, e)
+            return False
+    return False
@@ -0,0 +1,54 @@
+# bot/services/student_search.py
+from __future__ import annotations
+
+import re
+
+from bot.services.db import get_db
+
+# Индекс students_fts и триггеры синхронизации — bot/tools/migrate_unified.py: migrate_students_fts
+SEARCH_PAGE_SIZE = 8
+# Больше слов в запросе не берём — длинная строка всё равно сводится к этим
+MAX_QUERY_TERMS = 6
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(text: str) -> str | None:
+    """
+    'Иван @bob +7 777' → '"иван"* AND "bob"* AND "7777"*'.
+    Каждое слово — префиксный поиск; цифры склеиваем (телефон в индексе хранится без разделителей).
+    Телефон в индексе — целиком и последними 10 цифрами, поэтому «777 123» находит «+7 777 123…»,
+    а у 11+ цифр («8 777 …») ищем по последним 10 — так код страны не мешает.
+    """
+    text = (text or "").strip()
+    digits = re.sub(r"\D", "", text)
+    # запрос целиком похож на телефон — ищем одним токеном цифр
+    if digits and len(digits) >= 3 and not re.search(r"[^\d\s()+\-]", text):
+        return f'"{digits[-10:]}"*'
+
+    terms = [t.lower() for t in _TERM_RE.findall(text)][:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return " AND ".join(f'"{t}"*' for t in terms)
+
+
+async def search(text: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE) -> tuple[list, bool]:
+    """Ученики по релевантности (bm25). Возвращает (строки, есть_ещё)."""
+    query = fts_query(text)
+    if not query:
+        return [], False
+    async with get_db() as db:
+        cur = await db.execute(
+            """
+            SELECT s.id, s.tg_id, s.username, s.first_name, s.last_name, s.phone,
+                   s.onboarding_done, s.approved
+            FROM students_fts f
+            JOIN students s ON s.id = f.rowid
+            WHERE students_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ? OFFSET ?
+            """,
+            (query, limit + 1, offset),
+        )
+        rows = await cur.fetchall()
+    return rows[:limit], len(rows) > limit
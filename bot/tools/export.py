@@ -0,0 +1,32 @@
+# bot/tools/export.py
+"""
+Выгрузка таблиц без бота:
+    python -m bot.tools.export payments xlsx since=2025-01-01 -o payments.xlsx
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+from bot.services.exports import EXPORT_HELP, parse_args, write_export
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка таблиц бота в .csv.gz / .xlsx",
+                                     epilog=EXPORT_HELP, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("args", nargs="+", help="<таблица> [xlsx] [ключ=значение ...]")
+    parser.add_argument("-o", "--out", type=Path, help="куда писать (по умолчанию — во временную папку)")
+    ns = parser.parse_args()
+    try:
+        table, fmt, filters = parse_args(ns.args)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        path, count = write_export(table, filters, fmt, ns.out)
+    except RuntimeError as e:
+        parser.exit(1, f"[ERR] {e}\n")
+    print(f"[OK] {table}: {count} строк → {path}")
+
+
+if __name__ == "__main__":
+    main()
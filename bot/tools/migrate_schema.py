@@ -114,6 +114,7 @@ def migrate_progress(cur):
         ("idx_progress_student", "CREATE INDEX idx_progress_student ON progress(student_id)"),
         ("idx_progress_status", "CREATE INDEX idx_progress_status ON progress(status)"),
         ("idx_progress_status_remind", "CREATE INDEX idx_progress_status_remind ON progress(status, remind_at)"),
+        ("idx_progress_status_submitted", "CREATE INDEX idx_progress_status_submitted ON progress(status, submitted_at)"),
     ]:
         if not index_exists(cur, idx_name):
             execute(cur, idx_sql)
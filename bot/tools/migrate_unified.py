@@ -47,7 +47,16 @@ async def migrate_students(db: aiosqlite.Connection) -> None:
               consent INTEGER DEFAULT 0,
               waiting_lessons INTEGER DEFAULT 0,
               last_known_max_lesson INTEGER DEFAULT 0,
-              last_seen TEXT
+              last_seen TEXT,
+              approved INTEGER DEFAULT 0,
+              updated_at TEXT,
+              rank TEXT,
+              rank_points INTEGER DEFAULT 0,
+              timezone TEXT,
+              remind_window TEXT,
+              waiting_course TEXT,
+              reachable INTEGER NOT NULL DEFAULT 1,
+              blocked_at TEXT
             );
             """
         )
@@ -69,14 +78,40 @@ async def migrate_students(db: aiosqlite.Connection) -> None:
             ("waiting_lessons", "INTEGER"),
             ("last_known_max_lesson", "INTEGER"),
             ("last_seen", "TEXT"),
+            # одобрение анкеты админом и ранг (баланс баллов ведёт points.award)
+            ("approved", "INTEGER"),
+            ("updated_at", "TEXT"),
+            ("rank", "TEXT"),
+            ("rank_points", "INTEGER"),
+            # персональные часовой пояс и окно напоминаний (NULL — как у всех)
+            ("timezone", "TEXT"),
+            ("remind_window", "TEXT"),
+            # курс, релиза которого ждёт ученик (waiting_lessons=1)
+            ("waiting_course", "TEXT"),
+            # 0 — бот заблокирован / чат не найден; массовые отправки пропускают
+            ("reachable", "INTEGER"),
+            ("blocked_at", "TEXT"),
         ]
         for name, typ in cols:
             if not await column_exists(db, "students", name):
-                if name in {"has_guitar", "experience_months", "onboarding_done", "consent",
-                            "waiting_lessons", "last_known_max_lesson"}:
+                if name == "reachable":
+                    await db.execute(f"ALTER TABLE students ADD COLUMN {name} {typ} NOT NULL DEFAULT 1")
+                elif name in {"has_guitar", "experience_months", "onboarding_done", "consent",
+                            "waiting_lessons", "last_known_max_lesson", "approved", "rank_points"}:
                     await db.execute(f"ALTER TABLE students ADD COLUMN {name} {typ} DEFAULT 0")
                 else:
                     await db.execute(f"ALTER TABLE students ADD COLUMN {name} {typ}")
+    if not await index_exists(db, "idx_students_waiting"):
+        await db.execute(
+            "CREATE INDEX idx_students_waiting ON students(waiting_course, waiting_lessons, last_known_max_lesson)"
+        )
+    # keyset по id среди доступных: reachable=1 AND id > ? ORDER BY id
+    if not await index_exists(db, "idx_students_reachable"):
+        await db.execute("CREATE INDEX idx_students_reachable ON students(reachable, id)")
+    # флаги и баллы без NULL: фильтры сегментов сравнивают колонки напрямую (col=?) — по индексам
+    for name in ("approved", "onboarding_done", "waiting_lessons", "has_guitar", "rank_points"):
+        if await column_exists(db, "students", name):
+            await db.execute(f"UPDATE students SET {name}=0 WHERE {name} IS NULL")
     await db.commit()
 
 
@@ -98,7 +133,11 @@ async def migrate_progress(db: aiosqlite.Connection) -> None:
               deadline_at TEXT,
               remind_at TEXT,
               reminded INTEGER DEFAULT 0,
-              updated_at TEXT
+              updated_at TEXT,
+              claimed_by INTEGER,
+              claimed_at TEXT,
+              source_chat_id INTEGER,
+              source_message_ids TEXT
             );
             """
         )
@@ -117,6 +156,11 @@ async def migrate_progress(db: aiosqlite.Connection) -> None:
             ("remind_at", "TEXT"),
             ("reminded", "INTEGER"),
             ("updated_at", "TEXT"),
+            ("claimed_by", "INTEGER"),
+            ("claimed_at", "TEXT"),
+            # сообщения ученика со сдачей (id через запятую) — копия для переназначенного ревьюера
+            ("source_chat_id", "INTEGER"),
+            ("source_message_ids", "TEXT"),
         ]
         for name, typ in cols:
             if not await column_exists(db, "progress", name):
@@ -131,6 +175,11 @@ async def migrate_progress(db: aiosqlite.Connection) -> None:
         await db.execute("CREATE INDEX idx_progress_remind ON progress(remind_at)")
     if not await index_exists(db, "idx_progress_updated"):
         await db.execute("CREATE INDEX idx_progress_updated ON progress(updated_at)")
+    # планировщик напоминаний: MIN(remind_at) / MIN(submitted_at) по статусу
+    if not await index_exists(db, "idx_progress_status_remind"):
+        await db.execute("CREATE INDEX idx_progress_status_remind ON progress(status, remind_at)")
+    if not await index_exists(db, "idx_progress_status_submitted"):
+        await db.execute("CREATE INDEX idx_progress_status_submitted ON progress(status, submitted_at)")
     await db.commit()
 
 
@@ -142,6 +191,7 @@ async def migrate_payments(db: aiosqlite.Connection) -> None:
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               student_id INTEGER,
               amount INTEGER NOT NULL,
+              course_code TEXT,
               method TEXT,
               note TEXT,
               paid_at TEXT NOT NULL,
@@ -153,6 +203,7 @@ async def migrate_payments(db: aiosqlite.Connection) -> None:
         cols = [
             ("student_id", "INTEGER"),
             ("amount", "INTEGER"),
+            ("course_code", "TEXT"),
             ("method", "TEXT"),
             ("note", "TEXT"),
             ("paid_at", "TEXT"),
@@ -174,6 +225,7 @@ async def migrate_payment_requests(db: aiosqlite.Connection) -> None:
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               student_id INTEGER,
               amount INTEGER,
+              course_code TEXT,
               status TEXT,
               created_at TEXT,
               resolved_at TEXT
@@ -184,6 +236,7 @@ async def migrate_payment_requests(db: aiosqlite.Connection) -> None:
         cols = [
             ("student_id", "INTEGER"),
             ("amount", "INTEGER"),
+            ("course_code", "TEXT"),
             ("status", "TEXT"),
             ("created_at", "TEXT"),
             ("resolved_at", "TEXT"),
@@ -191,6 +244,12 @@ async def migrate_payment_requests(db: aiosqlite.Connection) -> None:
         for name, typ in cols:
             if not await column_exists(db, "payment_requests", name):
                 await db.execute(f"ALTER TABLE payment_requests ADD COLUMN {name} {typ}")
+    # постраничный список заявок: status='pending' AND id > ? ORDER BY id.
+    # Индекс по status в SQLite хранит и rowid (= id), т.е. это уже (status, id) —
+    # берём тот же idx_payreq_status, что и migrate_schema, дубль от прошлых версий удаляем.
+    await db.execute("DROP INDEX IF EXISTS idx_payment_requests_status")
+    if not await index_exists(db, "idx_payreq_status"):
+        await db.execute("CREATE INDEX idx_payreq_status ON payment_requests(status)")
     await db.commit()
 
 
@@ -217,6 +276,494 @@ async def migrate_points(db: aiosqlite.Connection) -> None:
         for name, typ in cols:
             if not await column_exists(db, "points", name):
                 await db.execute(f"ALTER TABLE points ADD COLUMN {name} {typ}")
+    # баланс students.rank_points дальше ведётся инкрементом (points.award) —
+    # выравниваем его по журналу на каждой миграции
+    if await column_exists(db, "students", "rank_points"):
+        await db.execute(
+            """
+            UPDATE students SET rank_points = t.s
+            FROM (SELECT student_id, SUM(amount) AS s FROM points GROUP BY student_id) AS t
+            WHERE t.student_id = students.id AND students.rank_points IS NOT t.s
+            """
+        )
+    await db.commit()
+
+
+async def migrate_test_results(db: aiosqlite.Connection) -> None:
+    # результаты тестов читают тесты ученика, /export и дневные агрегаты (rollups)
+    if not await table_exists(db, "test_results"):
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS test_results(
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id INTEGER NOT NULL,
+              test_code TEXT NOT NULL,
+              correct_count INTEGER NOT NULL,
+              total_count INTEGER NOT NULL,
+              passed INTEGER NOT NULL,
+              created_at TEXT NOT NULL,
+              updated_at TEXT,
+              UNIQUE(user_id, test_code)
+            );
+            """
+        )
+    else:
+        cols = [
+            ("user_id", "INTEGER"),
+            ("test_code", "TEXT"),
+            ("correct_count", "INTEGER"),
+            ("total_count", "INTEGER"),
+            ("passed", "INTEGER"),
+            ("created_at", "TEXT"),
+            ("updated_at", "TEXT"),
+        ]
+        for name, typ in cols:
+            if not await column_exists(db, "test_results", name):
+                await db.execute(f"ALTER TABLE test_results ADD COLUMN {name} {typ}")
+    await db.commit()
+
+
+async def migrate_outbox(db: aiosqlite.Connection) -> None:
+    # уведомления, записанные в одной транзакции со сменой состояния
+    if not await table_exists(db, "outbox"):
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox(
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              chat_id INTEGER NOT NULL,
+              text TEXT NOT NULL,
+              reply_markup TEXT,
+              status TEXT NOT NULL DEFAULT 'pending',
+              attempts INTEGER DEFAULT 0,
+              next_attempt_at TEXT,
+              last_error TEXT,
+              dedupe_key TEXT UNIQUE,
+              created_at TEXT,
+              sent_at TEXT
+            );
+            """
+        )
+    if not await index_exists(db, "idx_outbox_status_next"):
+        await db.execute("CREATE INDEX idx_outbox_status_next ON outbox(status, next_attempt_at)")
+    # «есть ли у чата более раннее письмо в ожидании» — для порядка писем одному чату
+    if not await index_exists(db, "idx_outbox_chat_pending"):
+        await db.execute("CREATE INDEX idx_outbox_chat_pending ON outbox(chat_id, id) WHERE status='pending'")
+    await db.commit()
+
+
+async def migrate_worker_leases(db: aiosqlite.Connection) -> None:
+    # аренды фоновых задач: одна задача — один процесс
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS worker_leases(
+          name TEXT PRIMARY KEY,
+          holder TEXT NOT NULL,
+          expires_at TEXT NOT NULL
+        );
+        """
+    )
+    await db.commit()
+
+
+async def migrate_admin_cards(db: aiosqlite.Connection) -> None:
+    # копии карточек сдачи у админов — чтобы править их все при взятии/проверке
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS admin_cards(
+          pid INTEGER NOT NULL,
+          chat_id INTEGER NOT NULL,
+          message_id INTEGER NOT NULL,
+          text TEXT NOT NULL,
+          tg_id INTEGER,
+          PRIMARY KEY (pid, chat_id)
+        );
+        """
+    )
+    await db.commit()
+
+
+async def migrate_review_assignments(db: aiosqlite.Connection) -> None:
+    # назначения работ ревьюерам: открытые (finished_at IS NULL) и история для статистики
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS review_assignments(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          pid INTEGER NOT NULL,
+          admin_id INTEGER NOT NULL,
+          assigned_at TEXT NOT NULL,
+          finished_at TEXT,
+          outcome TEXT
+        );
+        """
+    )
+    if not await index_exists(db, "idx_review_assignments_open"):
+        await db.execute(
+            "CREATE INDEX idx_review_assignments_open ON review_assignments(assigned_at) WHERE finished_at IS NULL"
+        )
+    if not await index_exists(db, "idx_review_assignments_pid"):
+        await db.execute("CREATE INDEX idx_review_assignments_pid ON review_assignments(pid, finished_at)")
+    if not await index_exists(db, "idx_review_assignments_finished"):
+        await db.execute("CREATE INDEX idx_review_assignments_finished ON review_assignments(finished_at)")
+    await db.commit()
+
+
+async def migrate_broadcasts(db: aiosqlite.Connection) -> None:
+    # рассылки с курсором: переживают рестарт, можно ставить на паузу/отменять
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          template TEXT NOT NULL,
+          segment TEXT,
+          status TEXT NOT NULL,
+          cursor_id INTEGER DEFAULT 0,
+          sent INTEGER DEFAULT 0,
+          failed INTEGER DEFAULT 0,
+          total INTEGER DEFAULT 0,
+          admin_chat_id INTEGER,
+          progress_message_id INTEGER,
+          created_by INTEGER,
+          created_at TEXT,
+          updated_at TEXT,
+          finished_at TEXT
+        );
+        """
+    )
+    if not await column_exists(db, "broadcasts", "segment"):
+        await db.execute("ALTER TABLE broadcasts ADD COLUMN segment TEXT")
+    if not await index_exists(db, "idx_broadcasts_status"):
+        await db.execute("CREATE INDEX idx_broadcasts_status ON broadcasts(status)")
+    await db.commit()
+
+
+async def migrate_segment_indexes(db: aiosqlite.Connection) -> None:
+    # индексы под фильтры аудиторий (bot/services/segments.py);
+    # колонки могли добавить другие миграции — создаём индекс, только если колонка есть
+    indexes = [
+        ("idx_students_approved", "students", "approved", "students(approved, onboarding_done)"),
+        ("idx_students_last_seen", "students", "last_seen", "students(last_seen)"),
+        ("idx_students_rank_points", "students", "rank_points", "students(rank_points)"),
+        ("idx_payments_course_student", "payments", "course_code", "payments(course_code, student_id)"),
+        ("idx_progress_student_lesson", "progress", "lesson_code", "progress(student_id, lesson_code)"),
+    ]
+    for name, table, column, target in indexes:
+        if await column_exists(db, table, column) and not await index_exists(db, name):
+            await db.execute(f"CREATE INDEX {name} ON {target}")
+    await db.commit()
+
+
+# Счётчики админ-панели: триггеры меняют их на каждом переходе статуса,
+# bot/services/counters.py: reconcile() периодически сверяет с таблицами.
+_PROGRESS_ACTIVE = "IN ('sent','returned','submitted')"
+_STUDENT_ONB_PENDING = "(COALESCE({r}.onboarding_done,0)=1 AND COALESCE({r}.approved,0)=0)"
+_NOW_ISO = "strftime('%Y-%m-%dT%H:%M:%SZ','now')"
+
+COUNTER_TRIGGERS = {
+    # --- progress: queue / active / дневная корзина approved ---
+    "trg_cnt_progress_ins": f"""
+        AFTER INSERT ON progress BEGIN
+          UPDATE counters SET value = value + (NEW.status IS 'submitted') WHERE name='queue';
+          UPDATE counters SET value = value + (COALESCE(NEW.status,'') {_PROGRESS_ACTIVE}) WHERE name='active';
+        END""",
+    "trg_cnt_progress_upd": f"""
+        AFTER UPDATE OF status ON progress WHEN OLD.status IS NOT NEW.status BEGIN
+          UPDATE counters SET value = value + (NEW.status IS 'submitted') - (OLD.status IS 'submitted')
+            WHERE name='queue';
+          UPDATE counters SET value = value + (COALESCE(NEW.status,'') {_PROGRESS_ACTIVE})
+                                            - (COALESCE(OLD.status,'') {_PROGRESS_ACTIVE})
+            WHERE name='active';
+          INSERT INTO counters_daily(name, day, value)
+            SELECT 'approved', substr(COALESCE(NEW.approved_at, {_NOW_ISO}),1,10), 1 WHERE NEW.status='approved'
+            ON CONFLICT(name, day) DO UPDATE SET value = value + 1;
+          UPDATE counters_daily SET value = value - 1
+            WHERE OLD.status='approved' AND name='approved' AND day = substr(OLD.approved_at,1,10);
+        END""",
+    "trg_cnt_progress_del": f"""
+        AFTER DELETE ON progress BEGIN
+          UPDATE counters SET value = value - (OLD.status IS 'submitted') WHERE name='queue';
+          UPDATE counters SET value = value - (COALESCE(OLD.status,'') {_PROGRESS_ACTIVE}) WHERE name='active';
+          UPDATE counters_daily SET value = value - 1
+            WHERE OLD.status='approved' AND name='approved' AND day = substr(OLD.approved_at,1,10);
+        END""",
+    # --- students: всего / анкеты на модерации ---
+    "trg_cnt_students_ins": f"""
+        AFTER INSERT ON students BEGIN
+          UPDATE counters SET value = value + 1 WHERE name='students_total';
+          UPDATE counters SET value = value + {_STUDENT_ONB_PENDING.format(r="NEW")} WHERE name='onb_pending';
+        END""",
+    "trg_cnt_students_upd": f"""
+        AFTER UPDATE OF onboarding_done, approved ON students BEGIN
+          UPDATE counters SET value = value + {_STUDENT_ONB_PENDING.format(r="NEW")}
+                                            - {_STUDENT_ONB_PENDING.format(r="OLD")}
+            WHERE name='onb_pending';
+        END""",
+    "trg_cnt_students_del": f"""
+        AFTER DELETE ON students BEGIN
+          UPDATE counters SET value = value - 1 WHERE name='students_total';
+          UPDATE counters SET value = value - {_STUDENT_ONB_PENDING.format(r="OLD")} WHERE name='onb_pending';
+        END""",
+    # --- payment_requests: заявки в ожидании ---
+    "trg_cnt_payreq_ins": """
+        AFTER INSERT ON payment_requests BEGIN
+          UPDATE counters SET value = value + (NEW.status IS 'pending') WHERE name='pay_pending';
+        END""",
+    "trg_cnt_payreq_upd": """
+        AFTER UPDATE OF status ON payment_requests BEGIN
+          UPDATE counters SET value = value + (NEW.status IS 'pending') - (OLD.status IS 'pending')
+            WHERE name='pay_pending';
+        END""",
+    "trg_cnt_payreq_del": """
+        AFTER DELETE ON payment_requests BEGIN
+          UPDATE counters SET value = value - (OLD.status IS 'pending') WHERE name='pay_pending';
+        END""",
+    # --- payments: дневная корзина суммы ---
+    "trg_cnt_payments_ins": """
+        AFTER INSERT ON payments WHEN NEW.paid_at IS NOT NULL BEGIN
+          INSERT INTO counters_daily(name, day, value) VALUES('payments_sum', substr(NEW.paid_at,1,10), NEW.amount)
+            ON CONFLICT(name, day) DO UPDATE SET value = value + excluded.value;
+        END""",
+    "trg_cnt_payments_del": """
+        AFTER DELETE ON payments WHEN OLD.paid_at IS NOT NULL BEGIN
+          UPDATE counters_daily SET value = value - OLD.amount
+            WHERE name='payments_sum' AND day = substr(OLD.paid_at,1,10);
+        END""",
+}
+
+
+async def migrate_counters(db: aiosqlite.Connection) -> None:
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS counters(
+          name TEXT PRIMARY KEY,
+          value INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS counters_daily(
+          name TEXT NOT NULL,
+          day TEXT NOT NULL,
+          value INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY(name, day)
+        );
+        """
+    )
+    for name, body in COUNTER_TRIGGERS.items():
+        await db.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    # стартовые значения — теми же запросами, что и периодическая сверка
+    from bot.services.counters import COUNTER_QUERIES, DAILY_QUERIES
+    for name, sql in COUNTER_QUERIES.items():
+        cur = await db.execute(sql)
+        value = (await cur.fetchone())[0]
+        await db.execute(
+            "INSERT INTO counters(name, value) VALUES(?,?) ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+            (name, value),
+        )
+    await db.execute("DELETE FROM counters_daily")
+    for name, sql in DAILY_QUERIES.items():
+        cur = await db.execute(sql)
+        await db.executemany(
+            "INSERT INTO counters_daily(name, day, value) VALUES(?,?,?)",
+            [(name, day, value) for day, value in await cur.fetchall() if day],
+        )
+    await db.commit()
+
+
+# Дневные агрегаты (bot/services/rollups.py). Момент анкеты/одобрения пишет триггер,
+# а изменения дат помечают дни в rollup_dirty — пересчитываются только они.
+STUDENT_STAGE_TRIGGER = f"""
+    AFTER UPDATE OF onboarding_done, approved ON students BEGIN
+      UPDATE students SET
+        onboarded_at = CASE
+          WHEN COALESCE(NEW.onboarding_done,0)=0 THEN NULL
+          WHEN COALESCE(OLD.onboarding_done,0)=0 THEN {_NOW_ISO}
+          ELSE onboarded_at END,
+        approved_at = CASE
+          WHEN COALESCE(NEW.approved,0)=0 THEN NULL
+          WHEN COALESCE(OLD.approved,0)=0 THEN {_NOW_ISO}
+          ELSE approved_at END
+      WHERE id = NEW.id;
+    END"""
+
+
+def _dirty_days_sql(cols: tuple[str, ...], *refs: str) -> str:
+    days = " UNION ".join(f"SELECT substr({r}.{c},1,10) AS d" for r in refs for c in cols)
+    return f"INSERT OR IGNORE INTO rollup_dirty(day) SELECT d FROM ({days}) WHERE d IS NOT NULL AND d <> '';"
+
+
+async def migrate_rollups(db: aiosqlite.Connection) -> None:
+    from bot.services.rollups import ROLLUP_SOURCES
+
+    for name in ("onboarded_at", "approved_at"):
+        if not await column_exists(db, "students", name):
+            await db.execute(f"ALTER TABLE students ADD COLUMN {name} TEXT")
+            # до миграции момента не знали — берём последнее изменение анкеты
+            flag = "onboarding_done" if name == "onboarded_at" else "approved"
+            await db.execute(
+                f"UPDATE students SET {name} = COALESCE(NULLIF(updated_at,''), NULLIF(created_at,'')) "
+                f"WHERE COALESCE({flag},0)=1"
+            )
+    await db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_students_stage_at {STUDENT_STAGE_TRIGGER}")
+
+    fresh = not await table_exists(db, "rollup_daily")
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rollup_daily(
+          day TEXT NOT NULL,
+          course TEXT NOT NULL DEFAULT '',
+          metric TEXT NOT NULL,
+          value INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY(day, course, metric)
+        );
+        """
+    )
+    await db.execute("CREATE TABLE IF NOT EXISTS rollup_dirty(day TEXT PRIMARY KEY)")
+
+    for table, (dates, extra) in ROLLUP_SOURCES.items():
+        if not await table_exists(db, table):
+            continue
+        watched = ", ".join(dates + extra)
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_rollup_{table}_ins AFTER INSERT ON {table} "
+            f"BEGIN {_dirty_days_sql(dates, 'NEW')} END"
+        )
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_rollup_{table}_upd AFTER UPDATE OF {watched} ON {table} "
+            f"BEGIN {_dirty_days_sql(dates, 'NEW', 'OLD')} END"
+        )
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_rollup_{table}_del AFTER DELETE ON {table} "
+            f"BEGIN {_dirty_days_sql(dates, 'OLD')} END"
+        )
+        # пересчёт дня идёт диапазоном по дате — нужен индекс на каждой колонке-дате
+        for col in dates:
+            index = f"idx_{table}_{col}"
+            if not await index_exists(db, index):
+                await db.execute(f"CREATE INDEX {index} ON {table}({col})")
+        if fresh:
+            # первый запуск: все дни с данными — в очередь, rollup_loop догонит порциями
+            for col in dates:
+                await db.execute(
+                    f"INSERT OR IGNORE INTO rollup_dirty(day) SELECT DISTINCT substr({col},1,10) FROM {table} "
+                    f"WHERE {col} IS NOT NULL AND {col} <> ''"
+                )
+    await db.commit()
+
+
+# Воронка (bot/services/funnel.py): строки по ученику пересобираются только для помеченных
+FUNNEL_SOURCES = {
+    "progress": ("student_id", "student_id, lesson_code, status, sent_at, approved_at"),
+    "payments": ("student_id", "student_id, course_code, paid_at"),
+    "students": ("id", "created_at, onboarded_at, approved_at"),
+}
+
+
+async def migrate_funnel(db: aiosqlite.Connection) -> None:
+    fresh = not await table_exists(db, "funnel_students")
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS funnel_students(
+          student_id INTEGER PRIMARY KEY,
+          cohort TEXT,
+          signup_at TEXT,
+          onboarded_at TEXT,
+          approved_at TEXT
+        );
+        """
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS funnel_lessons(
+          student_id INTEGER NOT NULL,
+          course TEXT NOT NULL,
+          first_sent_at TEXT,
+          max_lesson INTEGER NOT NULL DEFAULT 0,
+          free_done_at TEXT,
+          paid_at TEXT,
+          PRIMARY KEY(student_id, course)
+        );
+        """
+    )
+    await db.execute("CREATE TABLE IF NOT EXISTS funnel_dirty(student_id INTEGER PRIMARY KEY)")
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_cache(
+          name TEXT PRIMARY KEY,
+          text TEXT NOT NULL,
+          built_at TEXT NOT NULL
+        );
+        """
+    )
+    for table, (key, watched) in FUNNEL_SOURCES.items():
+        mark = "INSERT OR IGNORE INTO funnel_dirty(student_id) SELECT {r}.%s WHERE {r}.%s IS NOT NULL;" % (key, key)
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_funnel_{table}_ins AFTER INSERT ON {table} "
+            f"BEGIN {mark.format(r='NEW')} END"
+        )
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_funnel_{table}_upd AFTER UPDATE OF {watched} ON {table} "
+            f"BEGIN {mark.format(r='NEW')} {mark.format(r='OLD')} END"
+        )
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_funnel_{table}_del AFTER DELETE ON {table} "
+            f"BEGIN {mark.format(r='OLD')} END"
+        )
+    if fresh:
+        await db.execute("INSERT OR IGNORE INTO funnel_dirty(student_id) SELECT id FROM students")
+    await db.commit()
+
+
+# Полнотекстовый поиск учеников для /find (bot/services/student_search.py).
+# Своя копия полей (не external content): телефон храним только цифрами, двумя токенами —
+# целиком и последние 10 цифр (без кода страны), чтобы «777123» находил «+7 777 123…».
+_FTS_DIGITS = "replace(replace(replace(replace(replace(COALESCE({r}.phone,''),' ',''),'-',''),'(',''),')',''),'+','')"
+_FTS_PHONE = f"{_FTS_DIGITS} || ' ' || substr({_FTS_DIGITS}, -10)"
+_FTS_COLS = "first_name, last_name, username, phone, goal"
+
+
+def _fts_values(r: str) -> str:
+    return (f"COALESCE({r}.first_name,''), COALESCE({r}.last_name,''), COALESCE({r}.username,''), "
+            f"{_FTS_PHONE.format(r=r)}, COALESCE({r}.goal,'')")
+
+
+async def migrate_students_fts(db: aiosqlite.Connection) -> None:
+    created = not await table_exists(db, "students_fts")
+    if created:
+        await db.execute(
+            f"CREATE VIRTUAL TABLE students_fts USING fts5({_FTS_COLS}, "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    triggers = {
+        "trg_students_fts_ins": f"""
+            AFTER INSERT ON students BEGIN
+              INSERT INTO students_fts(rowid, {_FTS_COLS}) VALUES(NEW.id, {_fts_values("NEW")});
+            END""",
+        "trg_students_fts_del": """
+            AFTER DELETE ON students BEGIN
+              DELETE FROM students_fts WHERE rowid = OLD.id;
+            END""",
+        # только поля поиска: last_seen/updated_at меняются постоянно и индекс не трогают
+        "trg_students_fts_upd": f"""
+            AFTER UPDATE OF {_FTS_COLS} ON students BEGIN
+              DELETE FROM students_fts WHERE rowid = OLD.id;
+              INSERT INTO students_fts(rowid, {_FTS_COLS}) VALUES(NEW.id, {_fts_values("NEW")});
+            END""",
+    }
+    # триггеры старого формата (телефон одним токеном) — пересоздаём и переиндексируем
+    cur = await db.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='trg_students_fts_ins'")
+    row = await cur.fetchone()
+    stale = bool(row) and "substr(" not in row[0]
+    if stale:
+        for name in triggers:
+            await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+        await db.execute("DELETE FROM students_fts")
+    for name, body in triggers.items():
+        await db.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    if created or stale:
+        await db.execute(
+            f"INSERT INTO students_fts(rowid, {_FTS_COLS}) SELECT s.id, {_fts_values('s')} FROM students s"
+        )
     await db.commit()
 
 
@@ -235,6 +782,17 @@ async def migrate():
         await migrate_payments(db)
         await migrate_payment_requests(db)
         await migrate_points(db)
+        await migrate_test_results(db)
+        await migrate_outbox(db)
+        await migrate_worker_leases(db)
+        await migrate_admin_cards(db)
+        await migrate_review_assignments(db)
+        await migrate_broadcasts(db)
+        await migrate_segment_indexes(db)
+        await migrate_counters(db)
+        await migrate_students_fts(db)
+        await migrate_rollups(db)
+        await migrate_funnel(db)
         await migrate_views(db)
 
     print("[OK] Миграция завершена успешно.")